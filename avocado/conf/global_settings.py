@@ -92,6 +92,10 @@ QUERY_PROCESSORS = {
     'default': 'avocado.query.pipeline.QueryProcessor',
 }
 
+# Number of rows fetched at a time when streaming query results. On
+# PostgreSQL, this is the `itersize` of the server-side cursor.
+QUERY_STREAM_ITERSIZE = 2000
+
 # Custom validation error and warnings messages
 VALIDATION_ERRORS = {}
 VALIDATION_WARNINGS = {}
@@ -99,3 +103,24 @@ VALIDATION_WARNINGS = {}
 # Toggle whether DataField instances should cache the underlying data
 # for their most common data access methods.
 DATA_CACHE_ENABLED = True
+
+# Directory the finished export files are cached in, see
+# `avocado.query.exports`. Set to `None` to disable the export cache.
+EXPORT_CACHE_DIR = None
+
+# The maximum total size in bytes of the cached export files. The least
+# recently used files are removed once the limit is exceeded.
+EXPORT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+# Export jobs, see `avocado.query.jobs`. The class path of the store the
+# jobs are kept in.
+EXPORT_JOB_STORE = 'avocado.query.jobs.DatabaseJobStore'
+
+# The number of workers running export jobs and whether the workers are
+# threads ('thread') or processes ('process').
+EXPORT_JOB_WORKERS = 2
+EXPORT_JOB_POOL = 'thread'
+
+# Directory the files of the export jobs are written to. If None, a
+# directory in the system's temporary directory is used.
+EXPORT_JOB_DIR = None
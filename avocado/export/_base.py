@@ -1,6 +1,130 @@
-from avocado.models import DataConcept, DataView
-from avocado.formatters import Formatter
+import os
+import shutil
+import sqlite3
+import tempfile
+import cPickle as pickle
+from zipfile import ZipFile, ZIP_STORED
+from avocado.models import DataConcept, DataConceptField, DataView
+from avocado.formatters import Formatter, registry as formatters
 from cStringIO import StringIO
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+# Modes of `force_distinct` in addition to true and false
+SORTED = 'sorted'
+DISK = 'disk'
+
+
+class MemoryDistinct(object):
+    "Exact distinct which keeps every row seen in memory."
+    def __init__(self):
+        self.rows = set()
+
+    def seen(self, row):
+        if row in self.rows:
+            return True
+        self.rows.add(row)
+        return False
+
+    def close(self):
+        self.rows = None
+
+
+class SortedDistinct(object):
+    """Distinct for rows where duplicates are consecutive, e.g. the rows
+    are sorted by all columns. Only the previous row is kept.
+    """
+    def __init__(self):
+        self.previous = None
+
+    def seen(self, row):
+        if row == self.previous:
+            return True
+        self.previous = row
+        return False
+
+    def close(self):
+        self.previous = None
+
+
+class DiskDistinct(object):
+    """Exact distinct which keeps the rows seen in a temporary SQLite
+    database, so the memory used is independent of the number of rows.
+    """
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+        self.db = sqlite3.connect(self.path)
+        # The database is discarded afterwards, so durability is irrelevant
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('CREATE TABLE rows (row BLOB PRIMARY KEY)')
+
+    def seen(self, row):
+        data = sqlite3.Binary(pickle.dumps(row, pickle.HIGHEST_PROTOCOL))
+        cursor = self.db.execute('INSERT OR IGNORE INTO rows VALUES (?)',
+                                 (data,))
+        return cursor.rowcount == 0
+
+    def close(self):
+        self.db.close()
+        os.remove(self.path)
+
+
+DISTINCT_MODES = {
+    True: MemoryDistinct,
+    SORTED: SortedDistinct,
+    DISK: DiskDistinct,
+}
+
+
+def chunked(parts, chunk_size):
+    """Joins the strings produced by `parts` into chunks of at least
+    `chunk_size` bytes, except for the last one.
+    """
+    chunk = []
+    size = 0
+
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _formats_batches(formatter):
+    """Returns true if `formatter` formats a batch of rows the same as it
+    formats each row. Formatters that override `__call__` without also
+    overriding `format_batch_tuples` customize how rows are formatted,
+    so the batch method would bypass their override.
+    """
+    for klass in type(formatter).__mro__:
+        if 'format_batch_tuples' in vars(klass):
+            return True
+        if '__call__' in vars(klass):
+            return False
+    return False
+
+
+class FormattedRows(object):
+    """Wraps an iterable of rows that are formatted already, i.e. rows
+    produced by `BaseExporter.read_tuples()`. Exporters write these rows
+    as is, which allows formatting rows separately from writing them.
+    """
+    def __init__(self, iterable):
+        self.iterable = iterable
+
+    def __iter__(self):
+        return iter(self.iterable)
 
 
 class BaseExporter(object):
@@ -9,28 +133,75 @@ class BaseExporter(object):
     content_type = 'text/plain'
     preferred_formats = []
 
+    # The number of rows that are formatted together
+    batch_size = 1000
+
+    # The representation of the field data to select for every concept. If
+    # not set, the representation expected by each concept's formatter is
+    # used.
+    representation = None
+
     def __init__(self, concepts=None):
         if concepts is None:
             concepts = ()
         elif isinstance(concepts, DataView):
             node = concepts.parse()
             concepts = node.get_concepts_for_select()
+        else:
+            concepts = list(concepts)
 
         self.params = []
         self.row_length = 0
         self.concepts = concepts
+        self._slices = None
+
+        # The fields of all concepts are loaded together rather than by
+        # each concept's formatter
+        concept_fields = DataConceptField.objects.get_for_concepts(
+            [c.pk for c in concepts if c.pk is not None])
 
         for concept in concepts:
-            self.add_formatter(concept)
+            fields = None
+
+            if concept.pk in concept_fields:
+                fields = concept_fields[concept.pk][1]
+
+            self.add_formatter(concept, fields=fields)
 
     def __repr__(self):
         return u'<{0}: {1}/{2}>'.format(self.__class__.__name__,
                                         len(self.params), self.row_length)
 
-    def add_formatter(self, formatter, length=None, index=None):
+    def get_representations(self):
+        """Returns a dict of the representation of the field data to select
+        for each concept by concept id.
+        """
+        representations = {}
+
+        for concept in self.concepts:
+            if self.representation:
+                representation = self.representation
+            else:
+                representation = \
+                    formatters.get(concept.formatter_name).representation
+            representations[concept.pk] = representation
+
+        return representations
+
+    def add_formatter(self, formatter, length=None, index=None,
+                      fields=None):
+        """Adds a formatter for the next `length` values of the rows, or at
+        `index` if given. `formatter` can be a concept, a formatter or a
+        callable. The `fields` of a concept can be supplied if already
+        loaded.
+        """
         if isinstance(formatter, DataConcept):
-            length = formatter.concept_fields.count()
-            formatter = formatter.format
+            if fields is None:
+                fields = formatter.fields\
+                    .order_by('concept_fields__order')
+            fields = list(fields)
+            length = len(fields)
+            formatter = formatter.get_formatter(fields=fields)
         elif isinstance(formatter, Formatter):
             length = len(formatter.keys)
         elif length is None:
@@ -39,12 +210,25 @@ class BaseExporter(object):
 
         params = (formatter, length)
         self.row_length += length
+        self._slices = None
 
         if index is not None:
             self.params.insert(index, params)
         else:
             self.params.append(params)
 
+    def _get_slices(self):
+        "Returns the formatters with the start and end position in the row."
+        if self._slices is None:
+            self._slices = []
+            start = 0
+
+            for formatter, length in self.params:
+                self._slices.append((formatter, start, start + length))
+                start += length
+
+        return self._slices
+
     def get_file_obj(self, name=None):
         if name is None:
             return StringIO()
@@ -52,49 +236,147 @@ class BaseExporter(object):
             return open(name, 'w+')
         return name
 
-    def _format_row(self, row, **kwargs):
-        for formatter, length in self.params:
-            values, row = row[:length], row[length:]
-            yield formatter(values, preferred_formats=self.preferred_formats,
-                            **kwargs)
+    def get_zip_file(self, buff=None, compression=ZIP_STORED):
+        """Returns a `ZipFile` for writing to the file object for `buff`
+        using `compression` for the entries.
+
+        Entries written from files require seeking in the output, so for
+        outputs that cannot seek, e.g. responses, the zip file is written
+        to a temporary file. It is copied to the output by
+        `close_zip_file()`.
+        """
+        buff = self.get_file_obj(buff)
+
+        if hasattr(buff, 'seek'):
+            return ZipFile(buff, 'w', compression)
+
+        zip_file = ZipFile(tempfile.TemporaryFile(), 'w', compression)
+        zip_file.output = buff
+        return zip_file
+
+    def close_zip_file(self, zip_file):
+        "Closes a zip file returned by `get_zip_file()`."
+        # The file object is detached from the zip file when it is closed
+        fp = zip_file.fp
+        zip_file.close()
+
+        output = getattr(zip_file, 'output', None)
 
-    def read(self, iterable, force_distinct=True, offset=None, limit=None,
-             *args, **kwargs):
+        if output is not None:
+            fp.seek(0)
+            shutil.copyfileobj(fp, output)
+            fp.close()
+
+    def _format_batch(self, rows, **kwargs):
+        """Formats a batch of rows and returns a list of the formatted
+        sections for each row. Each section is a pair of the keys and the
+        formatted values. Formatters supporting `format_batch_tuples` format
+        their slice of all rows at once, see `_formats_batches()`.
+        """
+        sections = []
+
+        for formatter, start, end in self._get_slices():
+            values = [row[start:end] for row in rows]
+
+            if _formats_batches(formatter):
+                section = formatter.format_batch_tuples(
+                    values, preferred_formats=self.preferred_formats,
+                    **kwargs)
+            else:
+                section = []
+
+                for x in values:
+                    data = formatter(x,
+                                     preferred_formats=self.preferred_formats,
+                                     **kwargs)
+                    section.append((tuple(data.keys()),
+                                    tuple(data.values())))
+
+            sections.append(section)
+
+        return zip(*sections) if sections else [()] * len(rows)
+
+    def read(self, iterable, *args, **kwargs):
+        """Takes an iterable that produces rows to be formatted. For each row
+        a list of the formatted sections, one OrderedDict per formatter, is
+        produced. See `read_tuples` for the supported options.
+        """
+        for sections in self.read_tuples(iterable, *args, **kwargs):
+            yield [OrderedDict(zip(keys, values))
+                   for keys, values in sections]
+
+    def read_tuples(self, iterable, force_distinct=True, offset=None,
+                    limit=None, *args, **kwargs):
         """Takes an iterable that produces rows to be formatted.
 
-        If `force_distinct` is true, rows will be filtered based on the slice
-        of the row that is going to be formatted.
+        If `force_distinct` is set, rows will be filtered based on the slice
+        of the row that is going to be formatted. If true, the rows seen are
+        kept in memory. If 'sorted', only consecutive duplicates are removed
+        which is exact for rows that are sorted by the formatted columns.
+        If 'disk', the rows seen are kept in a temporary database on disk.
+        `force_distinct` should be false if the rows are known to be
+        distinct, e.g. by using DISTINCT in SQL.
 
         If `offset` is defined, only rows that are produced after the offset
-        index are returned.
+        index are returned. Duplicate rows that are filtered out do not
+        count towards the offset.
 
         If `limit` is defined, once the limit has been reached (or the
         iterator is exhausted), the loop will exit.
+
+        The rows are formatted in batches of `batch_size` rows. For each row
+        a sequence of the formatted sections, one per formatter, is produced.
+        Each section is a pair of the tuple of keys and the tuple of values.
         """
+        if force_distinct and force_distinct not in DISTINCT_MODES:
+            raise ValueError(u'"{0}" is not a valid distinct mode'
+                             .format(force_distinct))
+
+        # The options have been applied when the rows were formatted
+        if isinstance(iterable, FormattedRows):
+            for sections in iterable:
+                yield sections
+            return
+
+        i = 0
         emitted = 0
-        unique_rows = set()
+        distinct = force_distinct and DISTINCT_MODES[force_distinct]()
 
-        for i, row in enumerate(iterable):
-            if limit is not None and emitted >= limit:
-                break
+        # Rows are formatted in batches of `batch_size`
+        batch = []
 
-            _row = row[:self.row_length]
+        try:
+            for row in iterable:
+                if limit is not None and emitted >= limit:
+                    break
 
-            if force_distinct:
-                _row_hash = hash(tuple(_row))
+                _row = tuple(row[:self.row_length])
 
-                if _row_hash in unique_rows:
+                if distinct and distinct.seen(_row):
                     continue
 
-                unique_rows.add(_row_hash)
+                # The offset is relative to the distinct rows to be
+                # consistent with an OFFSET applied to distinct rows in SQL
+                if offset is None or i >= offset:
+                    emitted += 1
+                    batch.append(_row)
+
+                    if len(batch) >= self.batch_size:
+                        for sections in self._format_batch(batch, **kwargs):
+                            yield sections
+                        batch = []
+
+                i += 1
+        finally:
+            if distinct:
+                distinct.close()
 
-            if offset is None or i >= offset:
-                emitted += 1
-                yield self._format_row(_row, **kwargs)
+        for sections in self._format_batch(batch, **kwargs):
+            yield sections
 
     def write(self, iterable, *args, **kwargs):
-        for row_gen in self.read(iterable, *args, **kwargs):
+        for sections in self.read_tuples(iterable, *args, **kwargs):
             row = []
-            for data in row_gen:
-                row.extend(data.values())
+            for keys, values in sections:
+                row.extend(values)
             yield tuple(row)
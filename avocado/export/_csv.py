@@ -1,4 +1,7 @@
+import os
 import csv
+import tempfile
+from cStringIO import StringIO
 from _base import BaseExporter
 
 
@@ -11,18 +14,66 @@ class CSVExporter(BaseExporter):
 
     preferred_formats = ('csv', 'number', 'string')
 
-    def write(self, iterable, buff=None, *args, **kwargs):
-        header = []
-        buff = self.get_file_obj(buff)
-        writer = csv.writer(buff, quoting=csv.QUOTE_MINIMAL)
+    # The minimum size in bytes of the chunks produced by `stream()`
+    chunk_size = 64 * 1024
 
-        for i, row_gen in enumerate(self.read(iterable, *args, **kwargs)):
+    def _rows(self, iterable, *args, **kwargs):
+        "Yields the header followed by the rows to be written."
+        for i, sections in enumerate(self.read_tuples(iterable, *args,
+                                                      **kwargs)):
+            header = []
             row = []
-            for data in row_gen:
+            for keys, values in sections:
                 if i == 0:
-                    header.extend(data.keys())
-                row.extend(data.values())
+                    header.extend(keys)
+                row.extend(values)
             if i == 0:
-                writer.writerow(header)
+                yield header
+            yield row
+
+    def write(self, iterable, buff=None, *args, **kwargs):
+        buff = self.get_file_obj(buff)
+        writer = csv.writer(buff, quoting=csv.QUOTE_MINIMAL)
+
+        for row in self._rows(iterable, *args, **kwargs):
             writer.writerow(row)
         return buff
+
+    def stream(self, iterable, chunk_size=None, *args, **kwargs):
+        """Yields the encoded output in chunks as the rows are read, rather
+        than writing all of it to a buffer. Each chunk is at least
+        `chunk_size` bytes except for the last one. This is suitable for
+        a `StreamingHttpResponse`.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        buff = StringIO()
+        writer = csv.writer(buff, quoting=csv.QUOTE_MINIMAL)
+
+        for row in self._rows(iterable, *args, **kwargs):
+            writer.writerow(row)
+
+            if buff.tell() >= chunk_size:
+                yield buff.getvalue()
+                buff.seek(0)
+                buff.truncate()
+
+        if buff.tell():
+            yield buff.getvalue()
+
+    def write_to_zip(self, zip_file, arcname, iterable, *args, **kwargs):
+        """Writes the output to the `arcname` entry of `zip_file`.
+
+        The output is written to a temporary file which is then compressed
+        into the zip file in chunks, so the output is not held in memory.
+        """
+        fd, path = tempfile.mkstemp(suffix='.csv')
+
+        try:
+            with os.fdopen(fd, 'wb') as buff:
+                self.write(iterable, buff, *args, **kwargs)
+
+            zip_file.write(path, arcname)
+        finally:
+            os.remove(path)
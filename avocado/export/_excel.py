@@ -1,15 +1,150 @@
-from django.http import HttpResponse
-from django.core.exceptions import ImproperlyConfigured
-from avocado.conf import OPTIONAL_DEPS
-if not OPTIONAL_DEPS['openpyxl']:
-    raise ImproperlyConfigured('openpyxl must be installed to use this '
-                               'exporter.')
-
-from openpyxl import Workbook
+import os
+import re
+import tempfile
+from decimal import Decimal
+from datetime import date, datetime, time
+from zipfile import ZipFile, ZIP_DEFLATED
+from xml.sax.saxutils import escape, quoteattr
+from django.utils.encoding import force_unicode
 from _base import BaseExporter
 
+SPREADSHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/' \
+    'relationships'
+PACKAGE_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CONTENT_TYPES_NS = 'http://schemas.openxmlformats.org/package/2006/' \
+    'content-types'
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+MAIN_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.' \
+    'spreadsheetml.{0}+xml'
+
+# Characters that are not allowed in XML documents
+ILLEGAL_CHARACTERS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Excel stores dates as the number of days since this date
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# Indexes of the cell formats defined in the styles of the workbook
+DATE_STYLE = 1
+DATETIME_STYLE = 2
+TIME_STYLE = 3
+
+STYLES = (
+    '<styleSheet xmlns="{0}">'
+    '<numFmts count="1">'
+    '<numFmt numFmtId="164" formatCode="yyyy-mm-dd h:mm:ss"/>'
+    '</numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/>'
+    '</border></borders>'
+    '<cellStyleXfs count="1">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+    '</cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" '
+    'applyNumberFormat="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" '
+    'applyNumberFormat="1"/>'
+    '<xf numFmtId="21" fontId="0" fillId="0" borderId="0" xfId="0" '
+    'applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1">'
+    '<cellStyle name="Normal" xfId="0" builtinId="0"/>'
+    '</cellStyles>'
+    '</styleSheet>'
+).format(SPREADSHEET_NS)
+
+
+def column_letter(index):
+    "Returns the letters of the column at the zero-based `index`."
+    letters = ''
+    index += 1
+
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+
+    return letters
+
+
+def _serial(value):
+    "Returns the Excel serial number of a date, datetime or time."
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None)
+        delta = value - EXCEL_EPOCH
+        return delta.days + (delta.seconds +
+                             delta.microseconds / 1e6) / 86400.0
+
+    if isinstance(value, date):
+        return (value - EXCEL_EPOCH.date()).days
+
+    return (value.hour * 3600 + value.minute * 60 + value.second +
+            value.microsecond / 1e6) / 86400.0
+
+
+def _string_cell(ref, value):
+    value = ILLEGAL_CHARACTERS.sub(u'', value)
+
+    # Leading and trailing whitespace is dropped unless preserved
+    if value != value.strip():
+        text = u'<t xml:space="preserve">'
+    else:
+        text = u'<t>'
+
+    return u'<c r="{0}" t="inlineStr"><is>{1}{2}</t></is></c>'.format(
+        ref, text, escape(value))
+
+
+def encode_cell(ref, value):
+    "Returns the XML of the cell at `ref` for `value` or None if empty."
+    if value is None or value == u'':
+        return None
+
+    if isinstance(value, bool):
+        return u'<c r="{0}" t="b"><v>{1:d}</v></c>'.format(ref, value)
+
+    if isinstance(value, (int, long)):
+        return u'<c r="{0}"><v>{1:d}</v></c>'.format(ref, value)
+
+    if isinstance(value, float):
+        # NaN and infinity cannot be stored as numbers
+        if value != value or value in (float('inf'), float('-inf')):
+            return _string_cell(ref, repr(value))
+        return u'<c r="{0}"><v>{1!r}</v></c>'.format(ref, value)
+
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            return _string_cell(ref, unicode(value))
+        return u'<c r="{0}"><v>{1}</v></c>'.format(ref, value)
+
+    if isinstance(value, datetime):
+        style = DATETIME_STYLE
+    elif isinstance(value, date):
+        style = DATE_STYLE
+    elif isinstance(value, time):
+        style = TIME_STYLE
+    else:
+        return _string_cell(ref, force_unicode(value))
+
+    return u'<c r="{0}" s="{1}"><v>{2!r}</v></c>'.format(
+        ref, style, _serial(value))
+
 
 class ExcelExporter(BaseExporter):
+    """Writes the rows to the Data sheet of an Excel workbook and the
+    fields of the concepts to the Data Dictionary sheet.
+
+    The workbook is written natively. The XML of each sheet is written
+    incrementally to a temporary file which is compressed into the
+    workbook in chunks, so the rows are never held in memory.
+    """
     short_name = 'Excel'
     long_name = 'Microsoft Excel 2007 Format'
 
@@ -18,52 +153,161 @@ class ExcelExporter(BaseExporter):
 
     preferred_formats = ('excel', 'boolean', 'number', 'string')
 
+    # The size in bytes of the chunks yielded by `stream()`
+    chunk_size = 64 * 1024
+
+    sheets = ('Data', 'Data Dictionary')
+
+    def _data_rows(self, iterable, *args, **kwargs):
+        "Yields the header followed by the rows of the data sheet."
+        for i, sections in enumerate(self.read_tuples(iterable, *args,
+                                                      **kwargs)):
+            if i == 0:
+                yield [key for keys, values in sections for key in keys]
+
+            yield [value for keys, values in sections for value in values]
+
+    def _dictionary_rows(self):
+        """Yields the header followed by the fields of the concepts. The
+        fields were loaded with the formatters of the concepts.
+        """
+        yield ('Field Name', 'Data Type', 'Description', 'Concept Name',
+               'Concept Discription')
+
+        for formatter, length in self.params:
+            concept = getattr(formatter, 'concept', None)
+            fields = getattr(formatter, 'fields', None)
+
+            if concept is None or not fields:
+                continue
+
+            for field in fields.values():
+                yield (field.field_name, field.simple_type,
+                       field.description, concept.name, concept.description)
+
+    def write_sheet(self, zip_file, arcname, rows):
+        """Writes the XML of the worksheet for `rows` to the `arcname` entry
+        of `zip_file`. The XML is written to a temporary file first.
+        """
+        letters = []
+
+        fd, path = tempfile.mkstemp(suffix='.xml')
+
+        try:
+            with os.fdopen(fd, 'wb') as buff:
+                buff.write(XML_DECLARATION)
+                buff.write('<worksheet xmlns="{0}"><sheetData>'
+                           .format(SPREADSHEET_NS))
+
+                for i, row in enumerate(rows):
+                    while len(letters) < len(row):
+                        letters.append(column_letter(len(letters)))
+
+                    number = str(i + 1)
+                    cells = []
+
+                    for letter, value in zip(letters, row):
+                        cell = encode_cell(letter + number, value)
+
+                        if cell is not None:
+                            cells.append(cell)
+
+                    buff.write(u'<row r="{0}">{1}</row>'.format(
+                        number, u''.join(cells)).encode('utf-8'))
+
+                buff.write('</sheetData></worksheet>')
+
+            zip_file.write(path, arcname)
+        finally:
+            os.remove(path)
+
+    def write_workbook(self, zip_file, iterable, *args, **kwargs):
+        "Writes the parts of the workbook to `zip_file`."
+        sheets = []
+        relationships = []
+        overrides = [
+            ('/xl/workbook.xml', MAIN_CONTENT_TYPE.format('sheet.main')),
+            ('/xl/styles.xml', MAIN_CONTENT_TYPE.format('styles')),
+        ]
+
+        for i, name in enumerate(self.sheets):
+            sheets.append('<sheet name={0} sheetId="{1}" r:id="rId{1}"/>'
+                          .format(quoteattr(name), i + 1))
+            relationships.append(
+                ('rId{0}'.format(i + 1), 'worksheet',
+                 'worksheets/sheet{0}.xml'.format(i + 1)))
+            overrides.append(
+                ('/xl/worksheets/sheet{0}.xml'.format(i + 1),
+                 MAIN_CONTENT_TYPE.format('worksheet')))
+
+        relationships.append(('rId{0}'.format(len(sheets) + 1), 'styles',
+                              'styles.xml'))
+
+        self.write_sheet(zip_file, 'xl/worksheets/sheet1.xml',
+                         self._data_rows(iterable, *args, **kwargs))
+        self.write_sheet(zip_file, 'xl/worksheets/sheet2.xml',
+                         self._dictionary_rows())
+
+        zip_file.writestr('[Content_Types].xml', XML_DECLARATION + (
+            '<Types xmlns="{0}">'
+            '<Default Extension="rels" ContentType="application/'
+            'vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '{1}</Types>'
+        ).format(CONTENT_TYPES_NS, ''.join(
+            '<Override PartName="{0}" ContentType="{1}"/>'.format(*x)
+            for x in overrides)))
+
+        zip_file.writestr('_rels/.rels', XML_DECLARATION + (
+            '<Relationships xmlns="{0}">'
+            '<Relationship Id="rId1" Type="{1}/officeDocument" '
+            'Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ).format(PACKAGE_NS, RELATIONSHIPS_NS))
+
+        zip_file.writestr('xl/workbook.xml', XML_DECLARATION + (
+            '<workbook xmlns="{0}" xmlns:r="{1}">'
+            '<workbookPr/><sheets>{2}</sheets></workbook>'
+        ).format(SPREADSHEET_NS, RELATIONSHIPS_NS, ''.join(sheets)))
+
+        zip_file.writestr('xl/_rels/workbook.xml.rels', XML_DECLARATION + (
+            '<Relationships xmlns="{0}">{1}</Relationships>'
+        ).format(PACKAGE_NS, ''.join(
+            '<Relationship Id="{0}" Type="{1}/{2}" Target="{3}"/>'.format(
+                _id, RELATIONSHIPS_NS, _type, target)
+            for _id, _type, target in relationships)))
+
+        zip_file.writestr('xl/styles.xml', XML_DECLARATION + STYLES)
+
     def write(self, iterable, buff=None, *args, **kwargs):
         buff = self.get_file_obj(buff)
 
-        wb = Workbook(optimized_write=True)
-
-        ws_data = wb.create_sheet()
-        ws_data.title = 'Data'
-
-        header = []
-        # Create the data worksheet
-        for i, row_gen in enumerate(self.read(iterable, *args, **kwargs)):
-            row = []
-            for data in row_gen:
-                if i == 0:
-                    # Build up header row
-                    header.extend(data.keys())
-                # Add formatted section to the row
-                row.extend(data.values())
-            # Write headers on first iteration
-            if i == 0:
-                ws_data.append(header)
-            ws_data.append(row)
-
-        ws_dict = wb.create_sheet()
-        ws_dict.title = 'Data Dictionary'
-
-        # Create the Data Dictionary Worksheet
-        ws_dict.append(('Field Name', 'Data Type', 'Description',
-                        'Concept Name', 'Concept Discription'))
-
-        for c in self.concepts:
-            cfields = c.concept_fields.select_related('field')
-            for cfield in cfields:
-                field = cfield.field
-                ws_dict.append((field.field_name, field.simple_type,
-                                field.description, c.name, c.description))
-
-        # This hacked up implementation is due to `save_virtual_workbook`
-        # not behaving correctly. This function should handle the work
-        # https://bitbucket.org/ericgazoni/openpyxl/src/94b05cf9defb9787b4dfbf9e8dca7ba6e0b33d56/openpyxl/writer/excel.py?at=default#cl-154     # noqa
-        # however, no data is actually being saved to the worksheets..
-        if isinstance(buff, HttpResponse):
-            _buff = self.get_file_obj()
-            wb.save(_buff)
-            buff.content = _buff.getvalue()
-            _buff.close()
-        else:
-            wb.save(buff)
+        zip_file = self.get_zip_file(buff, compression=ZIP_DEFLATED)
+        self.write_workbook(zip_file, iterable, *args, **kwargs)
+        self.close_zip_file(zip_file)
+
         return buff
+
+    def stream(self, iterable, chunk_size=None, *args, **kwargs):
+        """Yields the workbook in chunks of `chunk_size` bytes, which is
+        suitable for a `StreamingHttpResponse`. The workbook is written to
+        a temporary file first since the end of a zip file refers back to
+        its entries.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        with tempfile.TemporaryFile() as buff:
+            zip_file = ZipFile(buff, 'w', ZIP_DEFLATED)
+            self.write_workbook(zip_file, iterable, *args, **kwargs)
+            zip_file.close()
+
+            buff.seek(0)
+
+            while True:
+                chunk = buff.read(chunk_size)
+
+                if not chunk:
+                    break
+
+                yield chunk
@@ -1,6 +1,6 @@
 import inspect
 from django.core.serializers.json import DjangoJSONEncoder
-from _base import BaseExporter
+from _base import BaseExporter, chunked
 
 
 class JSONGeneratorEncoder(DjangoJSONEncoder):
@@ -20,10 +20,75 @@ class JSONExporter(BaseExporter):
 
     preferred_formats = ('json', 'number', 'string')
 
+    # The minimum size in bytes of the chunks produced by `stream()`
+    chunk_size = 64 * 1024
+
+    def _encode_rows(self, iterable, *args, **kwargs):
+        """Yields each row encoded as a list of objects, one per formatted
+        section, with the keys in order.
+
+        The keys of each section are encoded once and the values are encoded
+        directly rather than building a mapping per section first. This uses
+        the C encoder for the values where available.
+        """
+        encode = JSONGeneratorEncoder().encode
+
+        # The encoded keys of each section by its keys
+        prefixes = {}
+
+        for sections in self.read_tuples(iterable, *args, **kwargs):
+            objects = []
+
+            for keys, values in sections:
+                if keys not in prefixes:
+                    prefixes[keys] = [encode(x) + ': ' for x in keys]
+
+                objects.append('{' + ', '.join([
+                    prefix + encode(value) for prefix, value
+                    in zip(prefixes[keys], values)]) + '}')
+
+            yield '[' + ', '.join(objects) + ']'
+
+    def _parts(self, iterable, *args, **kwargs):
+        "Yields the parts of the output in order."
+        yield '['
+
+        for i, row in enumerate(self._encode_rows(iterable, *args, **kwargs)):
+            if i > 0:
+                yield ', '
+            yield row
+
+        yield ']'
+
+    def stream(self, iterable, chunk_size=None, *args, **kwargs):
+        """Yields the encoded output in chunks as the rows are read. Each
+        chunk is at least `chunk_size` bytes except for the last one. This
+        is suitable for a `StreamingHttpResponse`.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        return chunked(self._parts(iterable, *args, **kwargs), chunk_size)
+
     def write(self, iterable, buff=None, *args, **kwargs):
         buff = self.get_file_obj(buff)
 
-        encoder = JSONGeneratorEncoder()
-        for chunk in encoder.iterencode(self.read(iterable, *args, **kwargs)):
+        for chunk in self.stream(iterable, None, *args, **kwargs):
             buff.write(chunk)
+
         return buff
+
+
+class NDJSONExporter(JSONExporter):
+    """Writes each row as a JSON array of the formatted sections on its own
+    line, so the output can be processed line by line.
+    """
+    short_name = 'NDJSON'
+    long_name = 'Newline Delimited JSON (NDJSON)'
+
+    file_extension = 'ndjson'
+    content_type = 'application/x-ndjson'
+
+    def _parts(self, iterable, *args, **kwargs):
+        for row in self._encode_rows(iterable, *args, **kwargs):
+            yield row + '\n'
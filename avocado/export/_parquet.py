@@ -0,0 +1,620 @@
+"""Exporter for the Apache Parquet columnar format.
+
+The file is written by a minimal pure-Python writer. Rows are buffered
+into row groups and each column of a row group is written as a single
+data page of PLAIN encoded values. The column types are derived from the
+fields of the concepts, so the data can be loaded with the types intact
+by pandas, R (arrow) and other Parquet readers. Columns with values that
+do not have the field's type are widened to doubles or strings.
+"""
+import os
+import json
+import zlib
+import struct
+import datetime
+import tempfile
+import cPickle as pickle
+from decimal import Decimal
+from django.utils import timezone
+from django.utils.encoding import force_unicode
+from avocado import get_version
+from _base import BaseExporter
+
+MAGIC = 'PAR1'
+
+# Thrift compact protocol types
+T_BOOLEAN_TRUE = 1
+T_BOOLEAN_FALSE = 2
+T_I32 = 5
+T_I64 = 6
+T_BINARY = 8
+T_LIST = 9
+T_STRUCT = 12
+
+# Parquet physical types
+BOOLEAN = 0
+INT32 = 1
+INT64 = 2
+DOUBLE = 5
+BYTE_ARRAY = 6
+
+# Parquet converted (logical) types
+UTF8 = 0
+DATE = 6
+TIME_MICROS = 8
+TIMESTAMP_MICROS = 10
+
+# Encodings, compression codecs and page types
+PLAIN = 0
+RLE = 3
+UNCOMPRESSED = 0
+GZIP = 2
+DATA_PAGE = 0
+
+# Repetition of the columns, all columns are nullable
+OPTIONAL = 1
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _varint(n):
+    data = []
+    while n > 0x7f:
+        data.append(chr((n & 0x7f) | 0x80))
+        n >>= 7
+    data.append(chr(n))
+    return ''.join(data)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _encode_value(_type, value):
+    if _type in (T_I32, T_I64):
+        return _varint(_zigzag(value))
+
+    if _type == T_BINARY:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return _varint(len(value)) + value
+
+    if _type == T_LIST:
+        item_type, items = value
+
+        if len(items) < 15:
+            header = chr(len(items) << 4 | item_type)
+        else:
+            header = chr(0xf0 | item_type) + _varint(len(items))
+
+        return header + ''.join([_encode_value(item_type, x) for x in items])
+
+    # Structs are encoded already
+    return value
+
+
+def encode_struct(fields):
+    """Encodes a struct with the Thrift compact protocol. `fields` is a list
+    of (id, type, value) in order of the field ids. Fields with a value of
+    `None` are omitted. The value of a list field is a pair of the item type
+    and the items and the value of a struct field is the encoded struct.
+    """
+    data = []
+    last = 0
+
+    for _id, _type, value in fields:
+        if value is None:
+            continue
+
+        if _type == T_BOOLEAN_TRUE:
+            _type = T_BOOLEAN_TRUE if value else T_BOOLEAN_FALSE
+
+        delta = _id - last
+
+        if 0 < delta <= 15:
+            data.append(chr(delta << 4 | _type))
+        else:
+            data.append(chr(_type) + _varint(_zigzag(_id)))
+
+        last = _id
+
+        if _type not in (T_BOOLEAN_TRUE, T_BOOLEAN_FALSE):
+            data.append(_encode_value(_type, value))
+
+    data.append('\x00')
+    return ''.join(data)
+
+
+def _to_boolean(value):
+    if not isinstance(value, bool):
+        raise TypeError
+    return value
+
+
+def _to_integer(value):
+    if isinstance(value, bool) or not isinstance(value, (int, long)):
+        raise TypeError
+    return value
+
+
+def _to_double(value):
+    if isinstance(value, bool) or \
+            not isinstance(value, (int, long, float, Decimal)):
+        raise TypeError
+    return float(value)
+
+
+def _to_string(value):
+    return force_unicode(value).encode('utf-8')
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime) or \
+            not isinstance(value, datetime.date):
+        raise TypeError
+    return (value - EPOCH.date()).days
+
+
+def _to_datetime(value):
+    if not isinstance(value, datetime.datetime):
+        raise TypeError
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+        delta.microseconds
+
+
+def _to_time(value):
+    if not isinstance(value, datetime.time):
+        raise TypeError
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * \
+        10 ** 6 + value.microsecond
+
+
+def _encode_booleans(values):
+    data = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value:
+            data[i // 8] |= 1 << (i % 8)
+    return str(data)
+
+
+def _pack(fmt):
+    def encode(values):
+        return struct.pack('<{0}{1}'.format(len(values), fmt), *values)
+    return encode
+
+
+def _encode_byte_arrays(values):
+    return ''.join([struct.pack('<i', len(x)) + x for x in values])
+
+
+# The column types by name with the physical type, the converted type,
+# the function converting a value to the physical value and the function
+# encoding a list of physical values
+COLUMN_TYPES = {
+    'boolean': (BOOLEAN, None, _to_boolean, _encode_booleans),
+    'integer': (INT64, None, _to_integer, _pack('q')),
+    'double': (DOUBLE, None, _to_double, _pack('d')),
+    'string': (BYTE_ARRAY, UTF8, _to_string, _encode_byte_arrays),
+    'date': (INT32, DATE, _to_date, _pack('i')),
+    'datetime': (INT64, TIMESTAMP_MICROS, _to_datetime, _pack('q')),
+    'time': (INT64, TIME_MICROS, _to_time, _pack('q')),
+}
+
+
+def get_column_type(field):
+    "Returns the column type for the data of `field`."
+    simple_type = field.simple_type
+
+    if simple_type == 'number':
+        if field.internal_type in ('decimal', 'float'):
+            return 'double'
+        return 'integer'
+
+    if simple_type == 'key':
+        return 'integer'
+
+    if simple_type in COLUMN_TYPES:
+        return simple_type
+
+    return 'string'
+
+
+def infer_column_type(values):
+    "Returns the column type for `values` based on the first non-null one."
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return 'boolean'
+        if isinstance(value, (int, long)):
+            return 'integer'
+        if isinstance(value, (float, Decimal)):
+            return 'double'
+        if isinstance(value, datetime.datetime):
+            return 'datetime'
+        if isinstance(value, datetime.date):
+            return 'date'
+        if isinstance(value, datetime.time):
+            return 'time'
+        break
+
+    return 'string'
+
+
+def convert_values(column_type, values):
+    """Converts the non-null `values` to the physical values of
+    `column_type`. A `ValueError` is raised if a value cannot be converted.
+    """
+    convert = COLUMN_TYPES[column_type][2]
+
+    try:
+        return [convert(x) for x in values if x is not None]
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(u'Values cannot be converted to {0}'
+                         .format(column_type))
+
+
+def widen_column_type(column_type, values):
+    """Returns `column_type` if the `values` can be converted to it,
+    otherwise the narrowest wider type they can be converted to. Integers
+    are widened to doubles and all other types to strings.
+    """
+    for _type in (column_type, 'double', 'string'):
+        if _type == 'double' and column_type not in ('integer', 'double'):
+            continue
+
+        try:
+            convert_values(_type, values)
+        except ValueError:
+            continue
+
+        return _type
+
+    return 'string'
+
+
+def _encode_levels(values):
+    "Encodes the definition levels of `values` as RLE runs."
+    runs = []
+    level = None
+    count = 0
+
+    for value in values:
+        _level = int(value is not None)
+
+        if _level != level:
+            if count:
+                runs.append(_varint(count << 1) + chr(level))
+            level = _level
+            count = 0
+
+        count += 1
+
+    if count:
+        runs.append(_varint(count << 1) + chr(level))
+
+    data = ''.join(runs)
+    return struct.pack('<i', len(data)) + data
+
+
+def _gzip(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParquetWriter(object):
+    """Writes a Parquet file to `fp` one row group at a time. `columns` is a
+    list of (name, column type) pairs, see `COLUMN_TYPES`.
+
+    Each column chunk is compressed with GZIP unless that does not reduce
+    its size, so the compression is chosen per column.
+    """
+    def __init__(self, fp, columns, compression_level=6):
+        self.fp = fp
+        self.columns = columns
+        self.compression_level = compression_level
+        self.row_groups = []
+        self.num_rows = 0
+        self.offset = 0
+
+        self._write(MAGIC)
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.offset += len(data)
+
+    def _write_column_chunk(self, name, column_type, values):
+        physical_type, converted_type, convert, encode = \
+            COLUMN_TYPES[column_type]
+
+        data = _encode_levels(values) + \
+            encode(convert_values(column_type, values))
+        compressed = _gzip(data, self.compression_level)
+
+        if len(compressed) < len(data):
+            codec = GZIP
+        else:
+            codec, compressed = UNCOMPRESSED, data
+
+        header = encode_struct([
+            (1, T_I32, DATA_PAGE),
+            (2, T_I32, len(data)),
+            (3, T_I32, len(compressed)),
+            (5, T_STRUCT, encode_struct([
+                (1, T_I32, len(values)),
+                (2, T_I32, PLAIN),
+                (3, T_I32, RLE),
+                (4, T_I32, RLE),
+            ])),
+        ])
+
+        offset = self.offset
+        self._write(header)
+        self._write(compressed)
+
+        uncompressed_size = len(header) + len(data)
+
+        metadata = encode_struct([
+            (1, T_I32, physical_type),
+            (2, T_LIST, (T_I32, [PLAIN, RLE])),
+            (3, T_LIST, (T_BINARY, [name])),
+            (4, T_I32, codec),
+            (5, T_I64, len(values)),
+            (6, T_I64, uncompressed_size),
+            (7, T_I64, len(header) + len(compressed)),
+            (9, T_I64, offset),
+        ])
+
+        chunk = encode_struct([
+            (2, T_I64, offset),
+            (3, T_STRUCT, metadata),
+        ])
+
+        return chunk, uncompressed_size
+
+    def write_row_group(self, columns):
+        """Writes a row group of the values of each column. The values must
+        be convertible to the type of the column.
+        """
+        num_rows = len(columns[0]) if columns else 0
+
+        if not num_rows:
+            return
+
+        chunks = []
+        size = 0
+
+        for (name, column_type), values in zip(self.columns, columns):
+            chunk, chunk_size = self._write_column_chunk(name, column_type,
+                                                         values)
+            chunks.append(chunk)
+            size += chunk_size
+
+        self.row_groups.append(encode_struct([
+            (1, T_LIST, (T_STRUCT, chunks)),
+            (2, T_I64, size),
+            (3, T_I64, num_rows),
+        ]))
+        self.num_rows += num_rows
+
+    def close(self):
+        "Writes the file metadata. The file object is not closed."
+        schema = [encode_struct([
+            (4, T_BINARY, 'schema'),
+            (5, T_I32, len(self.columns)),
+        ])]
+
+        for name, column_type in self.columns:
+            physical_type, converted_type = COLUMN_TYPES[column_type][:2]
+
+            schema.append(encode_struct([
+                (1, T_I32, physical_type),
+                (3, T_I32, OPTIONAL),
+                (4, T_BINARY, name),
+                (6, T_I32, converted_type),
+            ]))
+
+        footer = encode_struct([
+            (1, T_I32, 1),
+            (2, T_LIST, (T_STRUCT, schema)),
+            (3, T_I64, self.num_rows),
+            (4, T_LIST, (T_STRUCT, self.row_groups)),
+            (6, T_BINARY, u'avocado version {0}'.format(get_version())),
+        ])
+
+        self._write(footer)
+        self._write(struct.pack('<i', len(footer)))
+        self._write(MAGIC)
+
+
+def _unique_names(names):
+    "Suffixes repeated names with their occurrence to make them unique."
+    seen = {}
+    unique = []
+
+    for name in names:
+        if name in seen:
+            seen[name] += 1
+            name = u'{0}_{1}'.format(name, seen[name])
+        else:
+            seen[name] = 1
+        unique.append(name)
+
+    return unique
+
+
+class ParquetExporter(BaseExporter):
+    """Writes a zip file of the data as a Parquet file with typed columns
+    and a data dictionary of the columns as JSON.
+    """
+    short_name = 'Parquet'
+    long_name = 'Apache Parquet'
+
+    file_extension = 'zip'
+    content_type = 'application/zip'
+
+    preferred_formats = ('parquet',)
+
+    # The stored values are selected rather than labels so the columns
+    # have the type of the fields
+    representation = 'value'
+
+    # The number of rows written per row group
+    row_group_size = 10000
+
+    def _get_header(self, sections=None):
+        """Returns a list of (key, field, concept) for the columns. The keys
+        are taken from the formatted `sections` of a row if given, otherwise
+        from the formatters.
+        """
+        header = []
+
+        for i, (formatter, start, end) in enumerate(self._get_slices()):
+            fields = getattr(formatter, 'fields', None) or {}
+            concept = getattr(formatter, 'concept', None)
+
+            if sections is not None:
+                keys = sections[i][0]
+            else:
+                keys = getattr(formatter, 'keys', None) or ()
+
+            for key in keys:
+                header.append((key, fields.get(key), concept))
+
+        return header
+
+    def _get_column_types(self, header, columns):
+        """Returns the types of the columns of the first row group. The type
+        of columns without a field is inferred from the values, see
+        `widen_column_type()` for values that do not have the field's type.
+        """
+        types = []
+
+        for (key, field, concept), values in zip(header, columns):
+            column_type = 'string'
+
+            if field is not None:
+                column_type = get_column_type(field)
+            elif values:
+                column_type = infer_column_type(values)
+
+            types.append(widen_column_type(column_type, values))
+
+        return types
+
+    def _get_dictionary(self, header, columns):
+        "Returns the data dictionary of the columns."
+        dictionary = []
+
+        for (key, field, concept), (name, column_type) in zip(header,
+                                                              columns):
+            entry = {
+                'name': name,
+                'type': column_type,
+                'field': None,
+                'description': None,
+                'concept': None,
+                'concept_description': None,
+            }
+
+            if field is not None:
+                entry['field'] = u'.'.join(field.natural_key())
+                entry['description'] = field.description
+
+            if concept is not None:
+                entry['concept'] = concept.name
+                entry['concept_description'] = concept.description
+
+            dictionary.append(entry)
+
+        return dictionary
+
+    def _spool_row_group(self, spool, header, types, rows):
+        """Writes `rows` as a row group to the `spool` file and returns the
+        column types widened as needed for the values of the row group.
+        """
+        columns = zip(*rows) or [()] * len(header)
+
+        if types is None:
+            types = self._get_column_types(header, columns)
+        else:
+            types = [widen_column_type(column_type, values)
+                     for column_type, values in zip(types, columns)]
+
+        pickle.dump(columns, spool, pickle.HIGHEST_PROTOCOL)
+        return types
+
+    def _write_data(self, fp, iterable, *args, **kwargs):
+        """Writes the rows as a Parquet file to `fp` and returns the header
+        and the columns.
+
+        The types of the columns are only known once all rows have been
+        read since a later row group may require a wider type. The row
+        groups are spooled to a temporary file and written once all of
+        them are read, so only one row group is held in memory.
+        """
+        header = None
+        types = None
+        rows = []
+        groups = 0
+
+        with tempfile.TemporaryFile() as spool:
+            for sections in self.read_tuples(iterable, *args, **kwargs):
+                if header is None:
+                    header = self._get_header(sections)
+
+                row = []
+                for keys, values in sections:
+                    row.extend(values)
+
+                if len(row) != len(header):
+                    raise ValueError('All rows must have the same columns')
+
+                rows.append(row)
+
+                if len(rows) >= self.row_group_size:
+                    types = self._spool_row_group(spool, header, types, rows)
+                    groups += 1
+                    rows = []
+
+            if header is None:
+                header = self._get_header()
+
+            if rows or not groups:
+                types = self._spool_row_group(spool, header, types, rows)
+                groups += 1
+
+            names = _unique_names([key for key, field, concept in header])
+            writer = ParquetWriter(fp, zip(names, types))
+
+            spool.seek(0)
+            for i in range(groups):
+                writer.write_row_group(pickle.load(spool))
+
+        writer.close()
+
+        return header, writer.columns
+
+    def write(self, iterable, buff=None, *args, **kwargs):
+        zip_file = self.get_zip_file(buff)
+
+        fd, path = tempfile.mkstemp(suffix='.parquet')
+
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                header, columns = self._write_data(fp, iterable, *args,
+                                                   **kwargs)
+
+            zip_file.write(path, 'data.parquet')
+        finally:
+            os.remove(path)
+
+        dictionary = self._get_dictionary(header, columns)
+        zip_file.writestr('dictionary.json', json.dumps(dictionary, indent=4))
+
+        self.close_zip_file(zip_file)
+
+        return zip_file
@@ -1,5 +1,3 @@
-from zipfile import ZipFile
-from cStringIO import StringIO
 from string import punctuation
 from django.template import Context
 from django.template.loader import get_template
@@ -56,7 +54,7 @@ class RExporter(BaseExporter):
 
     def write(self, iterable, buff=None, template_name='export/script.R',
               *args, **kwargs):
-        zip_file = ZipFile(self.get_file_obj(buff), 'w')
+        zip_file = self.get_zip_file(buff)
 
         factors = []      # field names
         levels = []       # value dictionaries
@@ -81,15 +79,12 @@ class RExporter(BaseExporter):
         data_filename = 'data.csv'
         script_filename = 'script.R'
 
-        # File buffers
-        data_buff = StringIO()
         # Create the data file
         data_exporter = CSVExporter(self.concepts)
         # Overwrite preferred formats for data file
         data_exporter.preferred_formats = self.preferred_formats
-        data_exporter.write(iterable, data_buff, *args, **kwargs)
-
-        zip_file.writestr(data_filename, data_buff.getvalue())
+        data_exporter.write_to_zip(zip_file, data_filename, iterable,
+                                   *args, **kwargs)
 
         template = get_template(template_name)
         context = Context({
@@ -101,6 +96,6 @@ class RExporter(BaseExporter):
 
         # Write script from template
         zip_file.writestr(script_filename, template.render(context))
-        zip_file.close()
+        self.close_zip_file(zip_file)
 
         return zip_file
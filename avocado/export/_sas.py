@@ -1,5 +1,3 @@
-from zipfile import ZipFile
-from cStringIO import StringIO
 from string import punctuation
 from django.template import Context
 from django.template.loader import get_template
@@ -33,7 +31,7 @@ class SASExporter(BaseExporter):
         'number': 'best12.',
         'date': 'MMDDYYw.',
         'boolean': 'best12.',
-        'datatime': 'DATETIMEw.d',
+        'datetime': 'DATETIMEw.d',
         'time': 'TIMEw.d'
     }
 
@@ -88,7 +86,7 @@ class SASExporter(BaseExporter):
     def write(self, iterable, buff=None, template_name='export/script.sas',
               *args, **kwargs):
 
-        zip_file = ZipFile(self.get_file_obj(buff), 'w')
+        zip_file = self.get_zip_file(buff)
 
         formats = []            # sas formats for all fields
         informats = []          # sas informats for all fields
@@ -130,15 +128,12 @@ class SASExporter(BaseExporter):
         data_filename = 'data.csv'
         script_filename = 'script.sas'
 
-        # File buffers
-        data_buff = StringIO()
         # Create the data file
         data_exporter = CSVExporter(self.concepts)
         # Overwrite preferred formats for data file
         data_exporter.preferred_formats = self.preferred_formats
-        data_exporter.write(iterable, data_buff, *args, **kwargs)
-
-        zip_file.writestr(data_filename, data_buff.getvalue())
+        data_exporter.write_to_zip(zip_file, data_filename, iterable,
+                                   *args, **kwargs)
 
         template = get_template(template_name)
         context = Context({
@@ -153,6 +148,6 @@ class SASExporter(BaseExporter):
 
         # Write script from template
         zip_file.writestr(script_filename, template.render(context))
-        zip_file.close()
+        self.close_zip_file(zip_file)
 
         return zip_file
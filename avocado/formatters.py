@@ -10,6 +10,18 @@ from avocado.core import loader
 
 log = logging.getLogger(__name__)
 
+# Representations of a field's data that can be selected for formatting,
+# see `DataField.get_representation_field`
+VALUE = 'value'
+LABEL = 'label'
+CODE = 'code'
+ORDER = 'order'
+REPRESENTATIONS = (VALUE, LABEL, CODE, ORDER)
+
+
+# Marks a value no format method was able to format
+MISSING = object()
+
 
 class FormatterException(Exception):
     pass
@@ -93,8 +105,17 @@ class Formatter(object):
     """
     default_formats = ('boolean', 'number', 'string')
 
-    def __init__(self, concept=None, keys=None):
-        "Passing in a concept takes precedence over `keys`."
+    # The representation of the field data this formatter expects. Only
+    # this column is selected for each field of the concept.
+    representation = LABEL
+
+    # The maximum number of values planned per column, see `_format_column`
+    plan_size = 10000
+
+    def __init__(self, concept=None, keys=None, fields=None):
+        """Passing in a concept takes precedence over `keys`. The `fields`
+        of the concept in order can be supplied if already loaded.
+        """
         if not keys and not concept:
             raise ValueError('A concept or list of keys must be supplied.')
 
@@ -102,7 +123,9 @@ class Formatter(object):
         self.fields = None
 
         if concept:
-            fields = list(concept.fields.order_by('concept_fields__order'))
+            if fields is None:
+                fields = concept.fields.order_by('concept_fields__order')
+            fields = list(fields)
             self.fields = OrderedDict(_unique_keys(fields))
             self.keys = self.fields.keys()
         else:
@@ -112,86 +135,223 @@ class Formatter(object):
         # logging the exception twice
         self._errors = {}
 
-    def __call__(self, values, preferred_formats=None, **context):
-        # Create a copy of the preferred formats since each set values may
-        # be processed slightly differently (e.g. mixed data type in column)
-        # which could cause exceptions that would not be present during
-        # processing of other values
-        if preferred_formats is None:
-            preferred_formats = self.default_formats
-        preferred_formats = list(preferred_formats) + ['raw']
+        # The resolved format methods by preferred formats and the format
+        # plan of each column, see `_format_column`
+        self._methods = {}
+        self._plans = {}
+
+        self._get_methods(self.default_formats)
+
+    def __getstate__(self):
+        # The resolved methods are bound to this instance and cannot be
+        # pickled. They are resolved again when needed.
+        state = self.__dict__.copy()
+        state['_methods'] = {}
+        state['_plans'] = {}
+        return state
 
+    def __call__(self, values, preferred_formats=None, **context):
         # Create a OrderedDict of the values relative to the
         # concept fields objects the values represent. This
         # enables key-based access to the values rather than
         # relying on position.
-        if not isinstance(values, OrderedDict):
+        if isinstance(values, OrderedDict):
+            keys = values.keys()
+            values = values.values()
+        else:
+            keys = self.keys
             # Wrap single values
             if not isinstance(values, (list, tuple)):
                 values = [values]
-            values = OrderedDict(zip(self.keys, values))
-
-        # Iterate over all preferred formats and attempt to process the values.
-        # For formatter methods that process all values must be tracked and
-        # attempted only once. They are removed from the list once attempted.
-        # If no preferred multi-value methods succeed, each value is processed
-        # independently with the remaining formats
-        for f in iter(preferred_formats):
+
+        keys, values = self._format_rows(keys, [values], preferred_formats,
+                                         context)[0]
+        return OrderedDict(zip(keys, values))
+
+    def format_batch(self, rows, preferred_formats=None, **context):
+        """Formats a batch of `rows` where each row is a list or tuple of
+        values relative to `keys`. Returns a list of the outputs in the same
+        order, each equivalent to calling the formatter on the row.
+
+        The format methods are resolved once for the batch and the values
+        are processed column by column rather than row by row.
+        """
+        return [OrderedDict(zip(keys, values)) for keys, values in
+                self.format_batch_tuples(rows, preferred_formats, **context)]
+
+    def format_batch_tuples(self, rows, preferred_formats=None, **context):
+        """Same as `format_batch`, but each output is a pair of the tuple of
+        keys and the tuple of formatted values. Outputs that have the same
+        keys as the formatter share the same keys tuple, so no mapping is
+        created per row.
+        """
+        return self._format_rows(self.keys, rows, preferred_formats, context)
+
+    def _get_methods(self, preferred_formats):
+        """Returns the multi-value and the single-value format methods
+        supported by this formatter for `preferred_formats` in order.
+        """
+        if preferred_formats is None:
+            preferred_formats = self.default_formats
+
+        preferred_formats = tuple(preferred_formats)
+
+        if preferred_formats in self._methods:
+            return self._methods[preferred_formats]
+
+        multiple = []
+        single = []
+
+        for f in list(preferred_formats) + ['raw']:
             method = getattr(self, u'to_{0}'.format(f), None)
-            # This formatter does not support this format, remove it
-            # from the available list
+
+            # This formatter does not support this format
             if not method:
-                preferred_formats.pop(0)
                 continue
 
-            # The implicit behavior when handling multiple values is to process
-            # them independently since, in most cases, they are not dependent
-            # on one another, but rather should be represented together since
-            # the data is related. A formatter method can be flagged to process
-            # all values together by setting the attribute
-            # `process_multiple=True`. we must # check to if that flag has been
-            # set and simply pass through the values and context to the method
-            # as is. if ``process_multiple`` is not set, each value is handled
-            # independently
+            # The implicit behavior when handling multiple values is to
+            # process them independently since, in most cases, they are not
+            # dependent on one another, but rather should be represented
+            # together since the data is related. A formatter method can be
+            # flagged to process all values together by setting the attribute
+            # `process_multiple=True`.
             if getattr(method, 'process_multiple', False):
-                try:
-                    output = method(values, fields=self.fields,
-                                    concept=self.concept,
-                                    process_multiple=True, **context)
-                    if not isinstance(output, dict):
-                        return OrderedDict([(self.concept.name, output)])
-                    return output
-                # Remove from the preferred formats list since it failed
-                except Exception:
-                    if self.concept and self.concept not in self._errors:
-                        self._errors[self.concept] = None
-                        log.warning(u'Multi-value formatter error',
-                                    exc_info=True)
-                    preferred_formats.pop(0)
+                multiple.append(method)
+            else:
+                single.append(method)
+
+        self._methods[preferred_formats] = (multiple, single)
 
-        # The output is independent of the input. Formatters may output more
-        # or less values than what was entered.
-        output = OrderedDict()
+        return multiple, single
 
-        # Attempt to process each
-        for i, (key, value) in enumerate(values.iteritems()):
-            for f in preferred_formats:
-                method = getattr(self, u'to_{0}'.format(f))
-                field = self.fields[key] if self.fields else None
+    def _format_multiple(self, methods, values, context):
+        """Attempts the multi-value `methods` in order on `values` and
+        returns the output of the first one that succeeds. Returns `None`
+        if all of them fail.
+        """
+        for method in methods:
+            try:
+                output = method(values, fields=self.fields,
+                                concept=self.concept,
+                                process_multiple=True, **context)
+                if not isinstance(output, dict):
+                    return OrderedDict([(self.concept.name, output)])
+                return output
+            except Exception:
+                if self.concept and self.concept not in self._errors:
+                    self._errors[self.concept] = None
+                    log.warning(u'Multi-value formatter error',
+                                exc_info=True)
+
+    def _format_column(self, key, column, methods, plan, context):
+        """Formats the values of a single column with the first of the
+        single-value `methods` that succeeds for each value. Values that
+        cannot be formatted by any method are returned as `MISSING`.
+
+        The `plan` of the column maps each value to the first method that
+        succeeded for it. The methods that precede it are skipped for
+        subsequent occurrences of the same value since they would fail
+        again, so repeated values do not raise and handle an exception per
+        value. At most `plan_size` values are planned, values that are not
+        planned or cannot be hashed attempt all methods in order.
+        """
+        field = self.fields[key] if self.fields else None
+        kwargs = dict(context, field=field, concept=self.concept,
+                      process_multiple=False)
+
+        fvalues = []
+
+        for value in column:
+            # The type is part of the key since equal values of different
+            # types, e.g. 1 and True, may not be formatted the same
+            try:
+                plan_key = (type(value), value)
+                index = plan.get(plan_key)
+            except TypeError:
+                plan_key = None
+                index = None
+
+            fvalue = MISSING
+            i = index or 0
+
+            while i < len(methods):
                 try:
-                    fvalue = method(value, field=field, concept=self.concept,
-                                    process_multiple=False, **context)
-                    if isinstance(fvalue, dict):
-                        output.update(fvalue)
-                    else:
-                        output[key] = fvalue
+                    fvalue = methods[i](value, **kwargs)
                     break
                 except Exception:
                     if field and field not in self._errors:
                         self._errors[field] = None
                         log.warning(u'Single-value formatter error',
                                     exc_info=True)
-        return output
+                i += 1
+
+            if (plan_key is not None and index is None and
+                    len(plan) < self.plan_size):
+                plan[plan_key] = i
+
+            fvalues.append(fvalue)
+
+        return fvalues
+
+    def _format_rows(self, keys, rows, preferred_formats, context):
+        rows = list(rows)
+        keys = tuple(keys)
+        multiple, single = self._get_methods(preferred_formats)
+        plans = self._plans.setdefault(tuple(single), {})
+
+        outputs = [None] * len(rows)
+        pending = range(len(rows))
+
+        # Formatter methods that process all values are attempted first for
+        # each row. If none of them succeed, each value of the row is
+        # processed independently with the single-value formats.
+        if multiple:
+            pending = []
+
+            for i, values in enumerate(rows):
+                output = self._format_multiple(
+                    multiple, OrderedDict(zip(keys, values)), context)
+
+                if output is None:
+                    pending.append(i)
+                else:
+                    outputs[i] = (tuple(output.keys()),
+                                  tuple(output.values()))
+
+        if not pending:
+            return outputs
+
+        columns = zip(*[rows[i] for i in pending])
+
+        fcolumns = [self._format_column(key, column, single,
+                                        plans.setdefault(key, {}), context)
+                    for key, column in zip(keys, columns)]
+
+        # Outputs keep the keys of the formatter unless a format method
+        # output a mapping or a value could not be formatted
+        keys = keys[:len(fcolumns)]
+
+        for i, fvalues in zip(pending, zip(*fcolumns) or [()] * len(pending)):
+            for fvalue in fvalues:
+                if fvalue is MISSING or isinstance(fvalue, dict):
+                    break
+            else:
+                outputs[i] = (keys, fvalues)
+                continue
+
+            # The output is independent of the input. Formatters may output
+            # more or less values than what was entered.
+            output = OrderedDict()
+
+            for key, fvalue in zip(keys, fvalues):
+                if isinstance(fvalue, dict):
+                    output.update(fvalue)
+                elif fvalue is not MISSING:
+                    output[key] = fvalue
+
+            outputs[i] = (tuple(output.keys()), tuple(output.values()))
+
+        return outputs
 
     def __contains__(self, choice):
         return hasattr(self, u'to_{0}'.format(choice))
@@ -248,6 +408,11 @@ class RawFormatter(Formatter):
         preferred_formats = ['raw']
         return super(RawFormatter, self).__call__(values, preferred_formats)
 
+    def format_batch_tuples(self, rows, *args, **kwargs):
+        preferred_formats = ['raw']
+        return super(RawFormatter, self).format_batch_tuples(
+            rows, preferred_formats)
+
 
 registry = loader.Registry(default=Formatter, register_instance=False)
 loader.autodiscover('formatters')
@@ -4,9 +4,12 @@ from django.db.models import Q
 from django.db import transaction
 from django.conf import settings
 from django.db.models.manager import ManagerDescriptor
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
-from avocado.conf import OPTIONAL_DEPS, requires_dep
+from avocado.conf import OPTIONAL_DEPS, requires_dep, \
+    settings as avocado_settings
 from avocado.core.managers import PublishedManager, PublishedQuerySet
+from avocado.core.cache.model import CACHE_KEY_FUNC, NEVER_EXPIRE
 
 
 logger = logging.getLogger(__name__)
@@ -187,6 +190,72 @@ class DataConceptManager(PublishedManager, DataSearchMixin):
         return concept
 
 
+class DataConceptFieldManager(models.Manager):
+    "Manager for the `DataConceptField` model."
+
+    def _cache_key(self, pk):
+        return CACHE_KEY_FUNC(['avocado', 'concept_fields', pk])
+
+    def _load_for_concepts(self, ids):
+        from avocado.models import DataConcept
+
+        concepts = {}
+
+        cfields = self.get_query_set().filter(concept__pk__in=ids)\
+            .select_related('field', 'concept').order_by('concept', 'order')
+
+        for cf in cfields:
+            if cf.concept_id not in concepts:
+                concepts[cf.concept_id] = (cf.concept, [])
+            concepts[cf.concept_id][1].append(cf.field)
+
+        # Concepts without fields
+        missing = set(ids) - set(concepts)
+
+        if missing:
+            for concept in DataConcept.objects.filter(pk__in=missing):
+                concepts[concept.pk] = (concept, [])
+
+        return concepts
+
+    def get_for_concepts(self, ids):
+        """Returns a dict of (concept, fields) pairs keyed by the concept
+        `ids`. The fields are in the order defined on the concept. Concepts
+        that do not exist are not included.
+
+        Each pair is cached until the concept, its fields or the
+        concept fields change.
+        """
+        ids = set(ids)
+
+        if not ids:
+            return {}
+
+        if not avocado_settings.DATA_CACHE_ENABLED:
+            return self._load_for_concepts(ids)
+
+        keys = dict((self._cache_key(pk), pk) for pk in ids)
+
+        concepts = {}
+        for key, value in cache.get_many(keys.keys()).iteritems():
+            concepts[keys[key]] = value
+
+        missing = ids - set(concepts)
+
+        if missing:
+            loaded = self._load_for_concepts(missing)
+            cache.set_many(dict((self._cache_key(pk), value)
+                                for pk, value in loaded.iteritems()),
+                           timeout=NEVER_EXPIRE)
+            concepts.update(loaded)
+
+        return concepts
+
+    def uncache(self, ids):
+        "Removes the cached concept fields for the concept `ids`."
+        cache.delete_many([self._cache_key(pk) for pk in ids])
+
+
 class DataCategoryManager(PublishedManager):
     "Manager for the `DataCategory` model."
 
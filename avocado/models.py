@@ -1,4 +1,6 @@
 import re
+import inspect
+import jsonfield
 from warnings import warn
 from datetime import datetime
 from django.db import models
@@ -18,6 +20,8 @@ from avocado.conf import settings, dep_supported
 from avocado import managers, history
 from avocado.query.models import AbstractDataView, AbstractDataContext, \
     AbstractDataQuery
+from avocado.query.compiled import invalidate_compiled_contexts
+from avocado.query.jobs import JOB_STATUSES, PENDING
 from avocado.query.translators import registry as translators
 from avocado.query.operators import registry as operators
 from avocado.lexicon.models import Lexicon
@@ -65,6 +69,18 @@ def is_objectset(f):
     return False
 
 
+def _accepts_fields(klass):
+    """Returns true if the formatter class accepts the `fields` argument.
+    Formatters written before it was added override `__init__` with the
+    concept and keys only.
+    """
+    try:
+        args, varargs, keywords, defaults = inspect.getargspec(klass.__init__)
+    except TypeError:
+        return False
+    return 'fields' in args or keywords is not None
+
+
 class DataCategory(Base, PublishArchiveMixin):
     "A high-level organization for data concepts."
     # A reference to a parent for hierarchical categories
@@ -383,6 +399,22 @@ class DataField(BasePlural, PublishArchiveMixin):
                 except FieldDoesNotExist:
                     pass
 
+    def get_representation_field(self, representation):
+        """Returns the field object for `representation` which is one of
+        'value', 'label', 'code' or 'order'. Since a code field may not be
+        defined, the value field is returned in its place.
+        """
+        if representation not in formatters.REPRESENTATIONS:
+            raise ValueError(u'"{0}" is not a valid representation'
+                             .format(representation))
+
+        field = getattr(self, u'{0}_field'.format(representation))
+
+        if field is None:
+            return self.value_field
+
+        return field
+
     @property
     def nullable(self):
         "Returns whether this field can contain NULL values."
@@ -700,20 +732,33 @@ class DataConcept(BasePlural, PublishArchiveMixin):
 
     objects = managers.DataConceptManager()
 
-    def format(self, *args, **kwargs):
-        """Convenience method for formatting data relative to this concept's
-        associated formatter. To prevent redundant initializations (say, in
-        a tight loop) the formatter instance is cached until the formatter
-        name changes.
+    def get_formatter(self, fields=None):
+        """Returns an instance of this concept's associated formatter. To
+        prevent redundant initializations (say, in a tight loop) the
+        formatter instance is cached until the formatter name changes.
+
+        The concept's `fields` in order can be supplied if already loaded
+        to prevent the formatter from querying them. They are only passed
+        to formatters that accept them.
         """
         name = self.formatter_name
         cache = getattr(self, '_formatter_cache', None)
         if not cache or name != cache[0]:
-            formatter = formatters.registry.get(name)(self)
+            klass = formatters.registry.get(name)
+            if fields is not None and _accepts_fields(klass):
+                formatter = klass(self, fields=fields)
+            else:
+                formatter = klass(self)
             self._formatter_cache = (name, formatter)
         else:
             formatter = cache[1]
-        return formatter(*args, **kwargs)
+        return formatter
+
+    def format(self, *args, **kwargs):
+        """Convenience method for formatting data relative to this concept's
+        associated formatter.
+        """
+        return self.get_formatter()(*args, **kwargs)
 
     class Meta(object):
         app_label = 'avocado'
@@ -735,6 +780,8 @@ class DataConceptField(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    objects = managers.DataConceptFieldManager()
+
     class Meta(object):
         ordering = ('order', 'name')
 
@@ -987,6 +1034,60 @@ class DataQuery(AbstractDataQuery, Base):
         self.shared_users.add(user)
         self.save()
 
+
+class ExportJob(models.Model):
+    """An export of a context and view which is run by a worker in the
+    background, see `avocado.query.jobs`. The exported file is kept until
+    the job is deleted.
+    """
+    # Name of the exporter in the export registry
+    exporter = models.CharField(max_length=100)
+
+    # Alias of the query processor and the tree the query is applied to
+    processor = models.CharField(max_length=100, default='default')
+    tree = models.CharField(max_length=100, null=True, blank=True)
+
+    context_json = jsonfield.JSONField(null=True, blank=True, default=dict)
+    view_json = jsonfield.JSONField(null=True, blank=True, default=dict)
+
+    # Options of `QueryProcessor.export()`, e.g. the offset and limit
+    options = jsonfield.JSONField(null=True, blank=True, default=dict)
+
+    # The saved query being exported, if any
+    query = models.ForeignKey(DataQuery, null=True, blank=True,
+                              related_name='export_jobs',
+                              on_delete=models.SET_NULL)
+
+    # For authenticated users the `user` can be directly referenced,
+    # otherwise the session key can be used.
+    user = models.ForeignKey(User, null=True, blank=True,
+                             related_name='exportjob+')
+    session_key = models.CharField(max_length=40, null=True, blank=True)
+
+    status = models.CharField(max_length=20, choices=JOB_STATUSES,
+                              default=PENDING)
+
+    # The number of rows of the query read so far and the number of
+    # records of the query. Rows that are not written by the exporter,
+    # e.g. duplicates, are counted as well.
+    rows_read = models.IntegerField(default=0)
+    record_count = models.IntegerField(null=True, blank=True)
+
+    # The path of the exported file once the job is done
+    path = models.CharField(max_length=500, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta(object):
+        ordering = ('-created',)
+
+    def __unicode__(self):
+        return u'{0} export #{1} ({2})'.format(self.exporter, self.pk,
+                                               self.status)
+
 # Register instance-level cache invalidation handlers
 post_save.connect(post_save_cache, sender=DataField)
 post_save.connect(post_save_cache, sender=DataConcept)
@@ -996,6 +1097,31 @@ pre_delete.connect(pre_delete_uncache, sender=DataField)
 pre_delete.connect(pre_delete_uncache, sender=DataConcept)
 pre_delete.connect(pre_delete_uncache, sender=DataCategory)
 
+
+def uncache_concept_fields(sender, instance, **kwargs):
+    "Removes the cached concept fields of the concepts related to `instance`."
+    if sender is DataConcept:
+        ids = [instance.pk]
+    elif sender is DataConceptField:
+        ids = [instance.concept_id]
+    else:
+        ids = instance.concept_fields.values_list('concept', flat=True)
+
+    DataConceptField.objects.uncache(ids)
+
+
+post_save.connect(uncache_concept_fields, sender=DataField)
+post_save.connect(uncache_concept_fields, sender=DataConcept)
+post_save.connect(uncache_concept_fields, sender=DataConceptField)
+
+pre_delete.connect(uncache_concept_fields, sender=DataField)
+pre_delete.connect(uncache_concept_fields, sender=DataConcept)
+pre_delete.connect(uncache_concept_fields, sender=DataConceptField)
+
+# Compiled contexts depend on the field definitions
+post_save.connect(invalidate_compiled_contexts, sender=DataField)
+pre_delete.connect(invalidate_compiled_contexts, sender=DataField)
+
 # Register with history API
 if settings.HISTORY_ENABLED:
     history.register(DataContext, fields=('name', 'description', 'json'))
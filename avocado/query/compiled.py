@@ -0,0 +1,270 @@
+"""Compiled contexts are a serializable representation of parsed contexts.
+
+Compiling a context requires looking up each referenced field and
+translating its conditions, which results in a tree of `Q` objects. The
+compiled representation is a JSON-compatible structure of the branches,
+the referenced field ids and the conditions with their lookups and cleaned
+values. It is stored in the shared cache so compilation done by one
+process can be reused by all others without repeating the work.
+"""
+import json
+import datetime
+from uuid import uuid4
+from decimal import Decimal
+from django.db.models import Q, get_model
+from django.core.cache import cache
+from django.utils import tree as tree_utils
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from avocado.conf import settings
+from avocado.core.cache.model import CACHE_KEY_FUNC, NEVER_EXPIRE
+from .oldparsers import datacontext as parser
+from .utils import get_tree_label, get_digest
+
+TYPE_KEY = '__type__'
+
+DECODERS = {
+    'datetime': parse_datetime,
+    'date': parse_date,
+    'time': parse_time,
+    'decimal': Decimal,
+}
+
+
+def encode_value(value):
+    """Encodes a cleaned condition value into a JSON-compatible value. Types
+    not supported by JSON are tagged with their type. A `TypeError` is
+    raised for values that cannot be encoded, e.g. model instances.
+    """
+    if value is None or isinstance(value, (bool, int, long, float,
+                                           basestring)):
+        return value
+
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [encode_value(x) for x in value]
+
+    # datetime is a subclass of date so it must be checked first
+    if isinstance(value, datetime.datetime):
+        _type = 'datetime'
+    elif isinstance(value, datetime.date):
+        _type = 'date'
+    elif isinstance(value, datetime.time):
+        _type = 'time'
+    elif isinstance(value, Decimal):
+        return {TYPE_KEY: 'decimal', 'value': str(value)}
+    else:
+        raise TypeError(u'{0!r} cannot be encoded'.format(value))
+
+    return {TYPE_KEY: _type, 'value': value.isoformat()}
+
+
+def decode_value(value):
+    "Decodes a value encoded by `encode_value`."
+    if isinstance(value, list):
+        return [decode_value(x) for x in value]
+
+    if isinstance(value, dict):
+        return DECODERS[value[TYPE_KEY]](value['value'])
+
+    return value
+
+
+def encode_q(q):
+    "Encodes a `Q` object into a JSON-compatible structure."
+    children = []
+
+    for child in q.children:
+        if isinstance(child, tree_utils.Node):
+            children.append(encode_q(child))
+        else:
+            lookup, value = child
+            children.append([lookup, encode_value(value)])
+
+    return {
+        'connector': q.connector,
+        'negated': q.negated,
+        'children': children,
+    }
+
+
+def decode_q(attrs):
+    "Decodes a `Q` object encoded by `encode_q`."
+    q = Q()
+    q.connector = attrs['connector']
+    q.negated = attrs['negated']
+
+    for child in attrs['children']:
+        if isinstance(child, dict):
+            q.children.append(decode_q(child))
+        else:
+            lookup, value = child
+            q.children.append((str(lookup), decode_value(value)))
+
+    return q
+
+
+class CompiledCondition(parser.Condition):
+    """A condition rehydrated from its compiled representation.
+
+    The field is only fetched and the condition translated again if they
+    are accessed directly, e.g. for the language of the condition.
+    """
+    annotations = None
+    extra = None
+
+    def __init__(self, field, model, condition, operator, value, **context):
+        self.field_key = field
+        self.concept_key = None
+        self.operator = operator
+        self.value = value
+        self._model = model
+        self._condition = condition
+        parser.Node.__init__(self, **context)
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def condition(self):
+        return self._condition
+
+
+def compile_node(node):
+    """Returns the compiled representation of a parsed context node. A
+    `TypeError` is raised if the node cannot be represented, i.e. it uses
+    annotations or extra or a condition value that cannot be encoded.
+    """
+    if node.annotations or node.extra:
+        raise TypeError('Annotations and extra cannot be compiled')
+
+    if isinstance(node, parser.Branch):
+        return {
+            'type': node.type,
+            'children': [compile_node(x) for x in node.children],
+        }
+
+    if isinstance(node, parser.Condition):
+        opts = node.model._meta
+        condition = node.condition
+
+        return {
+            'field': node.field.pk,
+            'model': u'{0}.{1}'.format(opts.app_label, opts.module_name),
+            'condition': condition and encode_q(condition),
+            'operator': node.operator,
+            'value': node.value,
+        }
+
+    return {}
+
+
+def rehydrate(attrs, tree=None):
+    "Returns a node for the compiled representation `attrs`."
+    if 'type' in attrs:
+        node = parser.Branch(type=attrs['type'], tree=tree)
+        node.children = [rehydrate(x, tree=tree) for x in attrs['children']]
+        return node
+
+    if 'field' in attrs:
+        condition = attrs['condition']
+
+        return CompiledCondition(field=attrs['field'],
+                                 model=get_model(*attrs['model'].split('.')),
+                                 condition=condition and decode_q(condition),
+                                 operator=attrs['operator'],
+                                 value=attrs['value'], tree=tree)
+
+    return parser.Node(tree=tree)
+
+
+def has_composite(attrs):
+    "Returns true if the context `attrs` references another context."
+    if not attrs:
+        return False
+
+    if parser.is_composite(attrs):
+        return True
+
+    for child in attrs.get('children', ()):
+        if has_composite(child):
+            return True
+
+    return False
+
+
+class CompiledContextCache(object):
+    """Caches the compiled representation of contexts.
+
+    All entries are invalidated together when a field is changed since
+    the compilation depends on the field definitions.
+    """
+    def __init__(self, timeout=NEVER_EXPIRE):
+        self.timeout = timeout
+        self.version_key = CACHE_KEY_FUNC(['avocado', 'compiled', 'version'])
+
+    def get_version(self):
+        "Returns the current version token of the cache entries."
+        version = cache.get(self.version_key)
+
+        if version is None:
+            cache.add(self.version_key, uuid4().hex, timeout=self.timeout)
+            version = cache.get(self.version_key)
+
+        return version
+
+    def cache_key(self, attrs, tree=None):
+        "Returns the cache key of the compiled context `attrs`."
+        digest = get_digest({
+            'json': attrs,
+            'tree': get_tree_label(tree),
+        })
+        return CACHE_KEY_FUNC(['avocado', 'compiled', self.get_version(),
+                               digest])
+
+    def get(self, attrs, tree=None, **context):
+        """Returns a node for the context `attrs`.
+
+        The node is rehydrated from the cached representation if available.
+        Otherwise the context is parsed and its compiled representation is
+        cached if possible. Contexts that reference other contexts or are
+        parsed with additional `context` are not cached since they may
+        depend on more than the `attrs` themselves.
+        """
+        if not settings.DATA_CACHE_ENABLED or context or has_composite(attrs):
+            return parser.parse(attrs, tree=tree, **context)
+
+        key = self.cache_key(attrs, tree=tree)
+        data = cache.get(key)
+
+        if data is not None:
+            compiled = json.loads(data)
+
+            if compiled is not None:
+                return rehydrate(compiled, tree=tree)
+
+            return parser.parse(attrs, tree=tree)
+
+        node = parser.parse(attrs, tree=tree)
+
+        # Cache a null representation for contexts that cannot be
+        # compiled to prevent re-attempting it
+        try:
+            data = json.dumps(compile_node(node))
+        except TypeError:
+            data = json.dumps(None)
+
+        cache.set(key, data, timeout=self.timeout)
+
+        return node
+
+    def invalidate(self):
+        "Invalidates all cached compiled contexts."
+        cache.set(self.version_key, uuid4().hex, timeout=self.timeout)
+
+
+def invalidate_compiled_contexts(sender, **kwargs):
+    "Signal handler for invalidating the compiled contexts."
+    compiled_contexts.invalidate()
+
+
+compiled_contexts = CompiledContextCache()
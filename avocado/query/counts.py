@@ -0,0 +1,167 @@
+import logging
+from threading import Thread
+from django.db import connection
+from django.core.cache import cache
+from avocado.conf import settings
+from avocado.core.cache.model import CACHE_KEY_FUNC, NEVER_EXPIRE
+from .compiled import has_composite
+from .utils import get_tree_label, get_digest, get_data_versions
+
+logger = logging.getLogger(__name__)
+
+# Labels correspond to the count fields on the context and query models
+CONTEXT_COUNT = 'count'
+DISTINCT_COUNT = 'distinct_count'
+RECORD_COUNT = 'record_count'
+
+
+class CountCache(object):
+    """Caches counts of contexts and queries along with the `data_version`s
+    of the fields they reference.
+
+    A cached count is served until the version of one of the referenced
+    fields changes. From then on, the stale count is served while it is
+    refreshed in a background thread. The count is also stored on the
+    instance's count field if it has been saved.
+
+    Counts of contexts that reference other contexts are not cached since
+    changes of the referenced contexts would not be detected.
+    """
+    # Time allowed for a background refresh before another one can start
+    lock_timeout = 60 * 5
+
+    def __init__(self, timeout=NEVER_EXPIRE):
+        self.timeout = timeout
+
+    def _json(self, instance, label):
+        if label == CONTEXT_COUNT:
+            return instance.json
+        if label == DISTINCT_COUNT:
+            return {'context': instance.context_json}
+        return instance.json
+
+    def _context_json(self, instance, label):
+        if label == CONTEXT_COUNT:
+            return instance.json
+        return instance.context_json
+
+    def cache_key(self, instance, label, tree=None):
+        "Returns the cache key of the count relative to the instance JSON."
+        attrs = {
+            'json': self._json(instance, label),
+            'tree': get_tree_label(tree),
+        }
+        return CACHE_KEY_FUNC(['avocado', 'count', label, get_digest(attrs)])
+
+    def get_fields(self, instance, label, tree=None):
+        "Returns the fields the count depends on."
+        node = instance.parse(tree=tree)
+
+        if label == CONTEXT_COUNT:
+            return node.fields
+
+        fields = list(node.datacontext_node.fields)
+
+        if label == RECORD_COUNT:
+            view = node.dataview_node
+            for group in view.get_fields_for_select().values():
+                fields.extend(group)
+            for group in view.get_fields_for_order_by().values():
+                fields.extend(group)
+
+        return fields
+
+    def compute(self, instance, label, tree=None):
+        "Computes the count using the fast count path."
+        if label == CONTEXT_COUNT:
+            return instance.get_count(tree=tree)
+        return instance.count(tree=tree, distinct=(label == DISTINCT_COUNT))
+
+    def _store(self, instance, label, count):
+        setattr(instance, label, count)
+
+        if instance.pk:
+            instance.__class__._default_manager.filter(pk=instance.pk)\
+                .update(**{label: count})
+
+    def _compute(self, instance, label, tree):
+        count = self.compute(instance, label, tree=tree)
+        self._store(instance, label, count)
+        return count
+
+    def is_cached(self, instance, label):
+        "Returns whether the count of the instance is cached."
+        return settings.DATA_CACHE_ENABLED and \
+            not has_composite(self._context_json(instance, label))
+
+    def _refresh(self, instance, label, tree, versions, key):
+        count = self.compute(instance, label, tree=tree)
+        cache.set(key, (versions, count), timeout=self.timeout)
+        self._store(instance, label, count)
+        logger.debug(u'Refreshed count cache "{0}"'.format(key))
+        return count
+
+    def _refresh_async(self, instance, label, tree, versions, key):
+        try:
+            self._refresh(instance, label, tree, versions, key)
+        except Exception:
+            logger.exception(u'Error refreshing count cache "{0}"'
+                             .format(key))
+        finally:
+            cache.delete(key + ':lock')
+            # Release the connection opened by this thread
+            connection.close()
+
+    def _start_refresh(self, instance, label, tree, versions, key):
+        # Only one background refresh per count at a time
+        if cache.add(key + ':lock', True, timeout=self.lock_timeout):
+            thread = Thread(target=self._refresh_async,
+                            args=(instance, label, tree, versions, key))
+            thread.start()
+            return thread
+
+    def refresh(self, instance, label, tree=None, async=False):
+        """Recomputes and caches the count. If `async` is true, the refresh
+        is done in a background thread unless one is already running for
+        this count.
+        """
+        if not self.is_cached(instance, label):
+            return self._compute(instance, label, tree)
+
+        key = self.cache_key(instance, label, tree=tree)
+        versions = get_data_versions(self.get_fields(instance, label, tree))
+
+        if async:
+            self._start_refresh(instance, label, tree, versions, key)
+        else:
+            return self._refresh(instance, label, tree, versions, key)
+
+    def get(self, instance, label, tree=None, async=True):
+        """Returns the count for the instance. A stale count is returned
+        and refreshed if the data versions of the fields have changed.
+        """
+        if not self.is_cached(instance, label):
+            return self._compute(instance, label, tree)
+
+        key = self.cache_key(instance, label, tree=tree)
+        versions = get_data_versions(self.get_fields(instance, label, tree))
+        data = cache.get(key)
+
+        if data is None:
+            return self._refresh(instance, label, tree, versions, key)
+
+        cached_versions, count = data
+
+        if cached_versions != versions:
+            if not async:
+                return self._refresh(instance, label, tree, versions, key)
+            self._start_refresh(instance, label, tree, versions, key)
+
+        return count
+
+    def flush(self, instance, label, tree=None):
+        "Flushes the cached count."
+        cache.delete(self.cache_key(instance, label, tree=tree))
+
+
+count_cache = CountCache()
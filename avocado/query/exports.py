@@ -0,0 +1,295 @@
+import os
+import time
+import errno
+import logging
+import tempfile
+from avocado.conf import settings
+from .compiled import has_composite
+from .utils import get_tree_label, get_digest, get_data_versions
+
+logger = logging.getLogger(__name__)
+
+# Options of `QueryProcessor.export()` that do not change the output
+TRANSIENT_OPTIONS = ('stream', 'itersize')
+
+
+def _class_path(obj):
+    klass = obj.__class__
+    return u'{0}.{1}'.format(klass.__module__, klass.__name__)
+
+
+def _formatter_path(formatter):
+    # Formatters can be functions as well
+    if hasattr(formatter, '__name__'):
+        return u'{0}.{1}'.format(formatter.__module__, formatter.__name__)
+    return _class_path(formatter)
+
+
+class ExportCache(object):
+    """Caches the files written by exporters on disk.
+
+    An entry is identified by the exporter, the context and view JSON and
+    the export options. The `data_version`s of the fields referenced by the
+    context and view are part of the file name of the entry. Once the data
+    of one of the fields changes, the file is removed on the next lookup
+    and the export is written again.
+
+    The least recently used files are removed once their total size
+    exceeds `max_size`. Files of writes that did not complete are removed
+    once they have not been written to for `stale_timeout` seconds.
+    """
+    stale_timeout = 60 * 60
+
+    def __init__(self, path=None, max_size=None):
+        self._path = path
+        self._max_size = max_size
+
+    @property
+    def path(self):
+        if self._path is not None:
+            return self._path
+        return settings.EXPORT_CACHE_DIR
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return settings.EXPORT_CACHE_MAX_SIZE
+
+    def get_fields(self, processor):
+        "Returns the fields the output of the processor depends on."
+        fields = []
+
+        if processor.context:
+            fields.extend(processor.context.parse(tree=processor.tree).fields)
+
+        if processor.view:
+            node = processor.view.parse(tree=processor.tree)
+            for group in node.get_fields_for_select().values():
+                fields.extend(group)
+            for group in node.get_fields_for_order_by().values():
+                fields.extend(group)
+
+        return fields
+
+    def get_formatters(self, exporter):
+        """Returns the formatters of the exporter along with the concept and
+        the keys they format.
+        """
+        formatters = []
+
+        for formatter, length in exporter.params:
+            concept = getattr(formatter, 'concept', None)
+            keys = getattr(formatter, 'keys', None)
+
+            formatters.append({
+                'formatter': _formatter_path(formatter),
+                'concept': concept.pk if concept else None,
+                'keys': list(keys) if keys else None,
+                'length': length,
+            })
+
+        return formatters
+
+    def cache_key(self, processor, exporter, args=(), kwargs=None):
+        """Returns the key of the entry relative to the exporter and the
+        export options. A TypeError is raised if the options cannot be
+        serialized.
+        """
+        options = dict((k, v) for k, v in (kwargs or {}).items()
+                       if k not in TRANSIENT_OPTIONS)
+
+        return get_digest({
+            'processor': _class_path(processor),
+            'exporter': _class_path(exporter),
+            'formatters': self.get_formatters(exporter),
+            'preferred_formats': list(exporter.preferred_formats),
+            'representations': exporter.get_representations(),
+            'context': getattr(processor.context, 'json', None),
+            'view': getattr(processor.view, 'json', None),
+            'tree': get_tree_label(processor.tree),
+            'include_pk': processor.include_pk,
+            'args': args,
+            'options': options,
+        })
+
+    def get_version(self, processor):
+        "Returns the token of the current data versions of the fields."
+        return get_digest(get_data_versions(self.get_fields(processor)))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _listdir(self):
+        try:
+            return os.listdir(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+
+    def _names(self):
+        # Files being written are hidden
+        return [x for x in self._listdir() if not x.startswith('.')]
+
+    def _entries(self):
+        "Returns the modification time, size and path of the cached files."
+        entries = []
+
+        for name in self._names():
+            path = os.path.join(self.path, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def open(self, key, version):
+        """Returns the file of the entry opened for reading or None if the
+        entry is not cached for `version`. Files of the entry for other
+        versions are removed.
+        """
+        match = None
+        prefix = key + '.'
+
+        for name in self._names():
+            if not name.startswith(prefix):
+                continue
+
+            path = os.path.join(self.path, name)
+
+            if name.split('.')[1] != version:
+                self._remove(path)
+            else:
+                match = path
+
+        if match is None:
+            return None
+
+        try:
+            fp = open(match, 'rb')
+        except IOError:
+            return None
+
+        # Mark the file as recently used. The file may have been evicted
+        # meanwhile, in which case the open file is still readable.
+        try:
+            os.utime(match, None)
+        except OSError:
+            pass
+
+        return fp
+
+    def set(self, key, version, extension, write):
+        """Caches the file written by `write`, a function taking the file
+        to write to, and returns the file opened for reading.
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # The file is renamed once complete so a partially written file
+        # is never served
+        fd, temp_path = tempfile.mkstemp(prefix='.', dir=self.path)
+        path = os.path.join(self.path, u'{0}.{1}.{2}'.format(
+            key, version, extension))
+
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                write(fp)
+            os.rename(temp_path, path)
+        finally:
+            # Only exists if the write did not complete
+            self._remove(temp_path)
+
+        fp = open(path, 'rb')
+        self.evict()
+
+        return fp
+
+    def sweep(self):
+        """Removes the files of writes that did not complete, e.g. since the
+        process was killed, once they are stale.
+        """
+        stale = time.time() - self.stale_timeout
+
+        for name in self._listdir():
+            if not name.startswith('.'):
+                continue
+
+            path = os.path.join(self.path, name)
+
+            try:
+                if os.stat(path).st_mtime < stale:
+                    self._remove(path)
+            except OSError:
+                continue
+
+    def evict(self):
+        """Removes the least recently used files exceeding the maximum size
+        and the stale files of writes that did not complete.
+        """
+        self.sweep()
+
+        entries = sorted(self._entries())
+        size = sum(x[1] for x in entries)
+
+        for mtime, _size, path in entries:
+            if size <= self.max_size:
+                break
+
+            self._remove(path)
+            size -= _size
+
+    def clear(self):
+        "Removes all cached files."
+        for name in self._names():
+            self._remove(os.path.join(self.path, name))
+
+    def get(self, processor, exporter, *args, **kwargs):
+        """Returns the file written by `processor.export()` for `exporter`
+        opened for reading. The file is served from the cache if possible.
+
+        Exports are not cached if the cache is disabled, the context
+        references other contexts or the options cannot be serialized. In
+        this case a temporary file is returned.
+        """
+        def write(fp):
+            processor.export(exporter, buff=fp, *args, **kwargs)
+
+        key = None
+
+        if self.path and not (processor.context and
+                              has_composite(processor.context.json)):
+            try:
+                key = self.cache_key(processor, exporter, args, kwargs)
+            except TypeError:
+                logger.debug(u'Export options of {0} cannot be cached'
+                             .format(_class_path(exporter)))
+
+        if key is None:
+            fp = tempfile.TemporaryFile()
+            write(fp)
+            fp.seek(0)
+            return fp
+
+        version = self.get_version(processor)
+        fp = self.open(key, version)
+
+        if fp is None:
+            fp = self.set(key, version, exporter.file_extension, write)
+
+        return fp
+
+
+export_cache = ExportCache()
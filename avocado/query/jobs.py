@@ -0,0 +1,385 @@
+import os
+import errno
+import inspect
+import logging
+import tempfile
+import multiprocessing
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from django.db import connection, connections, transaction
+from django.utils.importlib import import_module
+from avocado.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# States of an export job
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_STATUSES = (
+    (PENDING, 'Pending'),
+    (RUNNING, 'Running'),
+    (DONE, 'Done'),
+    (FAILED, 'Failed'),
+)
+
+# Kinds of worker pools
+THREAD = 'thread'
+PROCESS = 'process'
+
+
+def _import(path):
+    toks = path.split('.')
+    name = toks.pop()
+    return getattr(import_module('.'.join(toks)), name)
+
+
+def _run_job(queue, job_id):
+    "Runs a job in a worker of the pool of `queue`."
+    try:
+        queue.run(job_id)
+    finally:
+        # Release the connection opened by this worker
+        connection.close()
+
+
+class JobStore(object):
+    """Keeps track of the export jobs. A job is an object with the
+    attributes of `avocado.models.ExportJob`.
+    """
+    def create(self, **attrs):
+        "Creates and returns a job."
+        raise NotImplementedError
+
+    def get(self, job_id):
+        "Returns the job or None if it does not exist."
+        raise NotImplementedError
+
+    def update(self, job_id, **attrs):
+        "Updates the attributes of the job."
+        raise NotImplementedError
+
+    def claim(self, job_id, **attrs):
+        """Atomically marks the job as running and updates the attributes
+        of the job if it is pending. Returns whether the job was pending so
+        a job is only run by one worker.
+        """
+        raise NotImplementedError
+
+    def delete(self, job_id):
+        "Deletes the job."
+        raise NotImplementedError
+
+    def in_transaction(self):
+        """Returns whether jobs that are created now are only visible to the
+        workers once a transaction is committed.
+        """
+        return False
+
+
+class DatabaseJobStore(JobStore):
+    "Stores the jobs as `ExportJob` instances."
+    def _model(self):
+        from avocado.models import ExportJob
+        return ExportJob
+
+    def create(self, **attrs):
+        return self._model().objects.create(**attrs)
+
+    def get(self, job_id):
+        try:
+            return self._model().objects.get(pk=job_id)
+        except self._model().DoesNotExist:
+            pass
+
+    def update(self, job_id, **attrs):
+        # Only the given attributes are written so concurrent updates of
+        # other attributes are not lost
+        self._model().objects.filter(pk=job_id).update(**attrs)
+
+    def claim(self, job_id, **attrs):
+        return self._model().objects.filter(pk=job_id, status=PENDING)\
+            .update(status=RUNNING, **attrs) > 0
+
+    def delete(self, job_id):
+        self._model().objects.filter(pk=job_id).delete()
+
+    def in_transaction(self):
+        return transaction.is_managed()
+
+
+class ProgressIterator(object):
+    """Wraps the rows of an export and reports the number of rows read
+    every `interval` rows and once all rows have been read.
+    """
+    def __init__(self, iterable, callback, interval):
+        self.iterable = iterable
+        self.callback = callback
+        self.interval = interval
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.iterable:
+            yield row
+
+            self.count += 1
+
+            if self.count % self.interval == 0:
+                self.callback(self.count)
+
+        self.callback(self.count)
+
+
+class ExportJobQueue(object):
+    """Runs exports in the background using a pool of local workers.
+
+    Jobs are kept in the `store`, see `JobStore`. The pool consists of
+    `workers` threads or processes depending on `pool`. Since the workers
+    only receive the id of a job, processes require a store that is shared
+    across processes such as the database. The exported files are written
+    to the `path` directory.
+
+    While a job is running, the number of rows read is reported every
+    `progress_interval` rows which can be compared to the `record_count`
+    of the query, see `progress()`.
+    """
+    progress_interval = 1000
+
+    def __init__(self, store=None, workers=None, pool=None, path=None):
+        self._store = store
+        self._workers = workers
+        self._pool_type = pool
+        self._path = path
+        self._pool = None
+
+    def __getstate__(self):
+        # Only the configuration is sent to the processes
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = _import(settings.EXPORT_JOB_STORE)()
+        return self._store
+
+    @property
+    def path(self):
+        if self._path is not None:
+            return self._path
+        if settings.EXPORT_JOB_DIR:
+            return settings.EXPORT_JOB_DIR
+        return os.path.join(tempfile.gettempdir(), 'avocado-export-jobs')
+
+    def get_pool(self):
+        "Returns the worker pool which is created on first use."
+        if self._pool is None:
+            workers = self._workers or settings.EXPORT_JOB_WORKERS
+            pool_type = self._pool_type or settings.EXPORT_JOB_POOL
+
+            if pool_type == PROCESS:
+                # The processes must not share the database connections
+                for _connection in connections.all():
+                    _connection.close()
+
+                self._pool = multiprocessing.Pool(workers)
+            elif pool_type == THREAD:
+                self._pool = ThreadPool(workers)
+            else:
+                raise ValueError(u'Unknown pool "{0}"'.format(pool_type))
+
+        return self._pool
+
+    def close(self):
+        "Waits for the running jobs and shuts down the pool."
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def enqueue(self, exporter, context=None, view=None, tree=None,
+                processor=None, query=None, user=None, session_key=None,
+                async=True, submit=True, **options):
+        """Creates a job exporting the `context` and `view` JSON using the
+        `exporter` registered in `avocado.export.registry` and returns it.
+
+        If a saved `query` is given, its context, view and tree are used
+        unless they are given. The `options` of `QueryProcessor.export()`
+        are supported and must be serializable. The job is run by the pool
+        unless `async` is false, in which case it is run immediately.
+
+        The workers only see the job once it is committed. Within a managed
+        transaction, e.g. when using `TransactionMiddleware`, pass `submit`
+        as false and pass the job to `submit()` once the transaction is
+        committed. Otherwise the job could never be run, so a ValueError is
+        raised.
+        """
+        from avocado.export import registry as exporters
+        from avocado.query.pipeline import QUERY_PROCESSOR_DEFAULT_ALIAS
+
+        if exporters[exporter] is None:
+            raise ValueError(u'Unknown exporter "{0}"'.format(exporter))
+
+        if inspect.isgeneratorfunction(exporters[exporter].write):
+            raise ValueError(u'Exporter "{0}" does not write to a file'
+                             .format(exporter))
+
+        if async and submit and self.store.in_transaction():
+            raise ValueError('Export jobs cannot be submitted before the '
+                             'transaction creating them is committed')
+
+        if query is not None:
+            if context is None:
+                context = query.context_json
+            if view is None:
+                view = query.view_json
+            if tree is None:
+                tree = query.tree
+
+        job = self.store.create(
+            exporter=exporter,
+            processor=processor or QUERY_PROCESSOR_DEFAULT_ALIAS,
+            tree=tree,
+            context_json=context or {},
+            view_json=view or {},
+            options=options,
+            query=query,
+            user=user,
+            session_key=session_key)
+
+        if not async:
+            self.run(job.id)
+        elif submit:
+            self.submit(job)
+
+        return self.store.get(job.id)
+
+    def submit(self, job):
+        "Submits the job to be run by the pool."
+        self.get_pool().apply_async(_run_job, (self, job.id))
+
+    def get_processor(self, job):
+        "Returns the query processor for the job."
+        from avocado.models import DataContext, DataView
+        from avocado.query.pipeline import query_processors
+
+        context = view = None
+
+        if job.context_json:
+            context = DataContext(json=job.context_json)
+        if job.view_json:
+            view = DataView(json=job.view_json)
+
+        return query_processors[job.processor](context=context, view=view,
+                                               tree=job.tree)
+
+    def get_file_path(self, job, exporter):
+        "Returns the path of the file the job is exported to."
+        return os.path.join(self.path, u'{0}.{1}'.format(
+            job.id, exporter.file_extension))
+
+    def _export(self, job, processor, exporter):
+        def progress(rows):
+            self.store.update(job.id, rows_read=rows)
+
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        options = dict(job.options or {})
+        options.setdefault('stream', True)
+
+        iterable, kwargs = processor._get_export_iterable(exporter, options)
+        iterable = ProgressIterator(iterable, progress,
+                                    self.progress_interval)
+
+        # The file is renamed once complete so a partially written file is
+        # never downloaded
+        fd, temp_path = tempfile.mkstemp(prefix='.', dir=self.path)
+        path = self.get_file_path(job, exporter)
+
+        try:
+            with os.fdopen(fd, 'wb') as buff:
+                output = exporter.write(iterable, buff=buff, **kwargs)
+
+                # Lazy writers return their output rather than writing it
+                # to the file, nothing would be read or written
+                if inspect.isgenerator(output):
+                    output.close()
+                    raise ValueError(u'Exporter "{0}" does not write to a '
+                                     'file'.format(job.exporter))
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        return path, iterable.count
+
+    def run(self, job_id):
+        """Runs the job unless it is not pending, e.g. it has been deleted
+        or is run by another worker.
+        """
+        from avocado.export import registry as exporters
+
+        if not self.store.claim(job_id, started=datetime.now()):
+            return
+
+        job = self.store.get(job_id)
+
+        if job is None:
+            return
+
+        try:
+            processor = self.get_processor(job)
+            exporter = processor.get_exporter(exporters[job.exporter])
+
+            self.store.update(job_id,
+                              record_count=processor.count(distinct=False))
+
+            path, rows = self._export(job, processor, exporter)
+        except Exception as e:
+            logger.exception(u'Error running export job {0}'.format(job_id))
+            self.store.update(job_id, status=FAILED, error=unicode(e),
+                              finished=datetime.now())
+        else:
+            self.store.update(job_id, status=DONE, path=path,
+                              rows_read=rows, finished=datetime.now())
+
+    def progress(self, job):
+        """Returns the estimated fraction of the job that is done or None
+        if it cannot be estimated yet.
+        """
+        if job.status == DONE:
+            return 1.0
+
+        if not job.record_count:
+            return None
+
+        return min(job.rows_read / float(job.record_count), 1.0)
+
+    def open(self, job):
+        "Returns the exported file opened for reading once the job is done."
+        if job.status != DONE:
+            raise ValueError(u'Export job {0} is {1}'.format(job.id,
+                                                             job.status))
+
+        return open(job.path, 'rb')
+
+    def delete(self, job):
+        "Deletes the job along with the exported file."
+        if job.path:
+            try:
+                os.remove(job.path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+        self.store.delete(job.id)
+
+
+export_jobs = ExportJobQueue()
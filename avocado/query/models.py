@@ -74,15 +74,55 @@ class AbstractDataContext(models.Model):
         "Returns a parsed node for this context."
         return parsers.datacontext.parse(self.json, tree=tree, **context)
 
-    def apply(self, queryset=None, tree=None, **context):
-        "Applies this context to a QuerySet."
+    def apply(self, queryset=None, tree=None, strategy=None, **context):
+        """Applies this context to a QuerySet.
+
+        `strategy` determines how conditions on non-root models are compiled.
+        The default, 'join', filters across the joined tables, 'subquery'
+        compiles each of these conditions into a primary key subquery and
+        'auto' only uses a subquery when a to-many relationship is traversed.
+        """
+        if tree is None and queryset is not None:
+            tree = queryset.model
+        if strategy is None:
+            strategy = parsers.datacontext.JOIN
+        return self.compile(tree=tree, **context) \
+            .apply(queryset=queryset, strategy=strategy)
+
+    def get_count(self, queryset=None, tree=None, distinct=True,
+                  strategy=None, **context):
+        """Returns the number of distinct objects matching this context, or
+        the number of joined rows if `distinct` is false.
+
+        This is named `get_count` since `count` is the stored count field.
+        """
         if tree is None and queryset is not None:
             tree = queryset.model
-        return self.parse(tree=tree, **context).apply(queryset=queryset)
+        if strategy is None:
+            strategy = parsers.datacontext.JOIN
+        return self.compile(tree=tree, **context) \
+            .count(queryset=queryset, distinct=distinct, strategy=strategy)
+
+    def compile(self, tree=None, **context):
+        """Returns a node for applying this context. The compiled context is
+        shared across processes using the cache, see `avocado.query.compiled`.
+        """
+        from .compiled import compiled_contexts
+        return compiled_contexts.get(self.json, tree=tree, **context)
 
     def language(self, tree=None, **context):
         return self.parse(tree=tree, **context).language
 
+    def cached_count(self, tree=None, async=True):
+        """Returns the count of objects matching this context.
+
+        The count is cached until the data of one of the referenced fields
+        changes, after which the stale count is returned while it is
+        refreshed in the background (unless `async` is false).
+        """
+        from .counts import count_cache, CONTEXT_COUNT
+        return count_cache.get(self, CONTEXT_COUNT, tree=tree, async=async)
+
     def sql(self, *args, **kwargs):
         """Returns the SQL query string representative of this context.
 
@@ -122,12 +162,19 @@ class AbstractDataView(models.Model):
         "Returns a parsed node for this view."
         return parsers.dataview.parse(self.json, tree=tree, **context)
 
-    def apply(self, queryset=None, tree=None, include_pk=True, **context):
-        "Applies this context to a QuerySet."
+    def apply(self, queryset=None, tree=None, include_pk=True,
+              representations=None, **context):
+        """Applies this view to a QuerySet.
+
+        `representations` is a dict of the representation to select for the
+        fields of each concept by concept id, see
+        `BaseExporter.get_representations`. The label is selected by default.
+        """
         if tree is None and queryset is not None:
             tree = queryset.model
         return self.parse(tree=tree, **context) \
-            .apply(queryset=queryset, include_pk=include_pk)
+            .apply(queryset=queryset, include_pk=include_pk,
+                   representations=representations)
 
     def sql(self, *args, **kwargs):
         """Returns the SQL query string representative of this view.
@@ -215,13 +262,56 @@ class AbstractDataQuery(models.Model):
         }
         return parsers.dataquery.parse(json, tree=tree, **context)
 
+    def compile(self, tree=None, **context):
+        """Returns a node for applying this query. Unlike `parse()`, the
+        context node is compiled, see `AbstractDataContext.compile`.
+        """
+        from .compiled import compiled_contexts
+        datacontext_node = \
+            compiled_contexts.get(self.context_json, tree=tree, **context)
+        dataview_node = \
+            parsers.dataview.parse(self.view_json, tree=tree, **context)
+        return parsers.dataquery.Node(datacontext_node, dataview_node,
+                                      **context)
+
+    def cached_count(self, tree=None, distinct=True, async=True):
+        """Returns the `distinct_count` if `distinct` is true, otherwise the
+        `record_count`. See `AbstractDataContext.cached_count` for how the
+        count is cached.
+        """
+        from .counts import count_cache, DISTINCT_COUNT, RECORD_COUNT
+        label = distinct and DISTINCT_COUNT or RECORD_COUNT
+        return count_cache.get(self, label, tree=tree, async=async)
+
     def apply(self, queryset=None, tree=None, distinct=True, include_pk=True,
+              strategy=None, representations=None, **context):
+        """Applies this context to a QuerySet.
+
+        See `AbstractDataContext.apply` for the supported `strategy` values
+        and `AbstractDataView.apply` for `representations`.
+        """
+        if tree is None and queryset is not None:
+            tree = queryset.model
+        if strategy is None:
+            strategy = parsers.datacontext.JOIN
+        return self.compile(tree=tree, **context) \
+            .apply(queryset=queryset, distinct=distinct, include_pk=include_pk,
+                   strategy=strategy, representations=representations)
+
+    def count(self, queryset=None, tree=None, distinct=True, strategy=None,
               **context):
-        "Applies this context to a QuerySet."
+        """Returns the number of distinct objects matching the context if
+        `distinct` is true, otherwise the number of records of this query.
+
+        Unlike counting the queryset returned by `apply()`, the ordering and
+        the columns that do not affect the count are not included.
+        """
         if tree is None and queryset is not None:
             tree = queryset.model
-        return self.parse(tree=tree, **context) \
-            .apply(queryset=queryset, distinct=distinct, include_pk=include_pk)
+        if strategy is None:
+            strategy = parsers.datacontext.JOIN
+        return self.compile(tree=tree, **context) \
+            .count(queryset=queryset, distinct=distinct, strategy=strategy)
 
     def sql(self, *args, **kwargs):
         """Returns the SQL query string representative of this query.
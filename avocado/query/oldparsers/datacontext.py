@@ -1,5 +1,6 @@
 from warnings import warn
 from modeltree.tree import trees
+from django.db.models import Q
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from avocado.core import utils
 
@@ -10,6 +11,15 @@ CONDITION_KEYS = ('operator', 'value')
 COMPOSITE_KEYS = ('composite',)
 LOGICAL_OPERATORS = ('and', 'or')
 
+# Compilation strategies for conditions on non-root models. `join` filters
+# across the LEFT OUTER JOINs along the tree path, `subquery` compiles each
+# condition into a `root.pk IN (SELECT ...)` and `auto` only uses a subquery
+# when the path traverses a to-many relationship.
+JOIN = 'join'
+SUBQUERY = 'subquery'
+AUTO = 'auto'
+STRATEGIES = (JOIN, SUBQUERY, AUTO)
+
 
 def has_keys(obj, keys):
     "Check the required keys are present in `obj`"
@@ -37,6 +47,19 @@ def is_composite(obj):
         return True
 
 
+def is_to_many(tree, model):
+    """Returns true if the path from the root model of `tree` to `model`
+    traverses a relationship that may produce multiple rows per root row,
+    i.e. a many-to-many or a reversed foreign key.
+    """
+    for node in tree._node_path(model) or ():
+        if node.relation == 'manytomany':
+            return True
+        if node.relation == 'foreignkey' and node.reverse:
+            return True
+    return False
+
+
 class Node(object):
     condition = None
     annotations = None
@@ -47,19 +70,48 @@ class Node(object):
         self.tree = tree
         self.context = context
 
-    def apply(self, queryset=None, distinct=True):
+    @property
+    def fields(self):
+        "Returns a list of the fields referenced by this node."
+        return []
+
+    def get_condition(self, strategy=JOIN):
+        "Returns the condition compiled using `strategy`."
+        return self.condition
+
+    def joins_to_many(self, strategy=JOIN):
+        """Returns true if applying this node using `strategy` may produce
+        multiple rows per root row. Since arbitrary tables may be added
+        by `extra`, its presence is assumed to fan out.
+        """
+        return bool(self.extra)
+
+    def apply(self, queryset=None, distinct=True, strategy=JOIN):
+        if strategy not in STRATEGIES:
+            raise ValueError(u'"{0}" is not a valid strategy. Choices are: '
+                             '{1}'.format(strategy, ', '.join(STRATEGIES)))
         if queryset is None:
             queryset = trees[self.tree].get_queryset()
         if self.annotations:
             queryset = queryset.values('pk').annotate(**self.annotations)
-        if self.condition:
-            queryset = queryset.filter(self.condition)
+        condition = self.get_condition(strategy)
+        if condition:
+            queryset = queryset.filter(condition)
         if self.extra:
             queryset = queryset.extra(**self.extra)
-        if distinct:
+        # DISTINCT is only required if a join can produce duplicate rows
+        if distinct and self.joins_to_many(strategy):
             queryset = queryset.distinct()
         return queryset
 
+    def count(self, queryset=None, distinct=True, strategy=JOIN):
+        """Returns the number of distinct root objects matching this node or
+        the number of joined rows if `distinct` is false.
+        """
+        queryset = self.apply(queryset=queryset, distinct=distinct,
+                              strategy=strategy)
+        return queryset.values('pk').count()
+
 
 class Condition(Node):
     "Contains information for a single query condition."
@@ -110,10 +162,57 @@ class Condition(Node):
                 self._field = DataField.objects.get(**field_key)
         return self._field
 
+    @property
+    def model(self):
+        "Returns the model the condition applies to."
+        return self.field.model
+
+    @property
+    def fields(self):
+        return [self.field]
+
     @property
     def condition(self):
         return self._meta['query_modifiers'].get('condition', None)
 
+    def get_condition(self, strategy=JOIN):
+        """Returns the condition compiled using `strategy`.
+
+        For the subquery strategies, the condition is evaluated against the
+        root model in a subquery and only the matching primary keys are
+        filtered on. The outer query has no joins and therefore no fan-out.
+        Note, each condition is evaluated independently, so multiple
+        conditions on the same to-many relationship may be satisfied by
+        different related rows.
+        """
+        condition = self.condition
+
+        if condition is None or strategy == JOIN:
+            return condition
+
+        tree = trees[self.tree]
+        model = self.model
+
+        if model is tree.root_model:
+            return condition
+
+        if strategy == AUTO and not is_to_many(tree, model):
+            return condition
+
+        subquery = tree.get_queryset().filter(condition).values('pk')
+        return Q(pk__in=subquery)
+
+    def joins_to_many(self, strategy=JOIN):
+        if self.extra:
+            return True
+
+        # Conditions on to-many relationships are compiled into subqueries
+        # for the other strategies
+        if self.condition is None or strategy != JOIN:
+            return False
+
+        return is_to_many(trees[self.tree], self.model)
+
     @property
     def annotations(self):
         return self._meta['query_modifiers'].get('annotations', None)
@@ -143,6 +242,13 @@ class Branch(Node):
             return q1 | q2
         return q1 & q2
 
+    @property
+    def fields(self):
+        fields = []
+        for node in self.children:
+            fields.extend(node.fields)
+        return fields
+
     @property
     def condition(self):
         if not hasattr(self, '_condition'):
@@ -156,6 +262,26 @@ class Branch(Node):
             self._condition = condition
         return self._condition
 
+    def get_condition(self, strategy=JOIN):
+        if strategy == JOIN:
+            return self.condition
+
+        condition = None
+        for node in self.children:
+            child = node.get_condition(strategy)
+            if child:
+                if condition:
+                    condition = self._combine(child, condition)
+                else:
+                    condition = child
+        return condition
+
+    def joins_to_many(self, strategy=JOIN):
+        for node in self.children:
+            if node.joins_to_many(strategy):
+                return True
+        return False
+
     @property
     def annotations(self):
         if not hasattr(self, '_annotations'):
@@ -10,11 +10,48 @@ class Node(object):
         self.datacontext_node = datacontext_node
         self.dataview_node = dataview_node
 
-    def apply(self, queryset=None, distinct=True, include_pk=True):
-        queryset = \
-            self.datacontext_node.apply(queryset=queryset, distinct=distinct)
-        return \
-            self.dataview_node.apply(queryset=queryset, include_pk=include_pk)
+    def apply(self, queryset=None, distinct=True, include_pk=True,
+              strategy=datacontext_parser.JOIN, representations=None):
+        queryset = self.datacontext_node.apply(queryset=queryset,
+                                               distinct=distinct,
+                                               strategy=strategy)
+
+        # The view may join to-many relationships independent of the context
+        if distinct and self.dataview_node.joins_to_many():
+            queryset = queryset.distinct()
+
+        return self.dataview_node.apply(queryset=queryset,
+                                        include_pk=include_pk,
+                                        representations=representations)
+
+    def count(self, queryset=None, distinct=True,
+              strategy=datacontext_parser.JOIN):
+        """Returns the number of distinct root objects matching the context
+        if `distinct` is true. Otherwise the number of records produced when
+        the view is applied.
+
+        Since neither count depends on the ordering, the ORDER BY and the
+        columns only selected to support it are stripped. The view is not
+        applied at all for the distinct count.
+        """
+        if distinct:
+            return self.datacontext_node.count(queryset=queryset,
+                                               strategy=strategy)
+
+        queryset = self.datacontext_node.apply(queryset=queryset,
+                                               strategy=strategy)
+
+        if self.dataview_node.joins_to_many():
+            queryset = queryset.distinct()
+
+        queryset = self.dataview_node.apply(queryset=queryset, sort=False)
+
+        # Without a DISTINCT the selected columns do not affect the number
+        # of rows, so the rows of the joined tables can be counted directly
+        if not queryset.query.distinct:
+            queryset.query.select = []
+
+        return queryset.count()
 
 
 def validate(attrs, **context):
@@ -5,6 +5,7 @@ except ImportError:
     from ordereddict import OrderedDict
 from modeltree.tree import trees
 from modeltree.query import ModelTreeQuerySet
+from .datacontext import is_to_many
 
 
 SORT_DIRECTIONS = ('asc', 'desc')
@@ -18,17 +19,25 @@ class Node(object):
 
     @property
     def concept_ids(self):
+        "Returns the ids of the visible concepts. Repeated ids are removed."
         ids = []
+        seen = set()
         for facet in self.facets:
             if facet.get('enabled') is False:
                 continue
             if facet.get('visible') is False:
                 continue
+            if facet['concept'] in seen:
+                continue
+            seen.add(facet['concept'])
             ids.append(facet['concept'])
         return ids
 
     @property
     def ordering(self):
+        """Returns (concept id, direction) pairs in sort order. Only the
+        first sort of a repeated concept is used.
+        """
         ids = []
         length = len(self.facets)
 
@@ -46,70 +55,100 @@ class Node(object):
 
         # Sort relative to sort index
         ids.sort(key=lambda x: x[0])
+
         # Return only the concept id and sort direction
-        return [(c, s) for i, c, s in ids]
+        ordering = []
+        seen = set()
+        for i, c, s in ids:
+            if c not in seen:
+                seen.add(c)
+                ordering.append((c, s))
+        return ordering
+
+    def _get_concept_fields(self):
+        """Returns a dict of (concept, fields) pairs for all concepts
+        referenced by this view. These are loaded once per node.
+        """
+        if not hasattr(self, '_concept_fields'):
+            from avocado.models import DataConceptField
+
+            ids = list(self.concept_ids)
+            ids.extend([pk for pk, direction in self.ordering])
+
+            self._concept_fields = \
+                DataConceptField.objects.get_for_concepts(ids)
+
+        return self._concept_fields
 
     def _get_concepts(self, ids):
         "Returns an ordered list of concepts based on `ids`."
-        if not ids:
-            return []
+        concepts = self._get_concept_fields()
+
+        ordered = []
+        seen = set()
 
-        from avocado.models import DataConcept
+        for pk in ids:
+            if pk in concepts and pk not in seen:
+                seen.add(pk)
+                ordered.append(concepts[pk][0])
 
-        concepts = list(DataConcept.objects.filter(pk__in=ids))
-        concepts.sort(key=lambda o: ids.index(o.pk))
-        return concepts
+        return ordered
 
     def _get_fields_for_concepts(self, ids):
         "Returns an ordered list of fields for concept `ids`."
-        from avocado.models import DataConceptField
+        concepts = self._get_concept_fields()
 
-        if not ids:
-            return OrderedDict()
+        # Construct an ordered dict of fields by their concept
+        groups = OrderedDict()
 
-        # Concept fields that are sorted by concept then order, but are not
-        # in the original order defined in `ids`
-        cfields = list(DataConceptField.objects.filter(concept__pk__in=ids)
-                       .select_related()
-                       .order_by('concept', 'order'))
+        for pk in ids:
+            if pk in concepts and pk not in groups and concepts[pk][1]:
+                groups[pk] = list(concepts[pk][1])
 
-        # Order concept fields relative to `ids`
-        cfields.sort(key=lambda o: ids.index(o.concept.pk))
+        return groups
 
-        # Construct an ordered dict of fields by their concept
-        groups = OrderedDict()
+    def _get_select(self, distinct, sort=True, representations=None):
+        """Returns the model fields to select. `representations` is a dict
+        of the representation to select for the fields of each concept, e.g.
+        'value' or 'label'. The label is selected for concepts not present.
+        """
+        from avocado.formatters import LABEL
 
-        for cf in cfields:
-            pk = cf.concept.pk
+        if representations is None:
+            representations = {}
 
-            if pk not in groups:
-                groups[pk] = []
+        model_fields = []
+        selected = set()
 
-            groups[pk].append(cf.field)
+        groups = self._get_fields_for_concepts(self.concept_ids)
 
-        return groups
+        for pk, fields in groups.iteritems():
+            representation = representations.get(pk, LABEL)
 
-    def _get_select(self, distinct):
-        # Apply all fields to the query to ensure ordering get applied.
-        # Django removes ORDER BY statements if column is not present in
-        # SELECT since it will cause a SQL error. This ensures the ordering
-        # is applied at the SQL level. The caveat here is that the rows
-        # returned will include this extra data. The exporter classes handle
-        # this by removing redundant rows relative to the *original* columns.
-        ids = list(self.concept_ids)
-        ordering = self.ordering
+            for f in fields:
+                field = f.get_representation_field(representation)
+                selected.add((field.model, field.name))
+                model_fields.append(field)
 
-        if ordering and distinct:
-            ids += list(zip(*ordering)[0])
+        # The ORDER BY columns must be present in the SELECT for the DISTINCT
+        # to be applied. This ensures the ordering is applied at the SQL
+        # level. The caveat here is that the rows returned will include this
+        # extra data. The exporter classes handle this by removing redundant
+        # rows relative to the *original* columns. Only the order fields that
+        # are not already selected are added.
+        ordering = self.ordering
 
-        # Flatten the grouped fields
-        fields = [i for l in self._get_fields_for_concepts(ids).values()
-                  for i in l]
+        if ordering and distinct and sort:
+            ids = [pk for pk, direction in ordering]
 
-        model_fields = []
+            for fields in self._get_fields_for_concepts(ids).values():
+                for f in fields:
+                    field = f.order_field
+                    key = (field.model, field.name)
 
-        for f in fields:
-            model_fields.append(f.label_field)
+                    if key not in selected:
+                        selected.add(key)
+                        model_fields.append(field)
 
         return model_fields
 
@@ -134,8 +173,37 @@ class Node(object):
 
         return order_by
 
+    def joins_to_many(self):
+        """Returns true if the selected or ordered fields are reached through
+        a to-many relationship, i.e. the view may produce multiple rows per
+        root row.
+        """
+        ids = list(self.concept_ids)
+        ordering = self.ordering
+
+        if ordering:
+            ids += list(zip(*ordering)[0])
+
+        if not ids:
+            return False
+
+        tree = trees[self.tree]
+
+        for fields in self._get_fields_for_concepts(ids).values():
+            for f in fields:
+                if is_to_many(tree, f.label_field.model) or \
+                        is_to_many(tree, f.order_field.model):
+                    return True
+
+        return False
+
     # Primary method for apply this view to a QuerySet
-    def apply(self, queryset=None, include_pk=True):
+    def apply(self, queryset=None, include_pk=True, sort=True,
+              representations=None):
+        """Applies the SELECT and ORDER BY of this view to the queryset. If
+        `sort` is false, the ordering and the columns only selected to
+        support it are omitted. See `_get_select` for `representations`.
+        """
         tree = trees[self.tree]
         if queryset is None:
             queryset = tree.get_queryset()
@@ -144,13 +212,15 @@ class Node(object):
         queryset = ModelTreeQuerySet(tree, query=queryset.query)
 
         # Set model fields for `select()` method
-        select = self._get_select(queryset.query.distinct)
+        select = self._get_select(queryset.query.distinct, sort=sort,
+                                  representations=representations)
         queryset = queryset.select(*select, include_pk=include_pk)
 
         # Set the order by on the QuerySet
-        order_by = self._get_order_by()
-        if order_by:
-            queryset = queryset.order_by(*order_by)
+        if sort:
+            order_by = self._get_order_by()
+            if order_by:
+                queryset = queryset.order_by(*order_by)
 
         return queryset
 
@@ -161,6 +231,22 @@ class Node(object):
     def get_fields_for_select(self):
         return self._get_fields_for_concepts(self.concept_ids)
 
+    def get_order_by(self):
+        "Returns the directional lookups of the ordering."
+        return self._get_order_by()
+
+    def selects_sort_columns(self, representations=None):
+        """Returns true if applying this view to a distinct queryset selects
+        columns beyond the view's own columns to support the ordering.
+        """
+        if not self.ordering:
+            return False
+
+        distinct = self._get_select(True, representations=representations)
+        plain = self._get_select(False, representations=representations)
+
+        return len(distinct) > len(plain)
+
     def get_concepts_for_order_by(self):
         ids = []
         ordering = self.ordering
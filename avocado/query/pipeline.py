@@ -1,10 +1,180 @@
+import os
+import inspect
+import tempfile
+import multiprocessing
+from uuid import uuid4
+from collections import deque
+from itertools import chain, islice
+from django.core import signing
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.utils.importlib import import_module
 from modeltree.tree import trees
 from avocado.formatters import RawFormatter
+from avocado.export import FormattedRows
 from avocado.conf import settings
+from avocado.query import oldparsers as parsers
+from avocado.query.compiled import encode_value, decode_value
+from avocado.query.exports import export_cache
+from avocado.query.utils import get_digest
 
 QUERY_PROCESSOR_DEFAULT_ALIAS = 'default'
 
+# Keyset pagination directions relative to the cursor
+NEXT = 'next'
+PREVIOUS = 'previous'
+
+CURSOR_SALT = 'avocado.query.pipeline.cursor'
+
+# Database vendors that sort NULLs as if they were larger than any value
+NULLS_LARGEST_VENDORS = ('postgresql', 'oracle')
+
+
+def _fetch(connection, sql, params, itersize):
+    if connection.vendor == 'postgresql':
+        # Ensure the connection is established
+        connection.cursor()
+
+        # Named cursors are declared on the server and only transfer
+        # `itersize` rows at a time. Cursors used outside of a transaction
+        # must be held.
+        cursor = connection.connection.cursor(
+            name='avocado_{0}'.format(uuid4().hex),
+            withhold=connection.features.uses_autocommit)
+        cursor.itersize = itersize
+
+        try:
+            cursor.execute(sql, params)
+
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+    else:
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(sql, params)
+
+            while True:
+                rows = cursor.fetchmany(itersize)
+
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+
+def stream_results(queryset, itersize=None):
+    """Returns an iterator over the rows of `queryset` which fetches
+    `itersize` rows at a time from the database. On PostgreSQL, a
+    server-side cursor is used so the memory used is independent of the
+    size of the result set.
+    """
+    if itersize is None:
+        itersize = settings.QUERY_STREAM_ITERSIZE
+
+    if isinstance(queryset, EmptyQuerySet):
+        return iter([])
+
+    compiler = queryset.query.get_compiler(queryset.db)
+
+    # Backends that convert the column values in Python rely on the
+    # compiler to iterate over the results
+    if hasattr(compiler, 'resolve_columns'):
+        return compiler.results_iter()
+
+    try:
+        sql, params = compiler.as_sql()
+    except EmptyResultSet:
+        return iter([])
+
+    return _fetch(connections[queryset.db], sql, params, itersize)
+
+
+def _get_partition_queryset(processor, lookups):
+    return trees[processor.tree].get_queryset().filter(**lookups)\
+        .order_by('pk')
+
+
+def _imap(pool, func, tasks, size):
+    """Same as `pool.imap()`, but at most `size` tasks are submitted ahead
+    of the result being consumed. The results not consumed yet are held in
+    memory, so this bounds the memory used if the results are consumed
+    more slowly than they are produced.
+    """
+    pending = deque()
+
+    for task in tasks:
+        if len(pending) >= size:
+            yield pending.popleft().get()
+
+        pending.append(pool.apply_async(func, (task,)))
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def _terminate_after(iterable, pool):
+    """Yields the items of `iterable` and terminates the `pool` once it is
+    exhausted or closed.
+    """
+    try:
+        for item in iterable:
+            yield item
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _format_partition(task):
+    """Returns the formatted rows of a partition. Runs in the processes of
+    `QueryProcessor.export_partitions()`.
+    """
+    processor, exporter, lookups, kwargs = task
+
+    kwargs['queryset'] = _get_partition_queryset(processor, lookups)
+    iterable, kwargs = processor._get_export_iterable(exporter, kwargs)
+
+    return list(exporter.read_tuples(iterable, **kwargs))
+
+
+def _write_partition(task):
+    """Writes a partition to a temporary file and returns its path. Runs in
+    the processes of `QueryProcessor.export_partitions()`.
+    """
+    processor, exporter, lookups, args, kwargs = task
+
+    kwargs['queryset'] = _get_partition_queryset(processor, lookups)
+    fd, path = tempfile.mkstemp(suffix='.' + exporter.file_extension)
+
+    with os.fdopen(fd, 'wb') as buff:
+        processor.export(exporter, buff=buff, *args, **kwargs)
+
+    return path
+
+
+class Page(object):
+    """A page of rows produced by keyset pagination along with the opaque
+    cursors for fetching the next and previous pages. A cursor is None if
+    there is no adjacent page in that direction.
+    """
+    def __init__(self, rows, next_cursor=None, previous_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
 
 class QueryProcessor(object):
     """Prepares and builds a QuerySet for export.
@@ -12,27 +182,338 @@ class QueryProcessor(object):
     Overriding or extending these methods enable customizing the behavior
     pre/post-construction of the query.
     """
+    # The maximum number of objects per partition of merged partitioned
+    # exports, see `export_partitions()`
+    partition_size = 10000
+
     def __init__(self, context=None, view=None, tree=None, include_pk=True):
         self.context = context
         self.view = view
         self.tree = tree
         self.include_pk = include_pk
 
-    def get_queryset(self, queryset=None, **kwargs):
-        "Returns a queryset based on the context and view."
+    def get_queryset(self, queryset=None, representations=None, **kwargs):
+        """Returns a queryset based on the context and view.
+
+        `representations` determines the columns selected for the view's
+        concepts. Pass `exporter.get_representations()` to only select the
+        columns the exporter uses.
+        """
         if self.context:
             queryset = \
                 self.context.apply(queryset=queryset, tree=self.tree)
 
         if self.view:
             queryset = self.view.apply(queryset=queryset, tree=self.tree,
-                                       include_pk=self.include_pk)
+                                       include_pk=self.include_pk,
+                                       representations=representations)
 
         if queryset is None:
             queryset = trees[self.tree].get_queryset().values('pk')
 
         return queryset
 
+    def count(self, queryset=None, distinct=True, **kwargs):
+        """Returns the number of distinct objects if `distinct` is true,
+        otherwise the number of records based on the context and view.
+        """
+        if self.context:
+            context_node = self.context.compile(tree=self.tree)
+        else:
+            context_node = parsers.datacontext.Node(tree=self.tree)
+
+        if self.view:
+            view_node = self.view.parse(tree=self.tree)
+        else:
+            view_node = parsers.dataview.Node(tree=self.tree)
+
+        node = parsers.dataquery.Node(context_node, view_node)
+        return node.count(queryset=queryset, distinct=distinct)
+
+    def get_export_queryset(self, exporter, force_distinct=True,
+                            queryset=None, **kwargs):
+        """Returns a pair of the queryset for `exporter` and the
+        `force_distinct` value to pass to the exporter's `read()`.
+
+        If the view allows it, the rows are made distinct in SQL and
+        `force_distinct` is false. This is not possible if columns in
+        addition to the exported ones must be selected to support the
+        ordering, in which case the rows are made distinct by the exporter
+        using `force_distinct`.
+        """
+        if not force_distinct or not self.view:
+            return self.get_queryset(queryset=queryset, **kwargs), \
+                force_distinct
+
+        node = self.view.parse(tree=self.tree)
+
+        if node.selects_sort_columns(kwargs.get('representations')):
+            return self.get_queryset(queryset=queryset, **kwargs), \
+                force_distinct
+
+        if queryset is None:
+            queryset = trees[self.tree].get_queryset()
+
+        # Rows are only distinct without DISTINCT if the primary key is
+        # selected and the view does not join to-many relationships. The
+        # context applies DISTINCT itself if it joins to-many relationships.
+        if not self.include_pk or node.joins_to_many():
+            queryset = queryset.distinct()
+
+        return self.get_queryset(queryset=queryset, **kwargs), False
+
+    def export(self, exporter, *args, **kwargs):
+        """Writes the rows of the query using `exporter` and returns the
+        output of the exporter's `write()`.
+
+        The `offset`, `limit`, `force_distinct`, `stream` and `itersize`
+        keyword arguments are supported along with the `queryset` and
+        `representations` of `get_queryset()`. The `representations`
+        default to the exporter's `get_representations()`. All other
+        arguments are passed to the exporter's `write()`.
+
+        If the rows are made distinct in SQL, see `get_export_queryset()`,
+        the `offset` and `limit` are applied in SQL as well rather than
+        reading and discarding the rows before the offset. For keyset
+        pagination of the rows, see `get_page()`.
+        """
+        iterable, kwargs = self._get_export_iterable(exporter, kwargs)
+        return exporter.write(iterable, *args, **kwargs)
+
+    def stream_export(self, exporter, *args, **kwargs):
+        """Same as `export()`, but returns the output of the exporter's
+        `stream()`, a generator of chunks of the output that can back a
+        `StreamingHttpResponse`.
+        """
+        iterable, kwargs = self._get_export_iterable(exporter, kwargs)
+        return exporter.stream(iterable, *args, **kwargs)
+
+    def cached_export(self, exporter, *args, **kwargs):
+        """Same as `export()`, but the output is written to a file which is
+        cached on disk until the data of the fields referenced by the query
+        changes, see `avocado.query.exports`. The file is returned opened
+        for reading, e.g. to back a `StreamingHttpResponse`.
+        """
+        return export_cache.get(self, exporter, *args, **kwargs)
+
+    def _get_export_iterable(self, exporter, kwargs):
+        """Pops the options of `export()` from `kwargs` and returns the
+        iterable of rows and the keyword arguments for the exporter.
+        """
+        offset = kwargs.pop('offset', None)
+        limit = kwargs.pop('limit', None)
+        force_distinct = kwargs.pop('force_distinct', True)
+        stream = kwargs.pop('stream', False)
+        itersize = kwargs.pop('itersize', None)
+
+        # Only the representations the formatters use are selected
+        representations = kwargs.pop('representations', None)
+        if representations is None:
+            representations = exporter.get_representations()
+
+        queryset, force_distinct = self.get_export_queryset(
+            exporter, force_distinct=force_distinct,
+            queryset=kwargs.pop('queryset', None),
+            representations=representations)
+
+        if not force_distinct:
+            queryset = self._slice(queryset, offset, limit)
+            offset = limit = None
+
+        if stream:
+            iterable = stream_results(queryset, itersize=itersize)
+        else:
+            iterable = self._get_results(queryset)
+
+        kwargs.update(force_distinct=force_distinct, offset=offset,
+                      limit=limit)
+
+        return iterable, kwargs
+
+    def get_partitions(self, n=1, size=None):
+        """Returns up to `n` ranges of the root primary key which partition
+        the objects matching the context into parts of about the same size.
+        If `size` is given, there are as many ranges as needed for the parts
+        to have at most `size` objects. Each range is a pair of the lower
+        bound, inclusive, and the upper bound, exclusive, where `None`
+        denotes an open bound.
+        """
+        queryset = None
+
+        if self.context:
+            queryset = self.context.apply(tree=self.tree)
+
+        if queryset is None:
+            queryset = trees[self.tree].get_queryset()
+
+        pks = queryset.order_by('pk').values_list('pk', flat=True)
+        count = pks.count()
+
+        if size:
+            n = max(n, -(-count // size))
+
+        # The position of the first object of each part but the first
+        positions = set(count * i // n for i in range(1, n))
+        positions.discard(0)
+
+        bounds = []
+
+        if positions:
+            last = max(positions)
+
+            # The primary keys are read in a single pass rather than one
+            # query per bound
+            for i, (pk,) in enumerate(stream_results(pks.values_list('pk'))):
+                if i in positions and (not bounds or bounds[-1] != pk):
+                    bounds.append(pk)
+
+                if i == last:
+                    break
+
+        bounds = [None] + bounds + [None]
+
+        return zip(bounds[:-1], bounds[1:])
+
+    def export_partitions(self, exporter, partitions=None, processes=None,
+                          parts=False, *args, **kwargs):
+        """Exports the rows of the query in `partitions` ranges of the root
+        primary key that are formatted in parallel by a pool of `processes`.
+        By default, there is one process per CPU. If `processes` is 0, the
+        partitions are exported in this process.
+
+        The formatted rows of the partitions are merged in order and written
+        by `exporter`, the output of `write()` is returned. If the output is
+        a generator, the processes are terminated once it is exhausted or
+        closed rather than on return. Since the rows
+        are ordered by the primary key, the view must not define an
+        ordering. The `offset` and `limit` apply to the merged rows. The
+        formatted rows of a partition are sent back from the process as a
+        whole, so by default there are as many partitions as needed for
+        each to have at most `partition_size` objects. Only a few
+        partitions per process are formatted ahead of being written.
+
+        If `parts` is true, each partition is written as a separate file
+        to a zip file written to the `buff` keyword argument, which is
+        returned. In this case each part is ordered by the view's ordering
+        and there is one partition per process by default.
+
+        The rows must include the primary key, otherwise rows of different
+        partitions could be duplicates of each other. The other options of
+        `export()` are supported. The processor, the exporter and the
+        arguments must be picklable to be sent to the processes.
+
+        The database connections are closed before the processes are
+        started so they are not shared with them. A ValueError is raised if
+        a transaction has uncommitted changes since they would be lost.
+        """
+        if not self.include_pk:
+            raise ValueError('Partitioned exports require the primary key '
+                             'to be included')
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        if partitions is not None:
+            ranges = self.get_partitions(partitions)
+        elif parts:
+            ranges = self.get_partitions(max(processes, 1))
+        else:
+            ranges = self.get_partitions(max(processes, 1),
+                                         size=self.partition_size)
+
+        lookups = []
+
+        for lower, upper in ranges:
+            _lookups = {}
+
+            if lower is not None:
+                _lookups['pk__gte'] = lower
+            if upper is not None:
+                _lookups['pk__lt'] = upper
+
+            lookups.append(_lookups)
+
+        if parts:
+            if 'offset' in kwargs or 'limit' in kwargs:
+                raise ValueError('The offset and limit are not supported '
+                                 'for parts')
+
+            buff = kwargs.pop('buff', None)
+            func = _write_partition
+            tasks = [(self, exporter, x, args, dict(kwargs))
+                     for x in lookups]
+        else:
+            if self.view and self.view.parse(tree=self.tree).ordering:
+                raise ValueError('Merged partitions are ordered by the '
+                                 'primary key, the view must not define '
+                                 'an ordering')
+
+            offset = kwargs.pop('offset', None) or 0
+            limit = kwargs.pop('limit', None)
+
+            # Only the options of the query are sent to the processes
+            options = {}
+            for key in ('force_distinct', 'stream', 'itersize',
+                        'representations'):
+                if key in kwargs:
+                    options[key] = kwargs.pop(key)
+
+            func = _format_partition
+            tasks = [(self, exporter, x, dict(options)) for x in lookups]
+
+        if processes:
+            for connection in connections.all():
+                if transaction.is_dirty(using=connection.alias):
+                    raise ValueError('The transaction must be committed '
+                                     'before a partitioned export')
+
+            # The processes must not share the database connections
+            for connection in connections.all():
+                connection.close()
+
+            pool = multiprocessing.Pool(processes)
+        else:
+            pool = None
+
+        try:
+            if pool is not None:
+                results = _imap(pool, func, tasks, processes * 2)
+            else:
+                results = (func(x) for x in tasks)
+
+            if not parts:
+                rows = chain.from_iterable(results)
+
+                if offset or limit is not None:
+                    stop = None if limit is None else offset + limit
+                    rows = islice(rows, offset, stop)
+
+                output = exporter.write(FormattedRows(rows), *args, **kwargs)
+
+                # Lazy writers only read the rows as their output is
+                # consumed, so the pool must outlive the return
+                if pool is not None and inspect.isgenerator(output):
+                    output, pool = _terminate_after(output, pool), None
+
+                return output
+
+            zip_file = exporter.get_zip_file(buff)
+
+            for i, path in enumerate(results):
+                try:
+                    zip_file.write(path, 'part-{0:04d}.{1}'.format(
+                        i + 1, exporter.file_extension))
+                finally:
+                    os.remove(path)
+
+            exporter.close_zip_file(zip_file)
+
+            return zip_file
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
     def get_exporter(self, klass, **kwargs):
         "Returns an exporter prepared for the queryset."
         exporter = klass(self.view)
@@ -43,26 +524,192 @@ class QueryProcessor(object):
 
         return exporter
 
-    def get_iterable(self, offset=None, limit=None, **kwargs):
-        "Returns an iterable that can be used by an exporter."
-        queryset = self.get_queryset(**kwargs)
+    def get_iterable(self, offset=None, limit=None, stream=False,
+                     itersize=None, **kwargs):
+        """Returns an iterable that can be used by an exporter.
+
+        If `stream` is true, the rows are fetched lazily `itersize` rows at
+        a time rather than being buffered, see `stream_results`.
+        """
+        queryset = self._slice(self.get_queryset(**kwargs), offset, limit)
+
+        if stream:
+            return stream_results(queryset, itersize=itersize)
+
+        return self._get_results(queryset)
 
+    def _slice(self, queryset, offset=None, limit=None):
         if offset is not None and limit is not None:
-            queryset = queryset[offset:offset + limit]
-        elif offset is not None:
-            queryset = queryset[offset:]
-        elif limit is not None:
-            queryset = queryset[:limit]
+            return queryset[offset:offset + limit]
+        if offset is not None:
+            return queryset[offset:]
+        if limit is not None:
+            return queryset[:limit]
+        return queryset
 
+    def _get_results(self, queryset):
         # ModelTreeQuerySet has a raw method defined, but fallback
         # to the creating a results iter if not present.
         if hasattr(queryset, 'raw'):
-            iterable = queryset.raw()
+            return queryset.raw()
+
+        compiler = queryset.query.get_compiler(queryset.db)
+        return compiler.results_iter()
+
+    def get_order_by(self):
+        """Returns the directional lookups used for keyset pagination. These
+        are the view's ordering followed by the root primary key which makes
+        the ordering total.
+        """
+        order_by = []
+
+        if self.view:
+            node = self.view.parse(tree=self.tree)
+
+            # Rows of views joining to-many relationships are not uniquely
+            # identified by the primary key
+            if node.joins_to_many():
+                raise ValueError('Keyset pagination is not supported for '
+                                 'views with to-many relationships')
+
+            order_by = node.get_order_by()
+
+        return order_by + ['pk']
+
+    def _get_keys(self, pks, lookups):
+        "Returns a dict of the ordering values for the rows `pks`."
+        queryset = trees[self.tree].get_queryset().filter(pk__in=pks)\
+            .values_list('pk', *lookups)
+
+        return dict((row[0], row[1:]) for row in queryset)
+
+    def _make_cursor(self, order_by, values, direction):
+        return signing.dumps({
+            'order_by': get_digest(order_by),
+            'values': encode_value(values),
+            'direction': direction,
+        }, salt=CURSOR_SALT, compress=True)
+
+    def _load_cursor(self, cursor, order_by):
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise ValueError('Invalid cursor')
+
+        if data['order_by'] != get_digest(order_by):
+            raise ValueError('The cursor does not match the ordering')
+
+        return decode_value(data['values']), data['direction']
+
+    def _get_seek_condition(self, order_by, values, nulls_largest):
+        """Returns a condition matching the rows positioned after the row
+        with the ordering `values`.
+
+        For each lookup, the rows are matched that are equal on all the
+        preceding lookups and positioned after the value of the lookup.
+        """
+        condition = None
+        prefix = Q()
+
+        for lookup, value in zip(order_by, values):
+            ascending = not lookup.startswith('-')
+            lookup = lookup.lstrip('-')
+
+            # Determines if NULLs are positioned at the end in this direction
+            nulls_last = ascending == nulls_largest
+
+            if value is None:
+                after = None if nulls_last else \
+                    Q(**{lookup + '__isnull': False})
+                equal = Q(**{lookup + '__isnull': True})
+            else:
+                if ascending:
+                    after = Q(**{lookup + '__gt': value})
+                else:
+                    after = Q(**{lookup + '__lt': value})
+
+                if nulls_last:
+                    after = after | Q(**{lookup + '__isnull': True})
+
+                equal = Q(**{lookup: value})
+
+            if after is not None:
+                after = prefix & after
+                condition = after if condition is None else condition | after
+
+            prefix = prefix & equal
+
+        return condition
+
+    def get_page(self, limit, cursor=None, **kwargs):
+        """Returns a `Page` of at most `limit` rows using keyset pagination.
+
+        The first page is returned if `cursor` is None. Otherwise `cursor`
+        is the `next_cursor` or `previous_cursor` of a page returned by this
+        method. Rather than skipping rows with an OFFSET, the rows are
+        filtered to those positioned after the cursor's row relative to the
+        ordering returned by `get_order_by()`, so each page costs the same
+        independent of its position.
+
+        The primary key must be included in the rows.
+        """
+        if not self.include_pk:
+            raise ValueError('Keyset pagination requires the primary key')
+
+        order_by = self.get_order_by()
+        lookups = [x.lstrip('-') for x in order_by]
+
+        queryset = trees[self.tree].get_queryset()
+        direction = NEXT
+
+        if cursor is not None:
+            values, direction = self._load_cursor(cursor, order_by)
+
+            # Previous pages are fetched by reversing the ordering
+            if direction == PREVIOUS:
+                seek_order_by = [x[1:] if x.startswith('-') else '-' + x
+                                 for x in order_by]
+            else:
+                seek_order_by = order_by
+
+            vendor = connections[queryset.db].vendor
+            condition = self._get_seek_condition(
+                seek_order_by, values, vendor in NULLS_LARGEST_VENDORS)
+
+            # Nothing is positioned after the cursor
+            if condition is None:
+                return Page([])
+
+            queryset = queryset.filter(condition)
         else:
-            compiler = queryset.query.get_compiler(queryset.db)
-            iterable = compiler.results_iter()
+            seek_order_by = order_by
+
+        queryset = self.get_queryset(queryset=queryset, **kwargs)\
+            .order_by(*seek_order_by)
+
+        # One more row is fetched to determine if another page exists
+        rows = list(self._get_results(queryset[:limit + 1]))
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        if direction == PREVIOUS:
+            rows.reverse()
+
+        if not rows:
+            return Page(rows)
+
+        keys = self._get_keys([rows[0][0], rows[-1][0]], lookups)
+
+        next_cursor = previous_cursor = None
+
+        if more or direction == PREVIOUS:
+            next_cursor = self._make_cursor(order_by, keys[rows[-1][0]], NEXT)
+
+        if cursor is not None and (more or direction == NEXT):
+            previous_cursor = \
+                self._make_cursor(order_by, keys[rows[0][0]], PREVIOUS)
 
-        return iterable
+        return Page(rows, next_cursor, previous_cursor)
 
 
 class QueryProcessors(object):
@@ -0,0 +1,36 @@
+import json
+import hashlib
+from modeltree.tree import trees
+
+
+def get_tree_label(tree=None):
+    "Returns a stable label for `tree` which may be an alias or a model."
+    if tree is None or isinstance(tree, basestring):
+        return tree
+    if tree in trees:
+        opts = trees[tree].root_model._meta
+        return u'{0}.{1}'.format(opts.app_label, opts.module_name)
+    return unicode(tree)
+
+
+def get_digest(attrs):
+    "Returns a hex digest of the canonical JSON representation of `attrs`."
+    data = json.dumps(attrs, sort_keys=True, separators=(',', ':'))
+    return hashlib.md5(data).hexdigest()
+
+
+def get_data_versions(fields):
+    """Returns a sorted tuple of (pk, data_version) pairs for `fields`.
+
+    The versions are fetched from the database rather than taken from the
+    instances since they may have been retrieved from the cache.
+    """
+    from avocado.models import DataField
+
+    pks = set(f.pk for f in fields)
+
+    if not pks:
+        return ()
+
+    return tuple(sorted(DataField.objects.filter(pk__in=pks)
+                        .values_list('pk', 'data_version')))
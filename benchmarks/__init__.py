@@ -0,0 +1,12 @@
+"""Benchmarks of the query and export pipeline over synthetic data.
+
+Run the benchmarks and write the results as JSON:
+
+    python -m benchmarks run --rows 100000 --width 20 -o results.json
+
+Compare the results of two runs, e.g. of two releases:
+
+    python -m benchmarks compare before.json after.json
+
+See `python -m benchmarks --help` for all options.
+"""
@@ -0,0 +1,72 @@
+from random import Random
+from django.core import management
+from avocado.models import DataField, DataConcept, DataConceptField, DataView
+from benchmarks.models import create_model, generate_value
+
+
+def create_rows(model, rows, null_rate=0.0, seed=0, batch_size=10000):
+    "Inserts `rows` random rows of which `null_rate` of the values are null."
+    random = Random(seed)
+    fields = [f for f in model._meta.fields if not f.primary_key]
+
+    for start in range(0, rows, batch_size):
+        objs = []
+
+        for i in range(start, min(rows, start + batch_size)):
+            attrs = {}
+
+            for field in fields:
+                if null_rate and random.random() < null_rate:
+                    attrs[field.name] = None
+                else:
+                    attrs[field.name] = generate_value(field, random)
+
+            objs.append(model(**attrs))
+
+        model.objects.bulk_create(objs)
+
+
+def create_concepts(model, concept_width=1):
+    """Returns the concepts over the fields of `model` in order. Each concept
+    has `concept_width` fields.
+    """
+    opts = model._meta
+    label = u'{0}.{1}'.format(opts.app_label, opts.module_name)
+
+    management.call_command('avocado', 'init', label, concepts=False,
+                            quiet=True)
+
+    fields = [DataField.objects.get_by_natural_key(opts.app_label,
+                                                   opts.module_name, f.name)
+              for f in opts.fields if not f.primary_key]
+
+    concepts = []
+
+    for start in range(0, len(fields), concept_width):
+        group = fields[start:start + concept_width]
+        concept = DataConcept(name=u', '.join(f.name for f in group),
+                              published=True)
+        concept.save()
+
+        for order, field in enumerate(group):
+            DataConceptField(concept=concept, field=field,
+                             order=order).save()
+
+        concepts.append(concept)
+
+    return concepts
+
+
+def create_data(rows, width, concept_width=1, null_rate=0.0, seed=0):
+    """Creates a model of `width` fields with `rows` random rows and returns
+    the model and a view of the concepts over its fields.
+    """
+    model = create_model(width)
+    management.call_command('syncdb', interactive=False, verbosity=0)
+
+    create_rows(model, rows, null_rate=null_rate, seed=seed)
+    concepts = create_concepts(model, concept_width=concept_width)
+
+    view = DataView(json=[{'concept': c.pk} for c in concepts])
+
+    return model, view
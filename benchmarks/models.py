@@ -0,0 +1,57 @@
+"""The models of the benchmarks are created at runtime by `create_model()`
+since their width is configurable.
+"""
+from decimal import Decimal
+from datetime import date, datetime, timedelta
+from django.db import models
+
+# The fields of a model cycle through these types
+FIELD_TYPES = (
+    ('char', models.CharField, {'max_length': 100}),
+    ('integer', models.IntegerField, {}),
+    ('float', models.FloatField, {}),
+    ('boolean', models.NullBooleanField, {}),
+    ('date', models.DateField, {}),
+    ('datetime', models.DateTimeField, {}),
+    ('decimal', models.DecimalField, {'max_digits': 12,
+                                      'decimal_places': 2}),
+)
+
+# The distinct values of the char fields
+WORDS = [u'value {0}'.format(i) for i in range(50)]
+
+EPOCH = datetime(2000, 1, 1)
+
+
+def create_model(width):
+    "Returns a model with `width` fields which cycle through the types."
+    attrs = {
+        '__module__': __name__,
+        'Meta': type('Meta', (object,), {'app_label': 'benchmarks'}),
+    }
+
+    for i in range(width):
+        name, field, kwargs = FIELD_TYPES[i % len(FIELD_TYPES)]
+        attrs['{0}_{1}'.format(name, i)] = field(null=True, **kwargs)
+
+    # Models are cached by name, so each width has its own model
+    return type('Record{0}'.format(width), (models.Model,), attrs)
+
+
+def generate_value(field, random):
+    "Returns a random value for `field`."
+    if isinstance(field, models.CharField):
+        return random.choice(WORDS)
+    if isinstance(field, models.IntegerField):
+        return random.randint(0, 100000)
+    if isinstance(field, models.FloatField):
+        return random.random() * 1000
+    if isinstance(field, models.NullBooleanField):
+        return random.random() < 0.5
+    if isinstance(field, models.DateTimeField):
+        return EPOCH + timedelta(seconds=random.randint(0, 10 ** 9))
+    if isinstance(field, models.DateField):
+        return date(2000, 1, 1) + timedelta(days=random.randint(0, 10000))
+    if isinstance(field, models.DecimalField):
+        return Decimal(random.randint(0, 10 ** 8)) / 100
+    raise TypeError(u'Unsupported field {0}'.format(field.name))
@@ -0,0 +1,343 @@
+"""Runs the benchmarks and compares their results.
+
+Each benchmark is run in a forked process, so the peak resident set size
+(RSS) is measured per benchmark. The results are written as JSON.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import multiprocessing
+from datetime import datetime
+from optparse import OptionParser
+import django
+import avocado
+from avocado import export
+from avocado.export import registry as exporters
+from avocado.query.pipeline import QueryProcessor
+from benchmarks.data import create_data
+
+USAGE = """usage: python -m benchmarks run [options] [benchmark ...]
+       python -m benchmarks compare [options] BASE RESULTS"""
+
+# Benchmarks of the formatting of the rows in addition to the exporters
+READ = 'read'
+FORMAT = 'format'
+
+# ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+MAXRSS_UNIT = sys.platform == 'darwin' and 1 or 1024
+
+
+def get_peak_rss():
+    "Returns the peak resident set size of this process in bytes."
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+class Output(object):
+    """Discards the output of an exporter while measuring its size and the
+    time of the first byte. Like a response, the output cannot seek.
+    """
+    def __init__(self):
+        self.size = 0
+        self.first_byte = None
+
+    def write(self, data):
+        if data and self.first_byte is None:
+            self.first_byte = time.time()
+
+        self.size += len(data)
+
+
+def read_rows(output, processor, rows):
+    "Reads the fetched rows using `BaseExporter.read()`."
+    exporter = processor.get_exporter(export.CSVExporter)
+
+    for row in exporter.read(rows):
+        pass
+
+
+def format_rows(output, processor, rows):
+    "Formats the fetched rows using `Formatter.__call__()`."
+    exporter = processor.get_exporter(export.CSVExporter)
+
+    for formatter, start, end in exporter._get_slices():
+        for row in rows:
+            formatter(row[start:end],
+                      preferred_formats=exporter.preferred_formats)
+
+
+def export_rows(output, processor, name):
+    """Exports the rows of the query using the exporter `name`. Exporters
+    that support it are streamed.
+    """
+    exporter = processor.get_exporter(exporters[name])
+
+    if hasattr(exporter, 'stream'):
+        for chunk in processor.stream_export(exporter, stream=True):
+            output.write(chunk)
+    else:
+        processor.export(exporter, buff=output, stream=True)
+
+
+def measure(func, *args):
+    "Runs `func` and returns the measurements."
+    output = Output()
+    baseline = get_peak_rss()
+
+    start = time.time()
+    func(output, *args)
+    seconds = time.time() - start
+
+    peak = get_peak_rss()
+
+    result = {
+        'seconds': seconds,
+        'peak_rss': peak,
+        'rss_increase': peak - baseline,
+        'bytes': None,
+        'time_to_first_byte': None,
+    }
+
+    if output.first_byte is not None:
+        result['bytes'] = output.size
+        result['time_to_first_byte'] = output.first_byte - start
+
+    return result
+
+
+def _measure_child(queue, func, args):
+    try:
+        queue.put(measure(func, *args))
+    except Exception as e:
+        queue.put(e)
+
+
+def measure_isolated(func, *args):
+    "Runs `func` in a forked process and returns the measurements."
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure_child,
+                                      args=(queue, func, args))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+
+def run_benchmark(name, processor, rows, count, repeat=1, isolate=True):
+    """Runs the benchmark `name` `repeat` times and returns the result of
+    the fastest run. `rows` are the fetched rows of the query and `count`
+    is the number of rows.
+    """
+    if name == READ:
+        func, args = read_rows, (processor, rows)
+    elif name == FORMAT:
+        func, args = format_rows, (processor, rows)
+    else:
+        func, args = export_rows, (processor, name)
+
+    runs = []
+
+    for i in range(repeat):
+        if isolate:
+            runs.append(measure_isolated(func, *args))
+        else:
+            runs.append(measure(func, *args))
+
+    result = min(runs, key=lambda x: x['seconds'])
+    result['peak_rss'] = max(x['peak_rss'] for x in runs)
+
+    result.update({
+        'name': name,
+        'rows': count,
+        'rows_per_second': count / result['seconds']
+        if result['seconds'] else None,
+    })
+
+    return result
+
+
+def get_benchmarks():
+    "Returns the names of all benchmarks."
+    return [READ, FORMAT] + [x for x, _ in exporters.choices]
+
+
+def run(names=None, rows=10000, width=10, concept_width=1, null_rate=0.1,
+        seed=0, repeat=3, isolate=True):
+    """Generates the data and runs the benchmarks `names`, by default all
+    of them. Returns the results along with the environment and options.
+    """
+    if not names:
+        names = get_benchmarks()
+
+    for name in names:
+        if name not in (READ, FORMAT) and name not in exporters:
+            raise ValueError(u'Unknown benchmark "{0}"'.format(name))
+
+    started = time.time()
+    model, view = create_data(rows, width, concept_width=concept_width,
+                              null_rate=null_rate, seed=seed)
+    setup = time.time() - started
+
+    processor = QueryProcessor(view=view, tree=model)
+
+    fetched = None
+    if READ in names or FORMAT in names:
+        fetched = list(processor.get_iterable())
+
+    results = []
+
+    for name in names:
+        results.append(run_benchmark(name, processor, fetched, rows,
+                                     repeat=repeat, isolate=isolate))
+
+    return {
+        'environment': {
+            'avocado': avocado.get_version(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now().isoformat(),
+        },
+        'options': {
+            'rows': rows,
+            'width': width,
+            'concept_width': concept_width,
+            'null_rate': null_rate,
+            'seed': seed,
+            'repeat': repeat,
+            'isolate': isolate,
+        },
+        'setup_seconds': setup,
+        'results': results,
+    }
+
+
+def compare(base, results, threshold=0.1):
+    """Returns the comparison of the results of two runs by benchmark and
+    whether the throughput of any benchmark regressed by more than
+    `threshold`.
+    """
+    base = dict((x['name'], x) for x in base['results'])
+    comparison = []
+    regressed = False
+
+    for result in results['results']:
+        before = base.get(result['name'])
+
+        if before is None:
+            continue
+
+        change = None
+        if before['rows_per_second'] and result['rows_per_second']:
+            change = result['rows_per_second'] / \
+                before['rows_per_second'] - 1
+
+            if change < -threshold:
+                regressed = True
+
+        rss_change = None
+        if before['peak_rss']:
+            rss_change = result['peak_rss'] / float(before['peak_rss']) - 1
+
+        comparison.append({
+            'name': result['name'],
+            'before': before['rows_per_second'],
+            'after': result['rows_per_second'],
+            'change': change,
+            'peak_rss_change': rss_change,
+        })
+
+    return comparison, regressed
+
+
+def _percent(value):
+    if value is None:
+        return '-'
+    return '{0:+.1f}%'.format(value * 100)
+
+
+def _number(value):
+    if value is None:
+        return '-'
+    return '{0:.0f}'.format(value)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if not argv or argv[0] not in ('run', 'compare'):
+        print(USAGE)
+        sys.exit(2)
+
+    command, argv = argv[0], argv[1:]
+    parser = OptionParser(usage=USAGE)
+
+    if command == 'compare':
+        parser.add_option('--threshold', type='float', default=0.1,
+                          help='Fraction of the rows per second a benchmark '
+                          'may regress by before failing. Default is 0.1')
+        options, args = parser.parse_args(argv)
+
+        if len(args) != 2:
+            parser.error('The base and compared results are required')
+
+        with open(args[0]) as base, open(args[1]) as results:
+            comparison, regressed = compare(json.load(base),
+                                            json.load(results),
+                                            threshold=options.threshold)
+
+        print('{0:<12} {1:>12} {2:>12} {3:>9} {4:>9}'.format(
+            'benchmark', 'before', 'after', 'change', 'peak rss'))
+
+        for x in comparison:
+            print('{0:<12} {1:>12} {2:>12} {3:>9} {4:>9}'.format(
+                x['name'], _number(x['before']), _number(x['after']),
+                _percent(x['change']), _percent(x['peak_rss_change'])))
+
+        sys.exit(regressed and 1 or 0)
+
+    parser.add_option('--rows', type='int', default=10000,
+                      help='Number of rows to generate. Default is 10000')
+    parser.add_option('--width', type='int', default=10,
+                      help='Number of fields of the model. Default is 10')
+    parser.add_option('--concept-width', type='int', default=1,
+                      help='Number of fields per concept. Default is 1')
+    parser.add_option('--null-rate', type='float', default=0.1,
+                      help='Fraction of null values. Default is 0.1')
+    parser.add_option('--seed', type='int', default=0,
+                      help='Seed of the generated data. Default is 0')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='Number of runs of each benchmark, the fastest '
+                      'is reported. Default is 3')
+    parser.add_option('--no-isolate', action='store_false', dest='isolate',
+                      default=hasattr(os, 'fork'),
+                      help='Run the benchmarks in this process rather than '
+                      'in forked processes')
+    parser.add_option('-o', '--output',
+                      help='File to write the results to. Default is stdout')
+
+    options, names = parser.parse_args(argv)
+
+    unknown = [x for x in names if x not in get_benchmarks()]
+    if unknown:
+        parser.error(u'Unknown benchmarks: {0}. Choose from {1}'.format(
+            ', '.join(unknown), ', '.join(get_benchmarks())))
+
+    results = run(names, rows=options.rows, width=options.width,
+                  concept_width=options.concept_width,
+                  null_rate=options.null_rate, seed=options.seed,
+                  repeat=options.repeat, isolate=options.isolate)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+        sys.stdout.write('\n')
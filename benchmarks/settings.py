@@ -0,0 +1,43 @@
+# Settings used by the benchmarks. The data is generated in an in-memory
+# SQLite database for every run.
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+INSTALLED_APPS = (
+    'django.contrib.sites',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+
+    'avocado',
+    'benchmarks',
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+SITE_ID = 1
+
+SECRET_KEY = 'benchmarks'
+
+# Formatter errors are logged once per field and are not of interest here
+LOGGING = {
+    'version': 1,
+    'handlers': {
+        'null': {
+            'class': 'django.utils.log.NullHandler',
+        },
+    },
+    'loggers': {
+        'avocado': {
+            'handlers': ['null'],
+            'propagate': False,
+        },
+    },
+}
@@ -16,7 +16,8 @@ if sys.version_info < (2, 7):
 kwargs = {
     # Packages
     'packages': find_packages(exclude=['tests', '*.tests', '*.tests.*',
-                                       'tests.*']),
+                                       'tests.*', 'benchmarks',
+                                       'benchmarks.*']),
     'include_package_data': True,
 
     # Dependencies
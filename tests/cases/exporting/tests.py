@@ -1,15 +1,25 @@
 import os
+import json
+from datetime import datetime
+from decimal import Decimal
+from zipfile import ZipFile
+from cStringIO import StringIO
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 from django.test import TestCase
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template import Template
 from django.core import management
+from django.core.serializers.json import DjangoJSONEncoder
 from avocado import export
-from avocado.formatters import RawFormatter
+from avocado.formatters import Formatter, RawFormatter
 from avocado.models import DataField, DataConcept, DataConceptField, DataView
 from ... import models
 
 __all__ = ['FileExportTestCase', 'ResponseExportTestCase',
-           'ForceDistinctRegressionTestCase']
+           'ForceDistinctRegressionTestCase', 'DistinctModeTestCase']
 
 
 class ExportTestCase(TestCase):
@@ -42,6 +52,32 @@ class ExportTestCase(TestCase):
         rows = list(self.exporter.write(self.query, offset=2, limit=2))
         self.assertEqual([r[0] for r in rows], [6, 1])
 
+    def test_batch_size(self):
+        query = list(self.query)
+        rows = list(self.exporter.write(query))
+        self.exporter.batch_size = 4
+        self.assertEqual(list(self.exporter.write(query)), rows)
+        self.assertEqual(list(self.exporter.write(query, offset=1, limit=4)),
+                         rows[1:5])
+
+    def test_custom_call(self):
+        class PrefixFormatter(Formatter):
+            def __call__(self, values, *args, **kwargs):
+                return OrderedDict([('pk', u'#{0}'.format(values[0]))])
+
+        class PrefixRawFormatter(RawFormatter):
+            def __call__(self, values, *args, **kwargs):
+                return OrderedDict([('pk', u'#{0}'.format(values[0]))])
+
+        # Rows are formatted one at a time by formatters overriding
+        # __call__ rather than bypassing the override with the batch method
+        query = list(self.query)
+
+        for klass in (PrefixFormatter, PrefixRawFormatter):
+            self.exporter.params[0] = (klass(keys=['pk']), 1)
+            rows = list(self.exporter.write(query, limit=2))
+            self.assertEqual([r[0] for r in rows], [u'#2', u'#4'])
+
 
 class FileExportTestCase(TestCase):
     fixtures = ['employee_data.json']
@@ -84,16 +120,56 @@ class FileExportTestCase(TestCase):
         buff.seek(0)
         self.assertEqual(len(buff.read()), 246)
 
+    def test_csv_stream(self):
+        exporter = export.CSVExporter(self.concepts)
+        chunks = list(exporter.stream(self.query, chunk_size=50))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(x) >= 50 for x in chunks[:-1]))
+        self.assertEqual(''.join(chunks),
+                         exporter.write(self.query).getvalue())
+
+    def test_concept_fields(self):
+        concepts = list(DataConcept.objects.exclude(
+            pk=self.concepts[0].pk)) + self.concepts
+
+        # The fields of all concepts are loaded in a single query
+        with self.assertNumQueries(1):
+            exporter = export.CSVExporter(concepts)
+
+        self.assertEqual(exporter.row_length, DataConceptField.objects.count())
+        self.assertEqual(exporter.params[-1][0].keys, ['first_name',
+                         'last_name', 'is_manager', 'name', 'salary'])
+
+    def test_representations(self):
+        pk = self.concepts[0].pk
+        exporter = export.CSVExporter(self.concepts)
+        self.assertEqual(exporter.get_representations(), {pk: 'label'})
+
+        exporter.representation = 'value'
+        self.assertEqual(exporter.get_representations(), {pk: 'value'})
+
     def test_excel(self):
         fname = 'excel_export.xlsx'
         exporter = export.ExcelExporter(self.concepts)
         exporter.write(self.query, fname)
         self.assertTrue(os.path.exists(fname))
-        # Observed slight size differences..
-        l = len(open(fname).read())
-        self.assertTrue(6220 <= l <= 6250)
+        self.assertEqual(len(open(fname).read()), 2908)
         os.remove(fname)
 
+    def test_excel_dictionary(self):
+        exporter = export.ExcelExporter(self.concepts)
+        rows = export.FormattedRows(list(exporter.read_tuples(self.query)))
+
+        # The dictionary is built from the fields loaded by the formatters
+        buff = StringIO()
+        with self.assertNumQueries(0):
+            exporter.write(rows, buff)
+
+        sheet = ZipFile(buff).read('xl/worksheets/sheet2.xml')
+        self.assertEqual(sheet.count('<row '), 6)
+        self.assertTrue('<t>Salary</t>' in sheet)
+
     def test_sas(self):
         fname = 'sas_export.zip'
         exporter = export.SASExporter(self.concepts)
@@ -102,6 +178,24 @@ class FileExportTestCase(TestCase):
         self.assertEqual(len(open(fname).read()), 1335)
         os.remove(fname)
 
+    def test_sas_datetime(self):
+        start_time = DataField.objects.get_by_natural_key(
+            'tests', 'meeting', 'start_time')
+        concept = DataConcept(name='Meeting')
+        concept.save()
+        DataConceptField(concept=concept, field=start_time).save()
+
+        models.Meeting(office=models.Office.objects.all()[0],
+                       start_time=datetime(2013, 5, 1, 9, 30)).save()
+        query = models.Meeting.objects.values_list('start_time')
+
+        buff = StringIO()
+        export.SASExporter([concept]).write(query, buff)
+
+        script = ZipFile(buff).read('script.sas')
+        # Both the informat and the format are set
+        self.assertEqual(script.count('DATETIMEw.d'), 2)
+
     def test_r(self):
         fname = 'r_export.zip'
         exporter = export.RExporter(self.concepts)
@@ -110,12 +204,118 @@ class FileExportTestCase(TestCase):
         self.assertEqual(len(open(fname).read()), 754)
         os.remove(fname)
 
+    def test_zip_data(self):
+        for klass in (export.RExporter, export.SASExporter):
+            buff = StringIO()
+            exporter = klass(self.concepts)
+            exporter.write(self.query, buff)
+
+            data_exporter = export.CSVExporter(self.concepts)
+            data_exporter.preferred_formats = exporter.preferred_formats
+
+            self.assertEqual(ZipFile(buff).read('data.csv'),
+                             data_exporter.write(self.query).getvalue())
+
+    def test_parquet(self):
+        exporter = export.ParquetExporter(self.concepts)
+        exporter.row_group_size = 4
+        buff = StringIO()
+        exporter.write(self.query, buff)
+
+        zip_file = ZipFile(buff)
+        data = zip_file.read('data.parquet')
+        self.assertEqual(data[:4], 'PAR1')
+        self.assertEqual(data[-4:], 'PAR1')
+
+        dictionary = json.loads(zip_file.read('dictionary.json'))
+        self.assertEqual([(x['name'], x['type']) for x in dictionary], [
+            ('first_name', 'string'),
+            ('last_name', 'string'),
+            ('is_manager', 'boolean'),
+            ('name', 'string'),
+            ('salary', 'integer'),
+        ])
+        self.assertEqual(dictionary[0]['description'], 'First Name')
+        self.assertEqual(dictionary[0]['concept'], 'Employee')
+
+    def test_parquet_widen(self):
+        rows = [list(x) for x in self.query]
+        rows[3][2] = 'yes'
+        rows[4][4] = 1.5
+
+        # The values of later row groups widen the types of the columns
+        exporter = export.ParquetExporter(self.concepts)
+        exporter.row_group_size = 2
+        buff = StringIO()
+        exporter.write(rows, buff)
+
+        zip_file = ZipFile(buff)
+        data = zip_file.read('data.parquet')
+        self.assertEqual(data[-4:], 'PAR1')
+
+        dictionary = json.loads(zip_file.read('dictionary.json'))
+        self.assertEqual([x['type'] for x in dictionary],
+                         ['string', 'string', 'string', 'string', 'double'])
+
+        self.assertEqual(export._parquet.widen_column_type(
+            'integer', [1, None, 2]), 'integer')
+        self.assertEqual(export._parquet.widen_column_type(
+            'date', [1.5]), 'string')
+        self.assertEqual(export._parquet.widen_column_type(
+            'double', [Decimal('1.5'), 2]), 'double')
+
+    def test_parquet_double(self):
+        rows = [list(x) for x in self.query]
+        rows[0][4] = Decimal('1.5')
+        rows[3][4] = 2.5
+
+        # Double columns keep their type in later row groups
+        exporter = export.ParquetExporter(self.concepts)
+        exporter.row_group_size = 2
+        buff = StringIO()
+        exporter.write(rows, buff)
+
+        zip_file = ZipFile(buff)
+        data = zip_file.read('data.parquet')
+        self.assertEqual(data[-4:], 'PAR1')
+
+        dictionary = json.loads(zip_file.read('dictionary.json'))
+        self.assertEqual([x['type'] for x in dictionary],
+                         ['string', 'string', 'boolean', 'string', 'double'])
+
     def test_json(self):
         exporter = export.JSONExporter(self.concepts)
         buff = exporter.write(self.query)
         buff.seek(0)
         self.assertEqual(len(buff.read()), 639)
 
+    def test_json_stream(self):
+        exporter = export.JSONExporter(self.concepts)
+        chunks = list(exporter.stream(self.query, chunk_size=100))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(len(''.join(chunks)), 639)
+
+    def test_ndjson(self):
+        exporter = export.NDJSONExporter(self.concepts)
+        lines = exporter.write(self.query).getvalue().splitlines()
+
+        rows = json.loads(export.JSONExporter(self.concepts)
+                          .write(self.query).getvalue())
+        self.assertEqual([json.loads(x) for x in lines], rows)
+        self.assertEqual(len(lines), 6)
+
+    def test_read_tuples(self):
+        exporter = export.JSONExporter(self.concepts)
+        rows = list(exporter.read(self.query))
+
+        self.assertEqual(list(exporter.read_tuples(self.query)), [
+            tuple((tuple(x.keys()), tuple(x.values())) for x in row)
+            for row in rows
+        ])
+        self.assertEqual(exporter.write(self.query).getvalue(),
+                         json.dumps(rows, cls=DjangoJSONEncoder))
+
     def test_html(self):
         exporter = export.HTMLExporter(self.concepts)
         template = Template("""<table>
@@ -139,13 +339,28 @@ class ResponseExportTestCase(FileExportTestCase):
         exporter.write(self.query, response)
         self.assertEqual(len(response.content), 246)
 
+    def test_csv_stream(self):
+        exporter = export.CSVExporter(self.concepts)
+        response = StreamingHttpResponse(exporter.stream(self.query))
+        self.assertEqual(len(''.join(response.streaming_content)), 246)
+
     def test_excel(self):
         exporter = export.ExcelExporter(self.concepts)
         response = HttpResponse()
         exporter.write(self.query, response)
-        # Observed slight size differences..
-        l = len(response.content)
-        self.assertTrue(6220 <= l <= 6250)
+        self.assertEqual(len(response.content), 2908)
+
+    def test_excel_stream(self):
+        exporter = export.ExcelExporter(self.concepts)
+        response = StreamingHttpResponse(exporter.stream(self.query,
+                                                         chunk_size=1024))
+        content = ''.join(response.streaming_content)
+        self.assertEqual(len(content), 2908)
+
+        zip_file = ZipFile(StringIO(content))
+        sheet = zip_file.read('xl/worksheets/sheet1.xml')
+        self.assertEqual(sheet.count('<row '), 7)
+        self.assertTrue('<c r="E2"><v>15000</v></c>' in sheet)
 
     def test_sas(self):
         exporter = export.SASExporter(self.concepts)
@@ -255,3 +470,28 @@ class ForceDistinctRegressionTestCase(TestCase):
             (1, u'Eric', u'Smith'),
             (2, u'Erin', u'Jones')
         ])
+
+
+class DistinctModeTestCase(TestCase):
+    def setUp(self):
+        self.exporter = export.BaseExporter()
+        self.exporter.add_formatter(RawFormatter(keys=['a']))
+
+        # The hashes of these rows collide
+        self.rows = [(-1, 'x'), (-2, 'y'), (-1, 'z'), (-2, 'y'), (-1, 'x')]
+
+    def read(self, force_distinct):
+        rows = self.exporter.write(self.rows, force_distinct=force_distinct)
+        return [r[0] for r in rows]
+
+    def test_modes(self):
+        self.assertEqual(self.read(False), [-1, -2, -1, -2, -1])
+        self.assertEqual(self.read(True), [-1, -2])
+        self.assertEqual(self.read(export.DISK), [-1, -2])
+        # Only consecutive rows are compared
+        self.assertEqual(self.read(export.SORTED), [-1, -2, -1, -2, -1])
+        self.rows.sort()
+        self.assertEqual(self.read(export.SORTED), [-2, -1])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.read, 'foo')
@@ -5,7 +5,7 @@ except ImportError:
 from django.test import TestCase
 from django.core import management
 from avocado.models import DataField, DataConcept, DataConceptField
-from avocado.formatters import Formatter
+from avocado.formatters import Formatter, FormatterException
 
 
 __all__ = ['FormatterTestCase']
@@ -91,3 +91,74 @@ class FormatterTestCase(TestCase):
             ('title__name', 'one'),
             ('project__name', 'two'),
         ]), f(['one', 'two']))
+
+    def test_format_batch(self):
+        rows = [self.values, ['Programmer', '1,000', False], [None] * 3]
+
+        for formats in (['string'], ['number'], ['boolean'], ['coded']):
+            self.assertEqual(
+                self.f.format_batch(rows, preferred_formats=formats),
+                [self.f(x, preferred_formats=formats) for x in rows])
+
+        self.assertEqual(self.f.format_batch([]), [])
+
+    def test_format_batch_multiple(self):
+        class HtmlFormatter(Formatter):
+            def to_html(self, values, **context):
+                if values['name'] is None:
+                    raise ValueError
+                return u'<span>{0}</span>'.format(values['name'])
+            to_html.process_multiple = True
+
+        f = HtmlFormatter(self.concept)
+        rows = [self.values, [None, 1, False]]
+
+        self.assertEqual(f.format_batch(rows, preferred_formats=['html']), [
+            OrderedDict([('Title', u'<span>CEO</span>')]),
+            OrderedDict([('name', None), ('salary', 1), ('boss', False)]),
+        ])
+
+    def test_format_plan(self):
+        class CountingFormatter(Formatter):
+            calls = 0
+
+            def to_number(self, value, **context):
+                self.calls += 1
+                return super(CountingFormatter, self).to_number(value)
+
+            def to_short(self, value, **context):
+                if len(value) > 3:
+                    raise FormatterException
+                return value.upper()
+
+        f = CountingFormatter(keys=['a'])
+        rows = [['10'], ['abc'], ['10'], ['abc'], [10]]
+
+        # The number format is not attempted again for the repeated value
+        # it failed for
+        self.assertEqual(f.format_batch(rows, preferred_formats=['number']), [
+            OrderedDict([('a', 10)]),
+            OrderedDict([('a', 'abc')]),
+            OrderedDict([('a', 10)]),
+            OrderedDict([('a', 'abc')]),
+            OrderedDict([('a', 10)]),
+        ])
+        self.assertEqual(f.calls, 4)
+
+        # The values after one an earlier format failed for are still
+        # attempted with it, as if the formats were attempted in order
+        f = CountingFormatter(keys=['a'])
+        rows = [['analyst'], ['ceo'], ['analyst'], ['vp']]
+        self.assertEqual(f.format_batch(rows, preferred_formats=['short']), [
+            OrderedDict([('a', 'analyst')]),
+            OrderedDict([('a', 'CEO')]),
+            OrderedDict([('a', 'analyst')]),
+            OrderedDict([('a', 'VP')]),
+        ])
+
+        # Values are no longer planned once the plan is full
+        f = CountingFormatter(keys=['a'])
+        f.plan_size = 1
+        rows = [['abc'], ['xyz'], ['xyz']]
+        f.format_batch(rows, preferred_formats=['number'])
+        self.assertEqual(f.calls, 3)
@@ -1,4 +1,9 @@
+import json
+from zipfile import ZipFile
+from cStringIO import StringIO
 from django.test import TestCase
+from avocado import export, formatters
+from avocado.query.pipeline import QueryProcessor
 from avocado.models import DataField, DataConcept, DataConceptField, DataView
 from ...models import Month, Date
 
@@ -38,3 +43,81 @@ class LexiconTestCase(TestCase):
 
         qs = Month.objects.filter(label__startswith='J').values('id')
         self.assertEqual(unicode(v.apply(qs).query), 'SELECT "tests_month"."id" FROM "tests_month" WHERE "tests_month"."label" LIKE J% ESCAPE \'\\\'  ORDER BY "tests_month"."order" ASC')
+
+    def test_dataview_representations(self):
+        f = DataField(app_name='tests', model_name='month', field_name='id')
+        f.save()
+
+        c = DataConcept()
+        c.save()
+
+        DataConceptField(field=f, concept=c).save()
+
+        v = DataView(json=[{'concept': c.pk, 'sort': 'asc'}])
+
+        # The order field is selected to support the DISTINCT
+        self.assertEqual(unicode(v.apply(Month.objects.distinct()).query), 'SELECT DISTINCT "tests_month"."id", "tests_month"."label", "tests_month"."order" FROM "tests_month" ORDER BY "tests_month"."order" ASC')
+
+        self.assertEqual(unicode(v.apply(Month.objects.all(), representations={c.pk: 'value'}).query), 'SELECT "tests_month"."id", "tests_month"."id" FROM "tests_month" ORDER BY "tests_month"."order" ASC')
+
+        self.assertEqual(unicode(v.apply(Month.objects.all(), representations={c.pk: 'code'}).query), 'SELECT "tests_month"."id", "tests_month"."code" FROM "tests_month" ORDER BY "tests_month"."order" ASC')
+
+        self.assertRaises(ValueError, f.get_representation_field, 'foo')
+
+    def test_export_representations(self):
+        f = DataField(app_name='tests', model_name='month', field_name='id')
+        f.save()
+
+        c = DataConcept()
+        c.save()
+
+        DataConceptField(field=f, concept=c).save()
+
+        processor = QueryProcessor(view=DataView(json=[{'concept': c.pk}]),
+                                   tree=Month, include_pk=False)
+
+        # The labels are selected for the default formatter
+        exporter = processor.get_exporter(export.BaseExporter)
+        self.assertEqual(list(processor.export(exporter, limit=2)),
+                         [(u'January',), (u'February',)])
+
+        # The representation declared by the concept's formatter
+        class CodeFormatter(formatters.Formatter):
+            representation = 'code'
+
+        formatters.registry.register(CodeFormatter)
+        c.formatter_name = 'CodeFormatter'
+        c.save()
+
+        try:
+            exporter = processor.get_exporter(export.BaseExporter)
+            self.assertEqual(list(processor.export(exporter, limit=2)),
+                             [(0,), (1,)])
+        finally:
+            formatters.registry.unregister(CodeFormatter)
+
+        # The representation of the exporter takes precedence
+        exporter.representation = 'value'
+        self.assertEqual(list(processor.export(exporter, limit=2)),
+                         [(1,), (2,)])
+
+    def test_export_parquet(self):
+        f = DataField(app_name='tests', model_name='month', field_name='id')
+        f.save()
+
+        c = DataConcept()
+        c.save()
+
+        DataConceptField(field=f, concept=c).save()
+
+        processor = QueryProcessor(view=DataView(json=[{'concept': c.pk}]),
+                                   tree=Month, include_pk=False)
+
+        # The values are selected rather than the labels so the column has
+        # the type of the field
+        exporter = processor.get_exporter(export.ParquetExporter)
+        buff = StringIO()
+        processor.export(exporter, buff=buff)
+
+        dictionary = json.loads(ZipFile(buff).read('dictionary.json'))
+        self.assertEqual(dictionary[0]['type'], 'integer')
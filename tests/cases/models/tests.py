@@ -195,6 +195,32 @@ class DataConceptTestCase(TestCase):
                 ('profile', u'<span>CEO</span><span>100000</span><span>True</span>')
             ]))
 
+    def test_formatter_signature(self):
+        from avocado.export import BaseExporter
+        from avocado.formatters import Formatter, registry as formatters
+
+        # Formatters overriding __init__ without the fields argument
+        class LegacyFormatter(Formatter):
+            def __init__(self, concept, keys=None):
+                super(LegacyFormatter, self).__init__(concept, keys)
+
+        salary_field = DataField.objects.get_by_natural_key('tests', 'title', 'salary')
+        concept = DataConcept(name='Salary', formatter_name='LegacyFormatter')
+        concept.save()
+        DataConceptField(concept=concept, field=salary_field).save()
+
+        formatters.register(LegacyFormatter)
+
+        try:
+            formatter = concept.get_formatter(fields=[salary_field])
+            self.assertTrue(isinstance(formatter, LegacyFormatter))
+            self.assertEqual(formatter.keys, ['salary'])
+
+            exporter = BaseExporter([concept])
+            self.assertEqual(list(exporter.write([(100000,)])), [(100000,)])
+        finally:
+            formatters.unregister(LegacyFormatter)
+
 
 class DataConceptManagerTestCase(TestCase):
     def setUp(self):
@@ -401,7 +427,7 @@ class DataQueryTestCase(TestCase):
         }
         query = DataQuery(attrs)
 
-        self.assertEqual(unicode(query.apply(tree=Employee).query), 'SELECT DISTINCT "tests_employee"."id", "tests_office"."location", "tests_title"."name" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") WHERE "tests_title"."boss" = True ')
+        self.assertEqual(unicode(query.apply(tree=Employee).query), 'SELECT "tests_employee"."id", "tests_office"."location", "tests_title"."name" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") WHERE "tests_title"."boss" = True ')
 
         query = DataQuery({'view': {'ordering': [(1, 'desc')]}})
         queryset = Employee.objects.all().distinct()
@@ -1,3 +1,8 @@
 from .operators import *
 from .parsers import *
 from .translators import *
+from .counts import *
+from .compiled import *
+from .pipeline import *
+from .exports import *
+from .jobs import *
@@ -0,0 +1,83 @@
+from datetime import date, datetime
+from decimal import Decimal
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core import management
+from django.core.cache import cache
+from avocado.models import DataField, DataContext
+from avocado.query import compiled
+from ....models import Employee
+
+__all__ = ['CompiledContextTestCase']
+
+
+class CompiledContextTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        self.context = DataContext(json={
+            'type': 'and',
+            'children': [{
+                'field': 'tests.project.due_date',
+                'operator': 'lt',
+                'value': '2013-01-01',
+            }, {
+                'field': 'tests.project.budget',
+                'operator': 'range',
+                'value': [1000, 10000.5],
+            }, {
+                'field': 'tests.title.name',
+                'operator': '-in',
+                'value': ['Programmer', 'Analyst'],
+            }]
+        })
+        cache.clear()
+
+    def test_values(self):
+        values = [None, True, 1, 1.5, u'a', date(2013, 1, 1),
+                  datetime(2013, 1, 1, 12, 30), Decimal('10.50'), [1, 2]]
+
+        for value in values:
+            encoded = compiled.encode_value(value)
+            self.assertEqual(compiled.decode_value(encoded), value)
+
+        self.assertRaises(TypeError, compiled.encode_value, Employee())
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_rehydrate(self):
+        node = self.context.compile(tree=Employee)
+        self.assertFalse(isinstance(node.children[0],
+                                    compiled.CompiledCondition))
+
+        rehydrated = self.context.compile(tree=Employee)
+        self.assertTrue(isinstance(rehydrated.children[0],
+                                   compiled.CompiledCondition))
+        self.assertEqual(rehydrated.language, node.language)
+
+        for strategy in ('join', 'subquery', 'auto'):
+            self.assertEqual(
+                unicode(rehydrated.apply(strategy=strategy).query),
+                unicode(node.apply(strategy=strategy).query))
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_invalidate(self):
+        key = compiled.compiled_contexts.cache_key(self.context.json)
+        self.context.compile()
+        self.assertNotEqual(cache.get(key), None)
+
+        field = DataField.objects.get_by_natural_key('tests', 'title', 'name')
+        field.save()
+
+        self.assertNotEqual(
+            compiled.compiled_contexts.cache_key(self.context.json), key)
+        self.assertFalse(isinstance(self.context.compile().children[0],
+                                    compiled.CompiledCondition))
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_composite(self):
+        self.context.save()
+        context = DataContext(json={'composite': self.context.pk})
+        context.compile()
+        key = compiled.compiled_contexts.cache_key(context.json)
+        self.assertEqual(cache.get(key), None)
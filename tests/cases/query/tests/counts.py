@@ -0,0 +1,125 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core import management
+from django.core.cache import cache
+from avocado.models import DataField, DataConcept, DataContext, DataQuery
+from avocado.query.counts import CountCache, count_cache, CONTEXT_COUNT
+from avocado.query.pipeline import QueryProcessor
+
+__all__ = ['CountCacheTestCase']
+
+
+class CountCacheTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        self.salary = DataField.objects.get_by_natural_key('tests', 'title',
+                                                           'salary')
+        self.context = DataContext(json={
+            'field': 'tests.title.salary',
+            'operator': 'gt',
+            'value': 15000,
+        })
+        self.context.save()
+        cache.clear()
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_context(self):
+        self.assertEqual(self.context.cached_count(), 3)
+        self.assertEqual(DataContext.objects.get(pk=self.context.pk).count, 3)
+
+        # Served from cache while the data versions are unchanged
+        key = count_cache.cache_key(self.context, 'count')
+        versions, count = cache.get(key)
+        cache.set(key, (versions, 10))
+        self.assertEqual(self.context.cached_count(), 10)
+
+        # Stale once the data version changes
+        self.salary.data_version += 1
+        self.salary.save()
+        self.assertEqual(self.context.cached_count(async=False), 3)
+        self.assertEqual(cache.get(key)[1], 3)
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_query(self):
+        concept = DataConcept.objects.get(fields=self.salary)
+        query = DataQuery(context_json=self.context.json,
+                          view_json=[{'concept': concept.pk}])
+        query.save()
+
+        self.assertEqual(query.cached_count(), 3)
+        self.assertEqual(query.cached_count(distinct=False), 3)
+
+        query = DataQuery.objects.get(pk=query.pk)
+        self.assertEqual(query.distinct_count, 3)
+        self.assertEqual(query.record_count, 3)
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_composite(self):
+        context = DataContext(json={'composite': self.context.pk})
+        context.save()
+        self.assertEqual(context.cached_count(), 3)
+
+        # Not cached since changes of the referenced context would not
+        # invalidate the count
+        key = count_cache.cache_key(context, 'count')
+        self.assertEqual(cache.get(key), None)
+
+        self.context.json['operator'] = 'gte'
+        self.context.save()
+        self.assertEqual(context.cached_count(), 6)
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_async(self):
+        class CountingCache(CountCache):
+            calls = 0
+            thread = None
+
+            def compute(self, instance, label, tree=None):
+                self.calls += 1
+                return self.calls
+
+            def _start_refresh(self, *args):
+                self.thread = super(CountingCache, self)._start_refresh(*args)
+                return self.thread
+
+        counts = CountingCache()
+        context = DataContext(json=self.context.json)
+        self.assertEqual(counts.get(context, CONTEXT_COUNT), 1)
+
+        # The stale count is served while it is refreshed in the background
+        self.salary.data_version += 1
+        self.salary.save()
+        self.assertEqual(counts.get(context, CONTEXT_COUNT), 1)
+        counts.thread.join()
+        self.assertEqual(counts.get(context, CONTEXT_COUNT), 2)
+        self.assertEqual(context.count, 2)
+
+        # Only one refresh runs at a time
+        key = counts.cache_key(context, CONTEXT_COUNT)
+        cache.set(key + ':lock', True)
+        counts.thread = None
+        self.salary.data_version += 1
+        self.salary.save()
+        self.assertEqual(counts.get(context, CONTEXT_COUNT), 2)
+        self.assertEqual(counts.thread, None)
+        self.assertEqual(counts.calls, 2)
+
+    def test_disabled(self):
+        self.assertEqual(self.context.cached_count(), 3)
+        key = count_cache.cache_key(self.context, 'count')
+        self.assertEqual(cache.get(key), None)
+
+    def test_fast_count(self):
+        concept = DataConcept.objects.get(fields=self.salary)
+        query = DataQuery(context_json=self.context.json,
+                          view_json=[{'concept': concept.pk, 'sort': 'desc'}])
+
+        self.assertEqual(self.context.get_count(), 3)
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.count(distinct=False), len(query.apply()))
+
+        processor = QueryProcessor(context=self.context, view=query.view)
+        self.assertEqual(processor.count(), 3)
+        self.assertEqual(QueryProcessor().count(), 6)
@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core import management
+from avocado import export, formatters
+from avocado.models import DataField, DataConcept, DataContext, DataView
+from avocado.query.exports import ExportCache
+from avocado.query.pipeline import QueryProcessor
+from ....models import Employee
+
+__all__ = ['ExportCacheTestCase']
+
+
+class ExportCacheTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        self.salary = DataField.objects.get_by_natural_key('tests', 'title',
+                                                           'salary')
+        concept = DataConcept.objects.get(fields=self.salary)
+        context = DataContext(json={
+            'field': 'tests.title.salary',
+            'operator': 'gt',
+            'value': 10000,
+        })
+        view = DataView(json=[{'concept': concept.pk, 'sort': 'desc'}])
+        self.processor = QueryProcessor(context=context, view=view,
+                                        tree=Employee)
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def export(self, cache=None, **kwargs):
+        exporter = self.processor.get_exporter(export.CSVExporter)
+
+        if cache is None:
+            return self.processor.cached_export(exporter, **kwargs)
+        return cache.get(self.processor, exporter, **kwargs)
+
+    def test_hit(self):
+        exporter = self.processor.get_exporter(export.CSVExporter)
+        expected = self.processor.export(exporter).getvalue()
+
+        with override_settings(AVOCADO_EXPORT_CACHE_DIR=self.path):
+            fp = self.export()
+            self.assertEqual(fp.read(), expected)
+            self.assertEqual(os.listdir(self.path),
+                             [os.path.basename(fp.name)])
+
+            # Served without exporting
+            self.processor.export = None
+            self.assertEqual(self.export().name, fp.name)
+
+    def test_cache_key(self):
+        cache = ExportCache(self.path)
+        exporter = self.processor.get_exporter(export.CSVExporter)
+        key = cache.cache_key(self.processor, exporter)
+
+        self.assertEqual(cache.cache_key(
+            self.processor, self.processor.get_exporter(export.CSVExporter)),
+            key)
+
+        # The formatters of the exporter
+        exporter.add_formatter(formatters.RawFormatter(keys=['pk']))
+        self.assertNotEqual(cache.cache_key(self.processor, exporter), key)
+
+        exporter = self.processor.get_exporter(export.CSVExporter)
+        exporter.preferred_formats = ['raw']
+        self.assertNotEqual(cache.cache_key(self.processor, exporter), key)
+
+        # The formatters of the concepts
+        class SalaryFormatter(formatters.Formatter):
+            pass
+
+        formatters.registry.register(SalaryFormatter)
+        concept = DataConcept.objects.get(fields=self.salary)
+        concept.formatter_name = 'SalaryFormatter'
+        concept.save()
+
+        try:
+            exporter = self.processor.get_exporter(export.CSVExporter)
+            self.assertNotEqual(cache.cache_key(self.processor, exporter),
+                                key)
+        finally:
+            formatters.registry.unregister(SalaryFormatter)
+
+    def test_incomplete(self):
+        cache = ExportCache(self.path)
+
+        def write(fp):
+            fp.write('a')
+            raise KeyboardInterrupt
+
+        self.assertRaises(KeyboardInterrupt, cache.set, 'key', 'version',
+                          'csv', write)
+        self.assertEqual(os.listdir(self.path), [])
+
+        # Stale files of writes that did not complete are removed
+        stale = tempfile.mkstemp(prefix='.', dir=self.path)[1]
+        os.utime(stale, (0, 0))
+        fresh = tempfile.mkstemp(prefix='.', dir=self.path)[1]
+
+        cache.evict()
+        self.assertEqual(os.listdir(self.path), [os.path.basename(fresh)])
+
+    def test_invalidate(self):
+        cache = ExportCache(self.path)
+        name = self.export(cache).name
+
+        self.salary.data_version += 1
+        self.salary.save()
+
+        fp = self.export(cache)
+        self.assertNotEqual(fp.name, name)
+        self.assertEqual(os.listdir(self.path), [os.path.basename(fp.name)])
+
+    def test_evict(self):
+        size = len(self.export(ExportCache(self.path), limit=1).read())
+        cache = ExportCache(self.path, max_size=size * 2)
+
+        first = self.export(cache, limit=1).name
+        os.utime(first, (0, 0))
+        second = self.export(cache, offset=1, limit=1).name
+        os.utime(second, (1, 1))
+
+        # The least recently used file is removed
+        self.assertEqual(self.export(cache, limit=1).name, first)
+        third = self.export(cache, offset=2, limit=1).name
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         sorted(os.path.basename(x) for x in (first, third)))
+
+    def test_disabled(self):
+        fp = self.export()
+        self.assertEqual(len(fp.read().splitlines()), 7)
+        self.assertEqual(os.listdir(self.path), [])
+
+        # Composite contexts are not cached
+        self.processor.context.save()
+        self.processor.context = DataContext(
+            json={'composite': self.processor.context.pk})
+        self.export(ExportCache(self.path))
+        self.assertEqual(os.listdir(self.path), [])
@@ -0,0 +1,179 @@
+import os
+import json
+import shutil
+import tempfile
+from django.test import TestCase
+from django.core import management
+from avocado import export
+from avocado.models import DataField, DataConcept, DataView, DataQuery, \
+    ExportJob
+from avocado.query import jobs
+from avocado.query.pipeline import QueryProcessor
+from ....models import Employee
+
+__all__ = ['ExportJobTestCase']
+
+
+class MemoryJobStore(jobs.JobStore):
+    def __init__(self):
+        self.jobs = {}
+        self.updates = []
+
+    def create(self, **attrs):
+        job = ExportJob(id=len(self.jobs) + 1, **attrs)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def update(self, job_id, **attrs):
+        self.updates.append(attrs)
+        for key, value in attrs.items():
+            setattr(self.jobs[job_id], key, value)
+
+    def claim(self, job_id, **attrs):
+        if self.jobs[job_id].status != jobs.PENDING:
+            return False
+        self.update(job_id, status=jobs.RUNNING, **attrs)
+        return True
+
+    def delete(self, job_id):
+        self.jobs.pop(job_id, None)
+
+
+class ExportJobTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        salary = DataConcept.objects.get(fields=DataField.objects
+            .get_by_natural_key('tests', 'title', 'salary'))
+        self.view = [{'concept': salary.pk, 'sort': 'desc'}]
+        self.path = tempfile.mkdtemp()
+        self.queue = jobs.ExportJobQueue(path=self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_run(self):
+        query = DataQuery(view_json=self.view)
+        query.save()
+
+        job = self.queue.enqueue('csv', query=query, tree='tests.employee',
+                                 async=False)
+        self.assertEqual(job.status, jobs.DONE)
+        self.assertEqual(job.query, query)
+        self.assertEqual(job.rows_read, 6)
+        self.assertEqual(job.record_count, 6)
+        self.assertEqual(self.queue.progress(job), 1.0)
+
+        processor = QueryProcessor(view=DataView(json=self.view),
+                                   tree=Employee)
+        exporter = processor.get_exporter(export.CSVExporter)
+        self.assertEqual(self.queue.open(job).read(),
+                         processor.export(exporter).getvalue())
+
+        self.queue.delete(job)
+        self.assertFalse(os.path.exists(job.path))
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_options(self):
+        job = self.queue.enqueue('json', view=self.view, async=False,
+                                 offset=1, limit=2)
+        self.assertEqual(job.path, os.path.join(self.path,
+                                                '{0}.json'.format(job.id)))
+        self.assertEqual(len(json.load(self.queue.open(job))), 2)
+
+    def test_progress(self):
+        store = MemoryJobStore()
+        queue = jobs.ExportJobQueue(store=store, path=self.path)
+        queue.progress_interval = 2
+
+        job = queue.enqueue('csv', view=self.view, async=False)
+        self.assertEqual(job.status, jobs.DONE)
+        self.assertEqual([x['rows_read'] for x in store.updates
+                          if 'rows_read' in x], [2, 4, 6, 6, 6])
+
+        job.status = jobs.RUNNING
+        self.assertEqual(queue.progress(job), 1.0)
+        job.rows_read = 3
+        self.assertEqual(queue.progress(job), 0.5)
+        job.record_count = None
+        self.assertEqual(queue.progress(job), None)
+
+    def test_claim(self):
+        store = MemoryJobStore()
+        queue = jobs.ExportJobQueue(store=store, path=self.path)
+
+        job = queue.enqueue('csv', view=self.view, submit=False)
+        self.assertEqual(job.status, jobs.PENDING)
+
+        # A job is only run once
+        self.assertTrue(store.claim(job.id))
+        self.assertFalse(store.claim(job.id))
+
+        queue.run(job.id)
+        self.assertEqual(job.status, jobs.RUNNING)
+        self.assertEqual(os.listdir(self.path), [])
+
+        store = jobs.DatabaseJobStore()
+        job = store.create(exporter='csv')
+        self.assertTrue(job.created)
+        self.assertTrue(store.claim(job.id))
+        self.assertFalse(store.claim(job.id))
+        self.assertEqual(store.get(job.id).status, jobs.RUNNING)
+
+    def test_submit(self):
+        # The test runs within a transaction, so the job would not be
+        # visible to the workers
+        self.assertRaises(ValueError, self.queue.enqueue, 'csv',
+                          view=self.view)
+        self.assertFalse(ExportJob.objects.exists())
+
+        job = self.queue.enqueue('csv', view=self.view, submit=False)
+        self.assertEqual(job.status, jobs.PENDING)
+
+        # Run by a worker once submitted
+        self.queue.run(job.id)
+        self.assertEqual(ExportJob.objects.get(pk=job.id).status, jobs.DONE)
+
+    def test_failed(self):
+        context = {'field': 'tests.title.foo', 'operator': 'exact',
+                   'value': 1}
+        job = self.queue.enqueue('csv', context=context, async=False)
+        self.assertEqual(job.status, jobs.FAILED)
+        self.assertTrue(job.error)
+        self.assertRaises(ValueError, self.queue.open, job)
+        self.assertEqual(os.listdir(self.path), [])
+
+        self.assertRaises(ValueError, self.queue.enqueue, 'foo')
+
+    def test_lazy_exporter(self):
+        store = MemoryJobStore()
+        queue = jobs.ExportJobQueue(store=store, path=self.path)
+
+        # The rows of lazy writers would never be read
+        export.registry.register(export.BaseExporter)
+
+        try:
+            self.assertRaises(ValueError, queue.enqueue, 'BaseExporter',
+                              view=self.view)
+
+            job = store.create(exporter='BaseExporter', view_json=self.view)
+            queue.run(job.id)
+            self.assertEqual(job.status, jobs.FAILED)
+            self.assertEqual(job.rows_read, 0)
+            self.assertEqual(os.listdir(self.path), [])
+        finally:
+            export.registry.unregister(export.BaseExporter)
+
+    def test_pool(self):
+        queue = jobs.ExportJobQueue(workers=1, pool='foo')
+        self.assertRaises(ValueError, queue.get_pool)
+
+        queue = jobs.ExportJobQueue(workers=1)
+        try:
+            self.assertTrue(queue.get_pool())
+        finally:
+            queue.close()
@@ -1,5 +1,7 @@
 from copy import deepcopy
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core import management
 from avocado.query import oldparsers as parsers
@@ -179,7 +181,7 @@ class DataContextParserTestCase(TestCase):
             'value': True
         }, tree=Employee)
 
-        self.assertEqual(unicode(node.apply().values('id').query), 'SELECT DISTINCT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE "tests_title"."boss" = True ')
+        self.assertEqual(unicode(node.apply().values('id').query), 'SELECT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE "tests_title"."boss" = True ')
         self.assertEqual(node.language, {'operator': 'exact', 'language': u'Boss is True', 'field': 4, 'value': True})
 
         # Branch node
@@ -196,7 +198,7 @@ class DataContextParserTestCase(TestCase):
             }]
         }, tree=Employee)
 
-        self.assertEqual(unicode(node.apply().values('id').query), 'SELECT DISTINCT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE ("tests_employee"."first_name" = John  AND "tests_title"."boss" = True )')
+        self.assertEqual(unicode(node.apply().values('id').query), 'SELECT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE ("tests_employee"."first_name" = John  AND "tests_title"."boss" = True )')
 
         self.assertEqual(node.language, {
             'type': 'and',
@@ -213,6 +215,33 @@ class DataContextParserTestCase(TestCase):
             }]
         })
 
+    def test_apply_strategy(self):
+        attrs = {
+            'type': 'and',
+            'children': [{
+                'field': 'tests.title.boss',
+                'operator': 'exact',
+                'value': True,
+            }, {
+                'field': 'tests.project.name',
+                'operator': 'exact',
+                'value': 'P1',
+            }]
+        }
+
+        # Joining the to-many relationship requires a DISTINCT
+        node = parsers.datacontext.parse(attrs, tree=Employee)
+        self.assertEqual(unicode(node.apply().values('id').query), 'SELECT DISTINCT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_project_employees" ON ("tests_employee"."id" = "tests_project_employees"."employee_id") INNER JOIN "tests_project" ON ("tests_project_employees"."project_id" = "tests_project"."id") INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE ("tests_project"."name" = P1  AND "tests_title"."boss" = True )')
+
+        node = parsers.datacontext.parse(attrs, tree=Employee)
+        self.assertEqual(unicode(node.apply(strategy='subquery').values('id').query), 'SELECT "tests_employee"."id" FROM "tests_employee" WHERE ("tests_employee"."id" IN (SELECT U0."id" FROM "tests_employee" U0 INNER JOIN "tests_project_employees" U1 ON (U0."id" = U1."employee_id") INNER JOIN "tests_project" U2 ON (U1."project_id" = U2."id") WHERE U2."name" = P1 ) AND "tests_employee"."id" IN (SELECT U0."id" FROM "tests_employee" U0 INNER JOIN "tests_title" U1 ON (U0."title_id" = U1."id") WHERE U1."boss" = True ))')
+
+        # Only the to-many condition is compiled into a subquery
+        node = parsers.datacontext.parse(attrs, tree=Employee)
+        self.assertEqual(unicode(node.apply(strategy='auto').values('id').query), 'SELECT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE ("tests_employee"."id" IN (SELECT U0."id" FROM "tests_employee" U0 INNER JOIN "tests_project_employees" U1 ON (U0."id" = U1."employee_id") INNER JOIN "tests_project" U2 ON (U1."project_id" = U2."id") WHERE U2."name" = P1 ) AND "tests_title"."boss" = True )')
+
+        self.assertRaises(ValueError, node.apply, strategy='foo')
+
 class DataViewParserTestCase(TestCase):
     fixtures = ['employee_data.json']
 
@@ -290,6 +319,49 @@ class DataViewParserTestCase(TestCase):
         }, tree=Employee)
         self.assertEqual(unicode(node.apply(Employee.objects.distinct()).query), 'SELECT DISTINCT "tests_employee"."id", "tests_office"."location", "tests_title"."name" FROM "tests_employee" INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") LEFT OUTER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") ORDER BY "tests_office"."location" DESC, "tests_title"."name" DESC')
 
+    def test_repeated_concepts(self):
+        node = parsers.dataview.parse([
+            {'concept': 1, 'sort': 'desc', 'sort_index': 1},
+            {'concept': 1, 'sort': 'asc', 'sort_index': 0},
+        ], tree=Employee)
+
+        self.assertEqual(node.concept_ids, [1])
+        self.assertEqual(node.ordering, [(1, 'asc')])
+        self.assertEqual(len(node.get_concepts_for_select()), 1)
+        self.assertEqual(unicode(node.apply().query), 'SELECT "tests_employee"."id", "tests_office"."location", "tests_title"."name" FROM "tests_employee" INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") LEFT OUTER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") ORDER BY "tests_office"."location" ASC, "tests_title"."name" ASC')
+
+    def test_concept_fields(self):
+        node = parsers.dataview.parse([
+            {'concept': 1, 'sort': 'desc'},
+        ], tree=Employee)
+
+        # Concepts and fields are loaded once for the node
+        with self.assertNumQueries(1):
+            node.apply()
+            node.get_concepts_for_select()
+            node.get_fields_for_select()
+            node.get_fields_for_order_by()
+
+        self.assertEqual([c.pk for c in node.get_concepts_for_select()], [1])
+        self.assertEqual([f.pk for f in node.get_fields_for_select()[1]],
+                         [1, 2])
+
+    @override_settings(AVOCADO_DATA_CACHE_ENABLED=True)
+    def test_concept_fields_cached(self):
+        cache.clear()
+        parsers.dataview.parse([{'concept': 1}]).get_fields_for_select()
+
+        with self.assertNumQueries(0):
+            parsers.dataview.parse([{'concept': 1}]).get_fields_for_select()
+
+        # Changes to the concept fields are reflected
+        DataConceptField(concept_id=1, field=DataField.objects.get(pk=3))\
+            .save()
+        fields = parsers.dataview.parse([{'concept': 1}])\
+            .get_fields_for_select()
+        self.assertEqual([f.pk for f in fields[1]], [1, 2, 3])
+
+
 class DataQueryParserTestCase(TestCase):
     fixtures = ['employee_data.json']
 
@@ -403,7 +475,7 @@ class DataQueryParserTestCase(TestCase):
             }
         }, tree=Employee)
 
-        self.assertEqual(unicode(node.apply().query), 'SELECT DISTINCT "tests_employee"."id", "tests_office"."location", "tests_title"."name" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") WHERE "tests_title"."boss" = True ')
+        self.assertEqual(unicode(node.apply().query), 'SELECT "tests_employee"."id", "tests_office"."location", "tests_title"."name" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") WHERE "tests_title"."boss" = True ')
 
         # Just the view
         node = parsers.dataquery.parse({
@@ -411,7 +483,7 @@ class DataQueryParserTestCase(TestCase):
                 'ordering': [(1, 'desc')],
             }
         }, tree=Employee)
-        self.assertEqual(unicode(node.apply().query), 'SELECT DISTINCT "tests_employee"."id", "tests_office"."location", "tests_title"."name" FROM "tests_employee" INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") LEFT OUTER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") ORDER BY "tests_office"."location" DESC, "tests_title"."name" DESC')
+        self.assertEqual(unicode(node.apply().query), 'SELECT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_office" ON ("tests_employee"."office_id" = "tests_office"."id") LEFT OUTER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") ORDER BY "tests_office"."location" DESC, "tests_title"."name" DESC')
 
         # Just the context
         node = parsers.dataquery.parse({
@@ -422,5 +494,32 @@ class DataQueryParserTestCase(TestCase):
             }
         }, tree=Employee)
 
-        self.assertEqual(unicode(node.apply().values('id').query), 'SELECT DISTINCT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE "tests_title"."boss" = True ')
+        self.assertEqual(unicode(node.apply().values('id').query), 'SELECT "tests_employee"."id" FROM "tests_employee" INNER JOIN "tests_title" ON ("tests_employee"."title_id" = "tests_title"."id") WHERE "tests_title"."boss" = True ')
         self.assertEqual(node.datacontext_node.language, {'operator': 'exact', 'language': u'Boss is True', 'field': 4, 'value': True})
+
+    def test_count(self):
+        node = parsers.dataquery.parse({
+            'context': {
+                'field': 'tests.title.boss',
+                'operator': 'exact',
+                'value': True
+            },
+            'view': {
+                'columns': [1],
+                'ordering': [(1, 'desc')],
+            }
+        }, tree=Employee)
+
+        queryset = node.apply()
+        self.assertEqual(node.count(), queryset.count())
+        self.assertEqual(node.count(distinct=False), len(queryset))
+
+        # Just the view
+        node = parsers.dataquery.parse({
+            'view': {
+                'ordering': [(1, 'desc')],
+            }
+        }, tree=Employee)
+
+        self.assertEqual(node.count(), Employee.objects.count())
+        self.assertEqual(node.count(distinct=False), Employee.objects.count())
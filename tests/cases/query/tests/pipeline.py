@@ -0,0 +1,317 @@
+import cPickle as pickle
+from zipfile import ZipFile
+from cStringIO import StringIO
+from django.test import TestCase, TransactionTestCase
+from django.db import connection
+from django.core import management
+from avocado import export
+from avocado.models import DataField, DataConcept, DataView
+from avocado.query.pipeline import QueryProcessor, stream_results
+from ....models import Employee
+
+__all__ = ['KeysetPaginationTestCase', 'StreamingTestCase',
+           'ExportQuerysetTestCase', 'ExportTestCase',
+           'PartitionedExportTestCase', 'PartitionedProcessExportTestCase']
+
+
+class KeysetPaginationTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        salary = DataField.objects.get_by_natural_key('tests', 'title',
+                                                      'salary')
+        self.concept = DataConcept.objects.get(fields=salary)
+
+        # Ensure NULLs are paginated as well
+        Employee.objects.filter(pk=3).update(title=None)
+
+    def assertPages(self, processor, limit):
+        queryset = processor.get_queryset()\
+            .order_by(*processor.get_order_by())
+        expected = [r[0] for r in queryset.raw()]
+
+        pages = []
+        page = processor.get_page(limit)
+        self.assertEqual(page.previous_cursor, None)
+
+        while True:
+            pages.append([r[0] for r in page])
+            if page.next_cursor is None:
+                break
+            page = processor.get_page(limit, cursor=page.next_cursor)
+
+        self.assertEqual(sum(pages, []), expected)
+        self.assertTrue(all(len(x) == limit for x in pages[:-1]))
+
+        # Walk back to the first page
+        while page.previous_cursor is not None:
+            page = processor.get_page(limit, cursor=page.previous_cursor)
+            self.assertEqual([r[0] for r in page], pages.pop(-2))
+
+        self.assertEqual(len(pages), 1)
+
+    def test_pages(self):
+        for sort in ('asc', 'desc'):
+            view = DataView(json=[{'concept': self.concept.pk, 'sort': sort}])
+            processor = QueryProcessor(view=view, tree=Employee)
+
+            for limit in (1, 2, 4, 10):
+                self.assertPages(processor, limit)
+
+    def test_no_view(self):
+        page = QueryProcessor(tree=Employee).get_page(4)
+        self.assertEqual([r[0] for r in page], [1, 2, 3, 4])
+
+    def test_invalid_cursor(self):
+        processor = QueryProcessor(tree=Employee)
+        cursor = processor.get_page(2).next_cursor
+
+        self.assertRaises(ValueError, processor.get_page, 2, cursor='foo')
+
+        # Cursors are bound to the ordering
+        view = DataView(json=[{'concept': self.concept.pk, 'sort': 'asc'}])
+        processor = QueryProcessor(view=view, tree=Employee)
+        self.assertRaises(ValueError, processor.get_page, 2, cursor=cursor)
+
+    def test_to_many(self):
+        name = DataField.objects.get_by_natural_key('tests', 'project', 'name')
+        concept = DataConcept.objects.get(fields=name)
+        view = DataView(json=[{'concept': concept.pk}])
+        processor = QueryProcessor(view=view, tree=Employee)
+        self.assertRaises(ValueError, processor.get_page, 2)
+
+
+class StreamingTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        salary = DataField.objects.get_by_natural_key('tests', 'title',
+                                                      'salary')
+        concept = DataConcept.objects.get(fields=salary)
+        view = DataView(json=[{'concept': concept.pk, 'sort': 'desc'}])
+        self.processor = QueryProcessor(view=view, tree=Employee)
+
+    def test_stream(self):
+        expected = list(self.processor.get_iterable())
+
+        iterable = self.processor.get_iterable(stream=True, itersize=2)
+        self.assertFalse(isinstance(iterable, (list, tuple)))
+        self.assertEqual(list(iterable), expected)
+
+        self.assertEqual(
+            list(self.processor.get_iterable(offset=1, limit=3, stream=True)),
+            expected[1:4])
+
+    def test_empty(self):
+        self.assertEqual(list(stream_results(Employee.objects.none())), [])
+
+
+class ExportQuerysetTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        self.salary = DataConcept.objects.get(fields=DataField.objects
+            .get_by_natural_key('tests', 'title', 'salary'))
+        self.project = DataConcept.objects.get(fields=DataField.objects
+            .get_by_natural_key('tests', 'project', 'name'))
+
+    def get(self, view, include_pk=True):
+        processor = QueryProcessor(view=DataView(json=view), tree=Employee,
+                                   include_pk=include_pk)
+        exporter = processor.get_exporter(export.CSVExporter)
+        return processor.get_export_queryset(exporter)
+
+    def test_unique(self):
+        queryset, force_distinct = self.get([{'concept': self.salary.pk}])
+        self.assertFalse(force_distinct)
+        self.assertFalse(queryset.query.distinct)
+
+    def test_sql_distinct(self):
+        queryset, force_distinct = self.get([{'concept': self.salary.pk}],
+                                            include_pk=False)
+        self.assertFalse(force_distinct)
+        self.assertTrue(queryset.query.distinct)
+
+        queryset, force_distinct = self.get([{'concept': self.project.pk}])
+        self.assertFalse(force_distinct)
+        self.assertTrue(queryset.query.distinct)
+
+    def test_sort_columns(self):
+        queryset, force_distinct = self.get([
+            {'concept': self.salary.pk},
+            {'concept': self.project.pk, 'sort': 'asc', 'visible': False},
+        ])
+        self.assertTrue(force_distinct)
+
+
+class ExportTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        salary = DataConcept.objects.get(fields=DataField.objects
+            .get_by_natural_key('tests', 'title', 'salary'))
+        view = DataView(json=[{'concept': salary.pk, 'sort': 'desc'}])
+        self.processor = QueryProcessor(view=view, tree=Employee)
+
+    def export(self, **kwargs):
+        exporter = self.processor.get_exporter(export.CSVExporter)
+        buff = self.processor.export(exporter, **kwargs)
+        return buff.getvalue().splitlines()[1:]
+
+    def test_offset_limit(self):
+        rows = self.export()
+        self.assertEqual(len(rows), 6)
+
+        connection.use_debug_cursor = True
+
+        try:
+            self.assertEqual(self.export(offset=2, limit=3), rows[2:5])
+            self.assertTrue([q for q in connection.queries
+                             if 'LIMIT 3 OFFSET 2' in q['sql']])
+        finally:
+            connection.use_debug_cursor = False
+
+        self.assertEqual(self.export(offset=4, stream=True), rows[4:])
+        # Offset applied by the exporter
+        self.assertEqual(self.export(offset=4, force_distinct='sorted'),
+                         rows[4:])
+
+    def test_stream_export(self):
+        exporter = self.processor.get_exporter(export.CSVExporter)
+        chunks = self.processor.stream_export(exporter, chunk_size=1,
+                                              offset=1, limit=2)
+        self.assertEqual(''.join(chunks).splitlines()[1:],
+                         self.export()[1:3])
+
+
+class PartitionedExportTestCase(TestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        self.salary = DataConcept.objects.get(fields=DataField.objects
+            .get_by_natural_key('tests', 'title', 'salary'))
+
+    def export(self, processor, **kwargs):
+        exporter = processor.get_exporter(export.CSVExporter)
+        buff = processor.export(exporter, **kwargs)
+        return buff.getvalue().splitlines()
+
+    def test_partitions(self):
+        processor = QueryProcessor(tree=Employee)
+        self.assertEqual(processor.get_partitions(1), [(None, None)])
+        self.assertEqual(processor.get_partitions(3),
+                         [(None, 3), (3, 5), (5, None)])
+        # More partitions than objects
+        self.assertEqual(len(processor.get_partitions(10)), 6)
+        # Partitions of at most two objects
+        self.assertEqual(processor.get_partitions(size=2),
+                         [(None, 3), (3, 5), (5, None)])
+        self.assertEqual(processor.get_partitions(2, size=6),
+                         [(None, 4), (4, None)])
+
+    def test_merge(self):
+        view = DataView(json=[{'concept': self.salary.pk}])
+        processor = QueryProcessor(view=view, tree=Employee)
+        expected = self.export(processor)
+        # Merged rows are ordered by the primary key
+        expected[1:] = sorted(expected[1:], key=lambda x: int(x.split(',')[0]))
+
+        exporter = processor.get_exporter(export.CSVExporter)
+        buff = processor.export_partitions(exporter, partitions=4,
+                                           processes=0)
+        self.assertEqual(buff.getvalue().splitlines(), expected)
+
+        exporter = processor.get_exporter(export.CSVExporter)
+        buff = processor.export_partitions(exporter, partitions=4,
+                                           processes=0, offset=2, limit=3)
+        self.assertEqual(buff.getvalue().splitlines(),
+                         expected[:1] + expected[3:6])
+
+        # The exporter must be picklable to be sent to the processes
+        self.assertTrue(pickle.loads(pickle.dumps(exporter)))
+
+    def test_ordered(self):
+        view = DataView(json=[{'concept': self.salary.pk, 'sort': 'desc'}])
+        processor = QueryProcessor(view=view, tree=Employee)
+        exporter = processor.get_exporter(export.CSVExporter)
+
+        self.assertRaises(ValueError, processor.export_partitions, exporter,
+                          processes=0)
+
+    def test_dirty_transaction(self):
+        processor = QueryProcessor(tree=Employee)
+        exporter = processor.get_exporter(export.CSVExporter)
+
+        # The changes of the test's transaction would be lost
+        Employee.objects.filter(pk=1).update(first_name='Eric')
+        self.assertRaises(ValueError, processor.export_partitions, exporter,
+                          processes=2)
+
+    def test_parts(self):
+        view = DataView(json=[{'concept': self.salary.pk, 'sort': 'desc'}])
+        processor = QueryProcessor(view=view, tree=Employee)
+        exporter = processor.get_exporter(export.CSVExporter)
+
+        buff = StringIO()
+        processor.export_partitions(exporter, partitions=2, processes=0,
+                                    parts=True, buff=buff)
+
+        zip_file = ZipFile(buff)
+        self.assertEqual(zip_file.namelist(), ['part-0001.csv',
+                                               'part-0002.csv'])
+        self.assertEqual(zip_file.read('part-0001.csv').splitlines()[1:],
+                         ['2,20000', '1,15000', '3,15000'])
+
+
+class PartitionedProcessExportTestCase(TransactionTestCase):
+    fixtures = ['employee_data.json']
+
+    def setUp(self):
+        management.call_command('avocado', 'init', 'tests', quiet=True)
+        salary = DataConcept.objects.get(fields=DataField.objects
+            .get_by_natural_key('tests', 'title', 'salary'))
+        self.view = DataView(json=[{'concept': salary.pk}])
+
+    def test_merge(self):
+        processor = QueryProcessor(view=self.view, tree=Employee)
+        exporter = processor.get_exporter(export.CSVExporter)
+        expected = processor.export_partitions(exporter, processes=0)\
+            .getvalue()
+
+        # More partitions than processes are formatted in the processes
+        processor.partition_size = 2
+        exporter = processor.get_exporter(export.CSVExporter)
+        buff = processor.export_partitions(exporter, processes=2)
+        self.assertEqual(buff.getvalue(), expected)
+        self.assertEqual(len(expected.splitlines()), 7)
+
+    def test_merge_lazy(self):
+        processor = QueryProcessor(view=self.view, tree=Employee)
+        exporter = processor.get_exporter(export.BaseExporter)
+        expected = list(processor.export_partitions(exporter, processes=0))
+
+        # The rows of lazy writers are read once the output is consumed
+        processor.partition_size = 2
+        exporter = processor.get_exporter(export.BaseExporter)
+        rows = processor.export_partitions(exporter, processes=2)
+        self.assertEqual(list(rows), expected)
+        self.assertEqual(len(expected), 6)
+
+    def test_parts(self):
+        processor = QueryProcessor(view=self.view, tree=Employee)
+        exporter = processor.get_exporter(export.CSVExporter)
+
+        buff = StringIO()
+        processor.export_partitions(exporter, processes=2, parts=True,
+                                    buff=buff)
+
+        zip_file = ZipFile(buff)
+        self.assertEqual(zip_file.namelist(), ['part-0001.csv',
+                                               'part-0002.csv'])
+        self.assertEqual(zip_file.read('part-0002.csv').splitlines()[1:],
+                         ['4,20000', '5,15000', '6,20000'])